@@ -6,13 +6,17 @@ from datetime import datetime
 import os
 import statistics
 
-import sqlite3
+import pyarrow.dataset as ds
 
-from utils.tools import civ_map, map_id_lookup, execute_sql
+from utils.backends import set_backend
+from utils.tools import civ_map, execute_sql, map_id_lookup, stream_sql
 from utils.models import Player
+import utils.snapshot
 import utils.update
 
-DB = "data/ranked.db"
+# when directory is set, queries read the Parquet snapshot instead of the
+# database, filtered by the snapshot equivalents of their where clauses
+SNAPSHOT = {"directory": None}
 
 
 def week_before_last_rating():
@@ -20,7 +24,34 @@ def week_before_last_rating():
     return utils.update.last_match_time() - 7 * 24 * 60 * 60
 
 
-def standard_ratings(version, where=None):
+def snapshot_filters(version, where=None, filters=None, mirror=None):
+    """ Snapshot equivalent of the where clause shared by the queries.
+    filters: the snapshot expressions of where, one per condition """
+    if len(filters or []) != len(where or []):
+        raise ValueError("Every where condition needs a snapshot filter")
+    filters = [
+        ds.field("civ_id").is_valid(),
+        ds.field("version").isin(versions(version)),
+    ] + list(filters or [])
+    if mirror is not None:
+        filters.append(ds.field("mirror") == mirror)
+    return filters
+
+
+def snapshot_grouped(keys, aggregations, filters):
+    """ GROUP BY over the snapshot."""
+    return utils.snapshot.grouped(
+        keys, aggregations, filters, SNAPSHOT["directory"]
+    )
+
+
+def add_condition(where, filters, sql, expression):
+    """ Adds a condition to both the sql where clauses and the snapshot filters."""
+    where.append(sql)
+    filters.append(expression)
+
+
+def standard_ratings(version, where=None, filters=None):
     """ Returns lower and upper bounds of stdev of elo ratings.
         Assumes highest rating of a user is most accurate.
         Only really makes sense if rating_type is in query."""
@@ -32,10 +63,13 @@ def standard_ratings(version, where=None):
                       GROUP BY player_id"""
     sql = sql_from_template(sql_template, version, where)
 
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    elos = [x[0] for x in cur.execute(sql).fetchall()]
-    conn.close()
+    if SNAPSHOT["directory"]:
+        filters = snapshot_filters(version, where, filters)
+        filters.append(ds.field("rating").is_valid())
+        rows = snapshot_grouped(["player_id"], [("rating", "max")], filters)
+        elos = [x[1] for x in rows]
+    else:
+        elos = [x[0] for x in execute_sql(sql)]
     if not elos:
         return 0, 0
     mean = statistics.mean(elos)
@@ -43,7 +77,7 @@ def standard_ratings(version, where=None):
     return mean - std, mean + std
 
 
-def most_popular_player(version, where=None):
+def most_popular_player(version, where=None, filters=None):
     """ Returns number of players and an array of
         civ name:player-preference-units in order of descending popularity."""
 
@@ -52,12 +86,17 @@ def most_popular_player(version, where=None):
                       GROUP BY player_id, civ_id"""
     sql = sql_from_template(sql_template, version, where)
 
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
     players = defaultdict(Player)
-    for row in cur.execute(sql).fetchall():
+    if SNAPSHOT["directory"]:
+        rows = snapshot_grouped(
+            ["player_id", "civ_id"],
+            [("*", "count")],
+            snapshot_filters(version, where, filters),
+        )
+    else:
+        rows = execute_sql(sql)
+    for row in rows:
         players[row[0]].add_civ_use(row[1], row[2])
-    conn.close()
     data = Counter()
     cmap = civ_map()
     for player in players.values():
@@ -66,7 +105,7 @@ def most_popular_player(version, where=None):
     return len(players), data
 
 
-def most_popular_match(version, where=None):
+def most_popular_match(version, where=None, filters=None):
     """ Returns an array of civ name:number of plays in order of descending
 popularity."""
     sql_template = """SELECT civ_id, COUNT(*) as cnt FROM matches
@@ -74,33 +113,41 @@ popularity."""
                       GROUP BY civ_id"""
     sql = sql_from_template(sql_template, version, where)
 
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+    if SNAPSHOT["directory"]:
+        rows = snapshot_grouped(
+            ["civ_id"], [("*", "count")], snapshot_filters(version, where, filters)
+        )
+    else:
+        rows = execute_sql(sql)
     data = Counter()
     cmap = civ_map()
     total = 0.0
-    for row in cur.execute(sql).fetchall():
+    for row in rows:
         total += row[1]
         data[cmap[row[0]]] = row[1]
-    conn.close()
     return total, data
 
 
-def win_rates_player(version, where=None):
+def win_rates_player(version, where=None, filters=None):
     """ Returns an array of civ name: win percentage in order of
         descending wins. """
     sql_template = """ SELECT player_id, civ_id, won, COUNT(*) as cnt FROM matches
                        WHERE civ_id IS NOT NULL AND version in ({}){}
-                       AND mirror = 0
+                       AND mirror = false
                        GROUP BY player_id, civ_id, won"""
     sql = sql_from_template(sql_template, version, where)
 
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+    if SNAPSHOT["directory"]:
+        rows = snapshot_grouped(
+            ["player_id", "civ_id", "won"],
+            [("*", "count")],
+            snapshot_filters(version, where, filters, mirror=False),
+        )
+    else:
+        rows = execute_sql(sql)
     players = defaultdict(Player)
-    for row in cur.execute(sql).fetchall():
+    for row in rows:
         players[row[0]].add_civ_win(row[1], row[2], row[3])
-    conn.close()
     total_win_rate(players)
     cmap = civ_map()
     win_calculator = defaultdict(list)
@@ -142,25 +189,30 @@ def total_win_rate(players):
     )
 
 
-def win_rates_match(version, where=None):
+def win_rates_match(version, where=None, filters=None):
     """ Returns an array of civ name: win percentage in order of
         descending wins. """
     sql_template = """ SELECT civ_id, won, COUNT(*) as cnt FROM matches
                        WHERE civ_id IS NOT NULL AND version in ({}){}
-                       AND mirror = 0
+                       AND mirror = false
                        GROUP BY civ_id, won"""
     sql = sql_from_template(sql_template, version, where)
 
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+    if SNAPSHOT["directory"]:
+        rows = snapshot_grouped(
+            ["civ_id", "won"],
+            [("*", "count")],
+            snapshot_filters(version, where, filters, mirror=False),
+        )
+    else:
+        rows = execute_sql(sql)
 
     civs = defaultdict(dict)
     total = 0
-    for row in cur.execute(sql).fetchall():
+    for row in rows:
         civ, won, count = row
         total += count
         civs[civ][won] = count
-    conn.close()
 
     cmap = civ_map()
     civ_percentages = Counter()
@@ -171,7 +223,17 @@ def win_rates_match(version, where=None):
 
 def sql_from_template(template, version, where_array):
     """ Formats template with standard variables."""
-    return template.format(version, where_array_to_sql(where_array))
+    return template.format(version_list(version), where_array_to_sql(where_array))
+
+
+def versions(version):
+    """ Splits comma-delimited versions into a list of stripped strings."""
+    return [x.strip() for x in str(version).split(",")]
+
+
+def version_list(version):
+    """ Quotes comma-delimited versions for "version in (...)"; version is text."""
+    return ", ".join("'{}'".format(x) for x in versions(version))
 
 
 def where_array_to_sql(where):
@@ -181,12 +243,12 @@ def where_array_to_sql(where):
     return "".join([" AND {}".format(x) for x in where])
 
 
-def collate_win_rates(version, where=None):
+def collate_win_rates(version, where=None, filters=None):
     """ Returns map of civilizations to map of popularity attributes """
 
     civ_data = defaultdict(dict)
-    player_total, player_popularity = win_rates_player(version, where)
-    match_total, match_popularity = win_rates_match(version, where)
+    player_total, player_popularity = win_rates_player(version, where, filters)
+    match_total, match_popularity = win_rates_match(version, where, filters)
     print("Total players: {:7d}".format(int(player_total)))
     print("Total matches: {:7d}".format(int(match_total)))
     rank = 0
@@ -205,12 +267,12 @@ def collate_win_rates(version, where=None):
     return civ_data
 
 
-def collate_popularities(version, where=None):
+def collate_popularities(version, where=None, filters=None):
     """ Returns map of civilizations to map of popularity attributes """
 
     civ_data = defaultdict(dict)
-    player_total, player_popularity = most_popular_player(version, where)
-    match_total, match_popularity = most_popular_match(version, where)
+    player_total, player_popularity = most_popular_player(version, where, filters)
+    match_total, match_popularity = most_popular_match(version, where, filters)
 
     print("Total players: {:7d}".format(int(player_total)))
     print("Total matches: {:7d}".format(int(match_total)))
@@ -235,26 +297,28 @@ def collate_popularities(version, where=None):
 
 def latest_version():
     """ Returns latest version available in db. """
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+    if SNAPSHOT["directory"]:
+        versions = utils.snapshot.distinct("version", (), SNAPSHOT["directory"])
+        rows = [(x,) for x in versions]
+    else:
+        rows = execute_sql("SELECT DISTINCT version FROM matches")
     version = 0
-    for row in cur.execute("SELECT DISTINCT version FROM matches").fetchall():
+    for row in rows:
         current_version = row[0]
         if not current_version:
             continue
         if int(current_version) > version:
             version = int(current_version)
-    conn.close()
     print("Version:", version)
     return version
 
 
-def display(metric, version, where, cap):
+def display(metric, version, where, cap, filters=None):
     """ Print table of data. """
     if metric == "popularity":
-        civ_data = collate_popularities(version, where)
+        civ_data = collate_popularities(version, where, filters)
     elif metric == "winrate":
-        civ_data = collate_win_rates(version, where)
+        civ_data = collate_win_rates(version, where, filters)
 
     print("Civilization   : Player :  Match : Diff")
 
@@ -321,6 +385,10 @@ def run():
         "-noelo", action="store_true", help="Data from players with no elo"
     )
     parser.add_argument("-n", type=int, help="Max number of civs to show")
+    parser.add_argument("--snapshot", help="Read this Parquet snapshot directory")
+    parser.add_argument(
+        "--backend", help="Database backend, e.g. sqlite:data/ranked.db"
+    )
 
     parser.add_argument(
         "-no-unrated",
@@ -333,56 +401,106 @@ def run():
         help="Matches where one or both players have no elo",
     )
     args = parser.parse_args()
+    if args.backend:
+        set_backend(args.backend)
+    SNAPSHOT["directory"] = args.snapshot
     version = args.v or latest_version()
     where = []
+    filters = []
+    game_type = ds.field("game_type")
+    team_size = ds.field("team_size")
+    rating = ds.field("rating")
     if args.query == "1v1":
-        where.append("game_type = 0 AND team_size = 1")
+        add_condition(
+            where,
+            filters,
+            "game_type = 0 AND team_size = 1",
+            (game_type == 0) & (team_size == 1),
+        )
     elif args.query == "team":
-        where.append("game_type = 0 AND team_size > 1")
+        add_condition(
+            where,
+            filters,
+            "game_type = 0 AND team_size > 1",
+            (game_type == 0) & (team_size > 1),
+        )
 
     if args.m:
-        where.append("map_type = {}".format(map_ids[args.m]))
+        add_condition(
+            where,
+            filters,
+            "map_type = {}".format(map_ids[args.m]),
+            ds.field("map_type") == int(map_ids[args.m]),
+        )
 
     if args.w:
-        where.append("started > {}".format(week_before_last_rating()))
+        started = week_before_last_rating()
+        add_condition(
+            where,
+            filters,
+            "started > {}".format(started),
+            ds.field("started") > started,
+        )
 
     if args.noelo:
-        where.append("rating IS NULL")
+        add_condition(where, filters, "rating IS NULL", rating.is_null())
     if args.gelo:
-        where.append("rating > {}".format(args.gelo))
+        add_condition(
+            where, filters, "rating > {}".format(args.gelo), rating > args.gelo
+        )
     elif args.lelo:
-        where.append("rating < {}".format(args.lelo))
+        add_condition(
+            where, filters, "rating < {}".format(args.lelo), rating < args.lelo
+        )
     elif args.lowelo:
-        low, _ = standard_ratings(version, where)
+        low, _ = standard_ratings(version, where, filters)
         print("All elos below {}".format(int(low)))
-        where.append("rating < {}".format(low))
+        add_condition(where, filters, "rating < {}".format(low), rating < low)
     elif args.midelo:
-        low, high = standard_ratings(version, where)
+        low, high = standard_ratings(version, where, filters)
         print("All elos between {} and {}".format(int(low), int(high)))
-        where.append("rating BETWEEN {} AND {}".format(low, high))
+        add_condition(
+            where,
+            filters,
+            "rating BETWEEN {} AND {}".format(low, high),
+            (rating >= low) & (rating <= high),
+        )
     elif args.highelo:
-        _, high = standard_ratings(version, where)
+        _, high = standard_ratings(version, where, filters)
         print("All elos above {}".format(int(high)))
-        where.append("rating > {}".format(high))
+        add_condition(where, filters, "rating > {}".format(high), rating > high)
 
+    if args.unrated or args.no_unrated:
+        unrated = []
+        if SNAPSHOT["directory"]:
+            unrated = utils.snapshot.distinct(
+                "match_id", [rating.is_null()], SNAPSHOT["directory"]
+            )
+        unrated_match = ds.field("match_id").isin(unrated)
     if args.unrated:
-        where.append(
-            "match_id IN (SELECT DISTINCT match_id FROM matches WHERE rating IS NULL)"
+        add_condition(
+            where,
+            filters,
+            "match_id IN (SELECT DISTINCT match_id FROM matches WHERE rating IS NULL)",
+            unrated_match,
         )
     if args.no_unrated:
-        where.append(
-            "match_id NOT IN (SELECT match_id FROM matches WHERE rating IS NULL)"
+        add_condition(
+            where,
+            filters,
+            "match_id NOT IN (SELECT match_id FROM matches WHERE rating IS NULL)",
+            ~unrated_match,
         )
     cap = args.n or 0
 
-    display(args.metric, version, where, cap)
+    display(args.metric, version, where, cap, filters)
 
 
 def missing_days():
     """ Print ranges with more than 1 day between matches."""
     sql = "SELECT DISTINCT started from matches ORDER BY started"
     last_match_time = None
-    for (started,) in execute_sql(sql):
+    for (started,) in stream_sql(sql):
         if last_match_time:
             if started - last_match_time > 86400:
                 d = datetime.fromtimestamp(last_match_time)
@@ -1,136 +1,43 @@
 #!/usr/bin/env python
 """ Analyzes win rates based on game length."""
-from collections import defaultdict
+from argparse import ArgumentParser
+from datetime import datetime, timezone
 
-
-from statistics import mean, StatisticsError
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
+import numpy as np
+
+from utils import glwr
+from utils.tools import civ_map, map_name_lookup
+
+STARTED_RANGE = (1633406443, 1637110800)
 
 
-from utils.tools import civ_map, execute_sql
-
-
-class Match:
-    """ Holds information about a match."""
-
-    def __init__(self, row):
-        self.match_id = row[0]
-        self.started = row[1]
-        self.finished = row[2]
-        self.won = row[3]
-        self.civ_id = row[4]
-        self.rating = row[5] or 0
-
-    @property
-    def match_length(self):
-        """ How many seconds the match lasted."""
-        return self.finished - self.started
-
-    @property
-    def bucket(self):
-        """ Which analytical bucket this match belongs in."""
-        l = self.match_length
-        if l < 776:  # 22 game minutes
-            return 0
-        if l < 1306:  # 37 game minutes
-            return 1
-        if l < 2118:  # 60 game minutes
-            return 2
-        return 3
-
-
-class Player:
-    """ Holds player matches."""
-
-    def __init__(self):
-        self.matches = []
-
-    def win_average(self, civ_id, bucket):
-        """ Returns the win average for this player
-playing this civ in this bucket.
-
-Throws StatisticsError if no match."""
-        tally = []
-        for match in self.matches:
-            if match.civ_id == civ_id and match.bucket == bucket:
-                tally.append(match.won)
-        return mean(tally)
-
-    @property
-    def high_lever(self):
-        for match in self.matches:
-            if match.rating > 1650:
-                return True
-        return False
-
-
-class Civ:
-    """ Holds aggregate match information for a civ."""
-
-    def __init__(self, civ_id):
-        self.civ_id = civ_id
-        self.matches = []
-        self.players = set()
-
-    def bucket_counts(self):
-        """ Returns a dictionary of
-win percentage of matches in each bucket."""
-        buckets = defaultdict(list)
-        for match in self.matches:
-            buckets[match.bucket].append(match.won)
-        avg = mean([m.won for m in self.matches])
-        display = {}
-        for name in ("SHORT", "MEDIUM", "LONG", "VERY LONG"):
-            display[name] = int(1000 * (avg - mean(buckets[name])))
-        return display
-
-    def axes(self):
-        """ Returns axes for plotting"""
-        data = defaultdict(list)
-        for player in self.players:
-            for bucket in range(4):
-                try:
-                    average = player.win_average(self.civ_id, bucket)
-                    data[bucket].append(average)
-                except StatisticsError:
-                    pass
-        x_values = []
-        y_values = []
-        for i in range(4):
-            x_values.append(i)
-            y_values.append(mean(data[i]))
-
-        return x_values, y_values, mean([m.won for m in self.matches])
-
-
-def loaded_civs():
-    """ Builds all the civs for later plotting."""
+def loaded_civs(
+    start=STARTED_RANGE[0],
+    end=STARTED_RANGE[1],
+    map_type=glwr.ARABIA,
+    elo=(None, None),
+    directory=None,
+    refresh=False,
+):
+    """ Returns {civ name: CivAxes} for 1v1 matches on map_type, from the
+    database or the Parquet snapshot in directory. """
     cmap = civ_map()
-    civs = {}
-    players = defaultdict(Player)
-    sql = """
-    SELECT match_id, started, finished, won, civ_id, rating, player_id
-FROM matches
-WHERE game_type = 0
-AND map_type = 9
-AND team_size = 1
-and started BETWEEN 1633406443 AND 1637110800
-"""
-    for row in execute_sql(sql):
-        match = Match(row)
-        # If it is less than 6 minutes, it was probably civ-unrelated
-        # Dark Age shenanigans or rage quitting.
-        if match.match_length < 353:
-            continue
-        name = cmap[row[4]]
-        if name not in civs:
-            civs[name] = Civ(row[4])
-        player = players[row[6]]
-        civs[name].players.add(player)
-        player.matches.append(match)
-        civs[name].matches.append(match)
-    return civs
+    civs = glwr.tallies(start, end, map_type, elo, directory, refresh).civs()
+    return {cmap[civ_id]: civ for civ_id, civ in civs.items()}
+
+
+def elo_label(elo):
+    """ "All Elos", "1650+", "Below 1200" or "1200-1650"."""
+    low, high = elo
+    if low is None and high is None:
+        return "All Elos"
+    if high is None:
+        return "{}+".format(low)
+    if low is None:
+        return "Below {}".format(high)
+    return "{}-{}".format(low, high)
 
 
 def all_civs_legend(legend):
@@ -162,10 +69,10 @@ Windows are 10% above and below average.""",
     )
 
 
-def plot_all_civs(civs, filename="tmp/glwr.png"):
+def plot_all_civs(civs, filename="tmp/glwr.png", title="Arabia\nAll Elos"):
     """ Plots a gamelengthwinrate chart with all civs on it."""
     fig, axs = plt.subplots(4, 10)
-    fig.suptitle("Win Rates vs Game Length on Arabia\nAll Elos", fontsize=24)
+    fig.suptitle("Win Rates vs Game Length on {}".format(title), fontsize=24)
     legend = axs[3, 9]
     all_civs_legend(legend)
 
@@ -182,7 +89,7 @@ def plot_all_civs(civs, filename="tmp/glwr.png"):
         column = index - row * 10
         civ_axs = axs[row, column]
         x_values, y_values, average = civ.axes()
-        yaverage = mean(y_values)
+        yaverage = np.nanmean(y_values)
         civ_axs.plot(
             x_values,
             [0.5 - average for _ in y_values],
@@ -212,7 +119,7 @@ def plot_civ(civ, dirname="tmp"):
     fig = plt.figure()
     fig.set_size_inches(2, 1.5)
     x_values, y_values, average = civ.axes()
-    yaverage = mean(y_values)
+    yaverage = np.nanmean(y_values)
     plt.plot(
         x_values,
         [0.5 - average for _ in y_values],
@@ -235,15 +142,37 @@ def plot_civ(civ, dirname="tmp"):
         plt.show()
 
 
+def timestamp(day):
+    """ Seconds since the epoch of a YYYY-MM-DD day (UTC)."""
+    return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+
 def run():
     """ Global variable hider."""
+    parser = ArgumentParser()
+    parser.add_argument("--snapshot", help="Read this Parquet snapshot directory")
+    parser.add_argument("--start", help="First day (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last day (YYYY-MM-DD), exclusive")
+    parser.add_argument("--map", type=int, default=glwr.ARABIA, help="map_type")
+    parser.add_argument("--elo-min", type=int, help="Lowest rating counted")
+    parser.add_argument("--elo-max", type=int, help="Ratings counted are below this")
+    parser.add_argument(
+        "--civs", action="store_true", help="Also plot each civ on its own"
+    )
+    parser.add_argument(
+        "--refresh", action="store_true", help="Recompute the cached tallies"
+    )
+    args = parser.parse_args()
     dirname = "tmp"
-    civs = loaded_civs()
-    for civ in civs.values():
-        if False:
+    start = timestamp(args.start) if args.start else STARTED_RANGE[0]
+    end = timestamp(args.end) - 1 if args.end else STARTED_RANGE[1]
+    elo = (args.elo_min, args.elo_max)
+    civs = loaded_civs(start, end, args.map, elo, args.snapshot, args.refresh)
+    if args.civs:
+        for civ in civs.values():
             plot_civ(civ, dirname)
-
-    plot_all_civs(civs)
+    title = "{}\n{}".format(map_name_lookup()[args.map], elo_label(elo))
+    plot_all_civs(civs, title=title)
 
 
 if __name__ == "__main__":
@@ -81,3 +81,61 @@ scorer text
 );
 CREATE UNIQUE INDEX player_score_index
 ON scores(player_url, scorer, evaluation_date);
+
+CREATE TABLE public.dirty_weeks (
+    week text primary key,
+    marked timestamptz DEFAULT clock_timestamp()
+);
+
+CREATE TABLE public.weekly_facts (
+    week text,
+    civ_id smallint,
+    map_type smallint,
+    team_size smallint,
+    game_type smallint,
+    rating_band smallint,
+    won boolean,
+    mirror boolean,
+    cnt integer,
+    PRIMARY KEY(week, civ_id, map_type, team_size, game_type, rating_band, won, mirror)
+);
+
+CREATE TABLE public.streaks (
+    week text,
+    civ_id text,
+    team_size text,
+    map_category text,
+    methodology text,
+    metric text,
+    compound boolean,
+    rank smallint,
+    level_since text,
+    top_5_weeks smallint,
+    year_top_5 smallint,
+    PRIMARY KEY(week, civ_id, team_size, map_category, methodology, metric, compound)
+);
+
+CREATE TABLE public.weekly_sketches (
+    week text,
+    map_type smallint,
+    team_size smallint,
+    game_type smallint,
+    rating_band smallint,
+    counted text,
+    registers bytea,
+    PRIMARY KEY(week, map_type, team_size, game_type, rating_band, counted)
+);
+
+CREATE TABLE public.schema_migrations (
+    name text primary key,
+    applied timestamptz DEFAULT now()
+);
+
+CREATE INDEX matches_started_brin ON matches USING brin (started);
+CREATE INDEX matches_player_started ON matches (player_id, started);
+CREATE INDEX matches_ranked_started
+ON matches (started, team_size, map_type) WHERE game_type = 0;
+CREATE INDEX matches_ranked_1v1_player
+ON matches (player_id, started) WHERE game_type = 0 AND team_size = 1;
+CREATE INDEX results_week_category
+ON results (week, team_size, map_category, methodology, metric);
@@ -3,35 +3,24 @@
 from argparse import ArgumentParser
 from collections import Counter, defaultdict
 from datetime import datetime, timedelta, timezone
-import json
 
 from analyze import latest_version
 
 import utils.map_pools
+from utils.cardinality import distinct_estimate, sketch_counts
 from utils.models import Player
-from utils.tools import execute_sql, last_time_breakpoint
+from utils.reference import reference_data
+from utils.tools import execute_sql, last_time_breakpoint, map_name_lookup
 
 
 def map_map():
-    """ Generates dict for mapping civ id to civ name. """
-    cmap = defaultdict(lambda: "UNKNOWN")
-    with open("data/strings.json") as f:
-        data = json.load(f)
-    for civ_info in data["map_type"]:
-        cmap[civ_info["id"]] = civ_info["string"]
-
-    return cmap
+    """ Generates dict for mapping map id to map name. """
+    return map_name_lookup()
 
 
 def board_map():
     """ Generates dict for mapping board id to board name. """
-    bmap = {}
-    with open("data/strings.json") as f:
-        data = json.load(f)
-    for civ_info in data["rating_type"]:
-        bmap[civ_info["id"]] = civ_info["string"]
-
-    return bmap
+    return reference_data().rating_types
 
 
 def timestamp_to_day(timestamp):
@@ -66,6 +55,22 @@ def show_maps_player_info(where):
         )
 
 
+def show_maps_player_estimate(where):
+    """ Display table of how many distinct players played each map, estimated
+    from the weekly sketches. where: conditions on the sketch keys """
+    mmap = map_map()
+    total = distinct_estimate("player_id", where)
+    counts = Counter()
+    for map_type, count in sketch_counts("player_id", ["map_type"], where):
+        counts[mmap[map_type]] = count
+    for map_name, count in counts.most_common():
+        print(
+            "{:30} : {:7.0f}: ({:2.0f}%)".format(
+                map_name, count, (100.0 * count) / (total or 1)
+            )
+        )
+
+
 def show_maps_match_info(where):
     """ Display table of map popularity information by match. """
     mmap = map_map()
@@ -156,6 +161,12 @@ if __name__ == "__main__":
         "-r", choices=("1v1", "team"), help="Limit to ranked 1v1 or team"
     )
 
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="With -p, estimate distinct players per map from the weekly sketches",
+    )
+
     parser.add_argument("--pool", help="Limit to latest map pool")
     parser.add_argument("--pools", action="store_true", help="list pools")
 
@@ -163,6 +174,8 @@ if __name__ == "__main__":
 
     version = args.v or latest_version()
     where_list = []
+    # the same conditions on the weekly_sketches keys
+    sketch_where = []
 
     if args.w:
         last_wednesday = last_time_breakpoint(datetime.now())
@@ -170,12 +183,14 @@ if __name__ == "__main__":
 
         end = (last_wednesday + timedelta(days=7)).timestamp()
         where_list.append("started BETWEEN {:0.0f} AND {:0.0f}".format(start, end))
+        sketch_where.append("week = '{}'".format(last_wednesday.strftime("%Y%m%d")))
     if args.r and args.pool:
         if args.pool == "latest":
             pool_list = utils.map_pools.latest(args.r)
         else:
             pool_list = utils.map_pools.pool(args.r, args.pool)
         where_list.append("map_type in ({})".format(pool_list))
+        sketch_where.append("map_type in ({})".format(pool_list))
         if not args.w:
             start = last_time_breakpoint(
                 datetime.strptime(args.pool, "%Y%m%d")
@@ -186,16 +201,26 @@ if __name__ == "__main__":
                     start.timestamp(), end.timestamp()
                 )
             )
+            sketch_where.append(
+                "week IN ('{}', '{}')".format(
+                    start.strftime("%Y%m%d"),
+                    (start + timedelta(days=7)).strftime("%Y%m%d"),
+                )
+            )
     if args.r == "1v1":
         where_list.append("game_type = 0 and team_size = 1")
+        sketch_where.append("game_type = 0 and team_size = 1")
     elif args.r == "team":
         where_list.append("game_type = 0 and team_size > 1")
+        sketch_where.append("game_type = 0 and team_size > 1")
 
     if args.versions:
         show_versions()
 
     if args.maps:
-        if args.p:
+        if args.p and args.approximate:
+            show_maps_player_estimate(sketch_where)
+        elif args.p:
             show_maps_player_info(where_list)
         else:
             show_maps_match_info(where_list)
@@ -2,16 +2,9 @@
 """ Writes out map popularity of last two pools."""
 from datetime import datetime, timedelta
 
-from utils.map_pools import map_type_filter, pools
-from utils.tools import execute_sql, last_time_breakpoint, map_name_lookup
-
-SQL = """SELECT map_type, COUNT(*) as cnt
-FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-{}
-AND team_size = {}
-GROUP BY map_type
-ORDER BY cnt DESC"""
+from utils.facts import ensure_facts, fact_counts
+from utils.map_pools import map_type_condition, pools
+from utils.tools import last_time_breakpoint, map_name_lookup
 
 
 def run():
@@ -27,12 +20,20 @@ def run():
             month = int(week[4:6])
             day = int(week[6:])
             start = last_time_breakpoint(datetime(year, month, day))
-            end = start + timedelta(days=14)
-            sql = SQL.format(
-                start.timestamp(), end.timestamp(), map_type_filter(week, size), size
-            )
+            fact_weeks = [
+                (start + timedelta(days=7 * offset)).strftime("%Y%m%d")
+                for offset in range(2)
+            ]
+            ensure_facts(fact_weeks)
+            where = [
+                "week IN ('{}')".format("', '".join(fact_weeks)),
+                map_type_condition(week, size),
+                "team_size = {}".format(size),
+            ]
             total = 0
-            for map_type, count in execute_sql(sql):
+            for map_type, count in sorted(
+                fact_counts(("map_type",), where), key=lambda row: -row[1]
+            ):
                 week_info.append((map_names[map_type], count,))
                 total += count
             hold = []
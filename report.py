@@ -5,28 +5,9 @@ from collections import defaultdict
 from datetime import datetime, timedelta
 
 from utils.tools import civ_map, execute_sql, last_time_breakpoint
+from utils.trends import results_query
 
-QUERIES = {
-    "popularity": """SELECT civ_id, pct, rank, sample_size FROM results
-                           WHERE week = "{}"
-                           {}
-                           AND methodology = "{}"
-                           AND metric = "popularity"
-                           AND compound = {}
-    """,
-    "win_rates": """SELECT civ_id, pct, rank, sample_size FROM results
-                           WHERE week = "{}"
-                           {}
-                           AND methodology = "{}"
-                           AND metric = "winrate"
-    """,
-    "bottom_win_rates": """SELECT civ_id, pct, rank, sample_size FROM results
-                           WHERE week = "{}"
-                           {}
-                           AND methodology = "{}"
-                           AND metric = "bottom_winrate"
-    """,
-}
+CATEGORIES = ("All", "Arabia", "Arena", "Others")
 
 
 class CivDict(defaultdict):
@@ -53,12 +34,7 @@ class CivDict(defaultdict):
 def build_category_filters(team_size):
     """ Generate category_filters because easier."""
     category_filters = {}
-    for category in (
-        "All",
-        "Arabia",
-        "Arena",
-        "Others",
-    ):
+    for category in CATEGORIES:
         category_filters[
             "{} {}".format(team_size, category)
         ] = "AND map_category = '{}' AND team_size = '{}'".format(category, team_size)
@@ -138,31 +114,25 @@ class Civilization:
         )
 
 
-def filters(label):
-    """ Generates additional "where" conditions for query """
-    team_size = label.split()[0]
-    return build_category_filters(team_size)[label]
-
-
-def most_popular(civs, week_index, week, category, methodology, compound):
-    """ Loads civs with most popular by match for given week. """
-    sql = QUERIES["popularity"].format(week, filters(category), methodology, compound)
-    for civ_id, pct, rank, _ in execute_sql(sql):
-        civ = civs[civ_id]
-        week = civ.week_by_index(week_index)
-        week.popularity_pcts[category] = pct
-        week.popularity_ranks[category] = rank
-
-
-def winrate(civs, week_index, week, category, methodology, bottom):
-    """ Loads civs with winrate data based on matches. """
-    key = "bottom_win_rates" if bottom else "win_rates"
-    sql = QUERIES[key].format(week, filters(category), methodology)
-    for civ_id, pct, rank, _ in execute_sql(sql):
-        civ = civs[civ_id]
-        week = civ.week_by_index(week_index)
-        week.winrate_pcts[category] = pct
-        week.winrate_ranks[category] = rank
+def load_results(civs, weeks, team_size, methodology, metrics, compound):
+    """ Loads civs with the popularity and win rate results of weeks
+    (in week_by_index order) in one round-trip.
+    metrics: results metrics, e.g. ("popularity", "winrate") """
+    sql, values = results_query(
+        weeks, team_size, CATEGORIES, methodology, metrics, compound
+    )
+    week_indexes = {week: index for index, week in enumerate(weeks)}
+    for week, map_category, metric, civ_id, rank, pct in execute_sql(
+        sql, values=values
+    ):
+        category = "{} {}".format(team_size, map_category)
+        info = civs[civ_id].week_by_index(week_indexes[week])
+        if metric == "popularity":
+            info.popularity_pcts[category] = pct
+            info.popularity_ranks[category] = rank
+        else:
+            info.winrate_pcts[category] = pct
+            info.winrate_ranks[category] = rank
 
 
 class ReportManager:
@@ -192,16 +162,19 @@ class ReportManager:
         last_wednesday = last_time_breakpoint(endtime)
         last_week = (last_wednesday - timedelta(days=14)).strftime("%Y%m%d")
         this_week = (last_wednesday - timedelta(days=7)).strftime("%Y%m%d")
-        for idx, timebox in enumerate((last_week, this_week,)):
-            for category in self.categories:
-                if not self.args.w:
-                    most_popular(
-                        self.civs, idx, timebox, category, methodology, self.args.c
-                    )
-                if not self.args.p:
-                    winrate(
-                        self.civs, idx, timebox, category, methodology, self.args.bottom
-                    )
+        metrics = []
+        if not self.args.w:
+            metrics.append("popularity")
+        if not self.args.p:
+            metrics.append("bottom_winrate" if self.args.bottom else "winrate")
+        load_results(
+            self.civs,
+            (last_week, this_week),
+            self.args.s,
+            methodology,
+            metrics,
+            self.args.c,
+        )
         return last_wednesday
 
     def display(self, report_date):
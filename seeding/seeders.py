@@ -12,6 +12,7 @@ from liquiaoe.managers import Tournament
 
 import utils.robo_atp
 from utils.identity import players_by_name
+from utils.ranking import DENSE_RANK, ranks
 from utils.tools import execute_sql, flatten, setup_logging
 
 LOGGER = setup_logging()
@@ -35,18 +36,9 @@ class Seeder:
     @property
     def ranked_partipants(self):
         if not self._ranks:
-            self._ranks = {}
-            participant_lookup = {}
-            for participant in self.participants:
-                participant_lookup[participant] = self.lookup[participant]
-            last_score = 0
-            last_rank = 0
-            for name in sorted(participant_lookup, key=lambda x: participant_lookup[x], reverse=True):
-                score = participant_lookup[name]
-                if score != last_score:
-                    last_rank += 1
-                    last_score = score
-                self._ranks[name] = last_rank
+            names = list(dict.fromkeys(self.participants))
+            scores = [self.lookup[name] for name in names]
+            self._ranks = dict(zip(names, ranks(scores, DENSE_RANK).tolist()))
         return self._ranks
         
     def load_others(self, others):
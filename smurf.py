@@ -2,7 +2,9 @@
 """ Finds the new users with big jumps in elo """
 from argparse import ArgumentParser
 from datetime import datetime, timedelta, timezone
+from itertools import groupby
 
+from utils.profiles import fetch_profiles, profile_cache
 from utils.tools import (
     civ_map,
     country_map,
@@ -10,7 +12,6 @@ from utils.tools import (
     map_name_lookup,
     last_time_breakpoint,
     timeboxes,
-    user_info,
 )
 
 
@@ -25,6 +26,57 @@ GROUP BY player_id
 HAVING COUNT(*) > 5 and max(rating) > 1699 AND MAX(rating) - MIN(rating) > 200
 """
 
+PLAYER_MATCHES_SQL = """
+SELECT player_id, rating, civ_id, map_type, started, won
+FROM matches
+WHERE civ_id IS NOT NULL
+AND game_type = 0 AND team_size = 1
+AND player_id = ANY(ARRAY[{}])
+AND started > {:0.0f}
+ORDER BY player_id, started
+"""
+
+FIRST_STARTED_SQL = """
+SELECT player_id, min(started)
+FROM matches
+WHERE player_id = ANY(ARRAY[{}])
+GROUP BY player_id
+"""
+
+# every player first seen in [start, end] on a ladder (rating_type), with
+# their first week on that ladder summarized
+FIRST_WEEK_SQL = """
+WITH first_seen AS (
+SELECT player_id, rating_type, MIN(started) AS first_started
+FROM matches
+WHERE rating_type IS NOT NULL {ladders}
+GROUP BY player_id, rating_type
+HAVING MIN(started) BETWEEN {start:0.0f} AND {end:0.0f}
+), first_week AS (
+SELECT m.player_id, m.rating_type, f.first_started, m.started, m.rating,
+m.won, m.civ_id, m.map_type,
+FIRST_VALUE(m.rating) OVER by_started AS first_rating,
+FIRST_VALUE(m.started) OVER by_rating AS peak_started
+FROM matches m
+JOIN first_seen f
+ON m.player_id = f.player_id AND m.rating_type = f.rating_type
+WHERE m.started < f.first_started + {week}
+AND m.rating IS NOT NULL
+WINDOW by_started AS (PARTITION BY m.player_id, m.rating_type ORDER BY m.started),
+by_rating AS (
+PARTITION BY m.player_id, m.rating_type ORDER BY m.rating DESC, m.started)
+)
+SELECT player_id, rating_type, first_started, MAX(peak_started),
+COUNT(*), MIN(first_rating), MIN(rating), MAX(rating),
+AVG(CAST(won AS INT)), COUNT(DISTINCT civ_id), COUNT(DISTINCT map_type)
+FROM first_week
+GROUP BY player_id, rating_type, first_started
+HAVING COUNT(*) > {games_over}
+AND MAX(rating) > {rating_over}
+AND MAX(rating) - MIN(rating) > {climb_over}
+ORDER BY MAX(rating) DESC
+"""
+
 WEEK_IN_SECONDS = 7 * 24 * 60 * 60
 COUNTRIES = country_map()
 
@@ -112,13 +164,31 @@ class WeekInfo:
         )
 
 
-class Smurf:
+class Profiled:
+    """ Username and country of a player, from their aoe2.net profile."""
+
+    username = None
+    country = ""
+
+    def set_profile(self, data):
+        """ Sets username and country from aoe2.net profile data."""
+        self.username = data["name"]
+        try:
+            if data["country"] in COUNTRIES:
+                self.country = COUNTRIES[data["country"]]
+            else:
+                self.country = data["country"]
+        except KeyError:
+            self.country = ""
+
+
+class Smurf(Profiled):
     """ Data holder for smurf-like player"""
 
-    def __init__(self, row, timebox):
+    def __init__(self, row, timebox, matches):
         self.start_cutoff, end_cutoff = timebox
         self.player_id = row[0]
-        week_info = self._best_week(end_cutoff)
+        week_info = self._best_week(end_cutoff, matches)
         if week_info:
             self.valid = True
             self.timebox = "{} - {}".format(
@@ -131,42 +201,17 @@ class Smurf:
             self.diff = week_info.diff
             self.map_types = week_info.map_types
             self.civ_ids = week_info.civ_ids
-            data = user_info(self.player_id)
-            self.username = data["name"]
-            try:
-                if data["country"] in COUNTRIES:
-                    self.country = COUNTRIES[data["country"]]
-                else:
-                    self.country = data["country"]
-            except KeyError:
-                self.country = ""
         else:
             self.valid = False
 
-    def validate(self, start_cutoff):
-        sql = """
-SELECT min(started)
-FROM matches
-WHERE player_id = {}""".format(self.player_id)
-        for started, in execute_sql(sql):
-            self.valid = started >= start_cutoff
+    def validate(self, start_cutoff, first_started):
+        """ Invalid if the player was seen before start_cutoff.
+        first_started: from first_started() """
+        self.valid = first_started[self.player_id] >= start_cutoff
 
-    def _best_week(self, end_cutoff):
-        sql = """
-SELECT rating, civ_id, map_type, started, won
-FROM matches
-WHERE civ_id IS NOT NULL
-AND game_type = 0 AND team_size = 1
-AND player_id = {}
-AND started > {:0.0f}
-ORDER BY started
-        """.format(
-            self.player_id,
-            self.start_cutoff
-        )
-        matches = []
-        for row in execute_sql(sql):
-            matches.append(Match(row))
+    def _best_week(self, end_cutoff, matches):
+        if not matches:
+            return None
         week_info = WeekInfo(matches[0].started, matches, end_cutoff)
         if week_info.valid(end_cutoff):
             return week_info
@@ -217,24 +262,164 @@ ORDER BY started
         )
 
 
+def id_array(player_ids):
+    """ Comma separated ids for ARRAY[...]."""
+    return ", ".join(str(int(player_id)) for player_id in player_ids)
+
+
+def player_matches(player_ids, start_cutoff):
+    """ Returns {player_id: [Match]} of 1v1 matches after start_cutoff,
+    ordered by started, for all player_ids in one query. """
+    if not player_ids:
+        return {}
+    sql = PLAYER_MATCHES_SQL.format(id_array(player_ids), start_cutoff)
+    histories = {}
+    for player_id, rows in groupby(execute_sql(sql), key=lambda row: row[0]):
+        histories[player_id] = [Match(row[1:]) for row in rows]
+    return histories
+
+
+def first_started(player_ids):
+    """ Returns {player_id: first started} for all player_ids in one query."""
+    if not player_ids:
+        return {}
+    return dict(execute_sql(FIRST_STARTED_SQL.format(id_array(player_ids))))
+
+
 def display(date_reference):
     """ Returns smurfs from past week."""
     wednesday = last_time_breakpoint(date_reference).timestamp()
     last_week, _ = timeboxes(wednesday)
     sql = SQL.format(last_week[0], wednesday)
+    rows = list(execute_sql(sql))
+    histories = player_matches([row[0] for row in rows], last_week[0])
+    candidates = [
+        Smurf(row, last_week, histories.get(row[0], [])) for row in rows
+    ]
+    candidates = [smurf for smurf in candidates if smurf.valid]
+    first_seen = first_started([smurf.player_id for smurf in candidates])
     smurfs = []
-    for row in execute_sql(sql):
-        smurf = Smurf(row, last_week)
+    for smurf in candidates:
+        smurf.validate(last_week[0], first_seen)
         if smurf.valid:
             smurfs.append(smurf)
+    profiles = fetch_profiles(
+        [smurf.player_id for smurf in smurfs], cache=profile_cache()
+    )
+    for smurf in smurfs:
+        smurf.set_profile(profiles[smurf.player_id])
     for smurf in sorted(smurfs, key=lambda x: x.max_rating, reverse=True):
         print(smurf)
 
+
+class FirstWeek(Profiled):
+    """ A player's first week on a ladder, from FIRST_WEEK_SQL."""
+
+    def __init__(self, row):
+        self.player_id = row[0]
+        self.rating_type = row[1]
+        self.first_started = row[2]
+        self.peak_started = row[3]
+        self.games_played = row[4]
+        self.first_rating = row[5]
+        self.min_rating = row[6]
+        self.max_rating = row[7]
+        self.win_pct = float(row[8])
+        self.civ_count = row[9]
+        self.map_count = row[10]
+
+    @property
+    def climb(self):
+        """ Rating gained from the first match to the peak."""
+        return self.max_rating - self.first_rating
+
+    def __str__(self):
+        first = datetime.fromtimestamp(self.first_started, tz=timezone.utc)
+        peak = datetime.fromtimestamp(self.peak_started, tz=timezone.utc)
+        return """{} ({}): https://aoe2.net/#profile-{}
+   Ladder: {:11}
+   First seen: {}
+   Peak: {:13}  after {}
+   Win Pct: {:10.0f}%
+   Games played: {:5}
+   Climb: {:12}
+   Number maps: {:6}
+   Number civs: {:6}
+""".format(
+            self.username,
+            self.country,
+            self.player_id,
+            self.rating_type,
+            first.strftime("%Y-%m-%d %H:%M"),
+            self.max_rating,
+            peak - first,
+            100 * self.win_pct,
+            self.games_played,
+            self.climb,
+            self.map_count,
+            self.civ_count,
+        )
+
+
+def first_weeks(
+    start,
+    end,
+    ladders=None,
+    games_over=5,
+    rating_over=RATING_CUTOFF - 1,
+    climb_over=200,
+):
+    """ Returns FirstWeeks of players first seen between start and end
+    (timestamps) who climbed fast, highest peak first.
+    ladders: rating_types to search (default all) """
+    ladder_filter = ""
+    if ladders:
+        ladder_filter = "AND rating_type IN ({})".format(
+            ", ".join(str(int(ladder)) for ladder in ladders)
+        )
+    sql = FIRST_WEEK_SQL.format(
+        ladders=ladder_filter,
+        start=start,
+        end=end,
+        week=WEEK_IN_SECONDS,
+        games_over=games_over,
+        rating_over=rating_over,
+        climb_over=climb_over,
+    )
+    return [FirstWeek(row) for row in execute_sql(sql)]
+
+
+def display_first_weeks(start, end, ladders):
+    """ Prints fast climbers first seen between start and end."""
+    climbers = first_weeks(start.timestamp(), end.timestamp(), ladders)
+    profiles = fetch_profiles(
+        [climber.player_id for climber in climbers], cache=profile_cache()
+    )
+    for climber in climbers:
+        climber.set_profile(profiles[climber.player_id])
+        print(climber)
+
+
 def run():
     """ Flow control function."""
     parser = ArgumentParser()
-    _ = parser.parse_args()
-    display(datetime.now())
+    parser.add_argument(
+        "--start",
+        help="Search players first seen from this YYYY-MM-DD (all ladders)",
+    )
+    parser.add_argument("--end", help="... up to this YYYY-MM-DD (default now)")
+    parser.add_argument(
+        "--ladder", type=int, action="append", help="rating_type to search"
+    )
+    args = parser.parse_args()
+    if not args.start:
+        display(datetime.now())
+        return
+    start = datetime.strptime(args.start, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    end = datetime.now(tz=timezone.utc)
+    if args.end:
+        end = datetime.strptime(args.end, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    display_first_weeks(start, end, args.ladder)
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+""" Fixtures shared by the tests."""
+from http.server import ThreadingHTTPServer
+import threading
+
+import pytest
+
+
+@pytest.fixture(name="stub_server")
+def fixture_stub_server(monkeypatch):
+    """ Starts local servers: stub_server(handler, module, path) serves handler
+    and points module.API_TEMPLATE at path on it. Returns the server."""
+    servers = []
+
+    def start(handler, module, path):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append(server)
+        monkeypatch.setattr(
+            module,
+            "API_TEMPLATE",
+            "http://127.0.0.1:{}".format(server.server_port) + path,
+        )
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
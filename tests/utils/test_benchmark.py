@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+""" Tests benchmark helpers."""
+
+from utils.benchmark import aggregate, regressions, renumbered, SyntheticMatches
+
+
+def test_synthetic_matches():
+    """ Tests generated rows are deterministic and internally consistent."""
+    rows = SyntheticMatches(seed=3).rows(200, 1000, 2000)
+    assert rows == SyntheticMatches(seed=3).rows(200, 1000, 2000)
+    matches = {}
+    for row in rows:
+        matches.setdefault(row[0], []).append(row)
+        assert 1000 <= row[4] < 2000
+    assert len(matches) == 200
+    for match_rows in matches.values():
+        team_size = match_rows[0][6]
+        assert len(match_rows) == 2 * team_size
+        assert sum(row[11] for row in match_rows) == team_size
+        mirror = len({row[9] for row in match_rows}) == 1
+        assert all(row[12] == mirror for row in match_rows)
+        assert len({row[8] for row in match_rows}) == len(match_rows)
+    assert aggregate(rows)
+
+
+def test_regressions():
+    """ Tests regression detection."""
+    baseline = {"aggregate": {"median": 1.0}, "load": {"median": 1.0}}
+    results = {"aggregate": {"median": 1.1}, "load": {"median": 1.5}}
+    messages = regressions(results, baseline, 0.2)
+    assert len(messages) == 1
+    assert messages[0].startswith("load")
+
+
+def test_renumbered():
+    """ Tests every run gets its own match ids."""
+    rows = SyntheticMatches(seed=3).rows(20, 1000, 2000)
+    first, second = renumbered(rows, 1), renumbered(rows, 2)
+    assert not {row[0] for row in first} & {row[0] for row in second}
+    assert [row[1:] for row in first] == [row[1:] for row in rows]
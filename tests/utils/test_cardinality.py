@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+""" Tests the HyperLogLog distinct count estimates."""
+import pytest
+
+from utils import backends, cardinality
+from utils.backends import SQLiteBackend
+from utils.benchmark import SyntheticMatches
+from utils.cardinality import HyperLogLog
+from utils.facts import week_of
+from utils.results_cacher import week_timebox
+from utils.update import CREATE_MATCH_TABLE, MATCH_COLUMNS
+
+WEEKS = ("20211027", "20211103")
+
+
+def test_estimates():
+    """ Estimates stay close for small and large sets."""
+    assert HyperLogLog().count() == 0
+    assert HyperLogLog().add(range(100)).count() == pytest.approx(100, rel=0.05)
+    large = HyperLogLog().add(range(200000))
+    assert large.count() == pytest.approx(200000, rel=0.05)
+    strings = HyperLogLog().add("match-{}".format(index) for index in range(5000))
+    assert strings.count() == pytest.approx(5000, rel=0.05)
+
+
+def test_merge_and_bytes():
+    """ A merge is the sketch of the union and survives serialization."""
+    first = HyperLogLog().add(range(0, 3000))
+    second = HyperLogLog().add(range(2000, 6000))
+    union = HyperLogLog().add(range(0, 6000))
+    merged = HyperLogLog.merged([first, second])
+    assert (merged.registers == union.registers).all()
+    small = HyperLogLog().add([1, 2, 3])
+    assert len(small.to_bytes()) < 20
+    for sketch in (small, merged):
+        copy = HyperLogLog.from_bytes(sketch.to_bytes())
+        assert (copy.registers == sketch.registers).all()
+    # the same values always land in the same registers
+    again = HyperLogLog().add(["1", "2", "3"])
+    assert (again.registers == small.registers).all()
+
+
+@pytest.fixture(name="rows")
+def fixture_rows(tmp_path, monkeypatch):
+    """ Synthetic matches for WEEKS on a SQLite backend."""
+    generator = SyntheticMatches(seed=6, players=3000)
+    rows = []
+    for index, week in enumerate(WEEKS):
+        start, end = week_timebox(week)
+        for row in generator.rows(2000, int(start), int(end)):
+            rows.append(("{}{}".format(index, row[0]),) + tuple(row[1:]))
+    backend = SQLiteBackend(str(tmp_path / "ranked.db"))
+    backend.transaction(CREATE_MATCH_TABLE, None)
+    backend.transaction(cardinality.CREATE_SKETCHES_TABLE, None)
+    backend.bulk_insert(
+        "INSERT INTO matches ({}) VALUES %s".format(MATCH_COLUMNS), rows
+    )
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    return rows
+
+
+def test_stored_sketches(rows):
+    """ Ingested batches, repeated or rebuilt, estimate the distinct counts."""
+    for offset in range(0, len(rows), 1500):
+        cardinality.add_rows(rows[offset : offset + 1500])
+    cardinality.add_rows(rows[:1500])
+    players = cardinality.distinct_estimate("player_id")
+    assert players == pytest.approx(len({row[8] for row in rows}), rel=0.05)
+    by_week = dict(
+        cardinality.sketch_counts("match_id", ["week"], ["team_size = 1"])
+    )
+    for week in WEEKS:
+        expected = {
+            row[0] for row in rows if row[6] == 1 and week_of(row[4]) == week
+        }
+        assert by_week[week] == pytest.approx(len(expected), rel=0.05)
+    columns = ["week", "map_type"]
+    before = sorted(cardinality.sketch_counts("player_id", columns))
+    cardinality.rebuild_sketches(WEEKS)
+    assert sorted(cardinality.sketch_counts("player_id", columns)) == before
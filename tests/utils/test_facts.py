@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+""" Tests weekly facts helpers."""
+from datetime import datetime, timezone
+
+import pytest
+
+from utils import backends, facts
+from utils.backends import SQLiteBackend
+from utils.facts import fact_counts, rating_band, week_of, UNKNOWN
+from utils.tools import last_time_breakpoint
+
+
+def test_week_of():
+    """ Tests week_of agrees with last_time_breakpoint."""
+    for day in range(1, 15):
+        for hour in (0, 1, 12):
+            now = datetime(2021, 11, day, hour, 30, tzinfo=timezone.utc)
+            breakpoint = last_time_breakpoint(now)
+            if breakpoint > now:
+                continue
+            assert week_of(int(now.timestamp())) == breakpoint.strftime("%Y%m%d")
+    wednesday = datetime(2021, 11, 3, 1, tzinfo=timezone.utc)
+    assert week_of(int(wednesday.timestamp())) == "20211103"
+    assert week_of(int(wednesday.timestamp()) - 1) == "20211027"
+
+
+def test_rating_band():
+    """ Tests rating bands."""
+    assert rating_band(None) == UNKNOWN
+    assert rating_band(1649) == 1600
+    assert rating_band(1650) == 1650
+
+
+def test_fact_counts_columns():
+    """ Tests unknown columns are refused."""
+    with pytest.raises(ValueError):
+        list(fact_counts(("player_id",)))
+
+
+def test_ensure_facts(tmp_path, monkeypatch):
+    """ Only weeks without facts are rebuilt."""
+    backend = SQLiteBackend(str(tmp_path / "facts.db"))
+    backend.transaction(facts.CREATE_FACTS_TABLE, None)
+    backend.bulk_insert(
+        "INSERT INTO weekly_facts VALUES %s", [("20211027", 1, 9, 1, 0, 1600, 1, 0, 3)]
+    )
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    rebuilt = []
+    monkeypatch.setattr(facts, "rebuild_facts", rebuilt.append)
+    facts.ensure_facts(["20211027", "20211103"])
+    assert rebuilt == [["20211103"]]
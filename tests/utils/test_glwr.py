@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+""" Tests the game length win rate tallies."""
+from collections import defaultdict
+from statistics import mean
+
+import numpy as np
+import pytest
+
+from utils import backends, glwr, snapshot
+from utils.backends import SQLiteBackend
+from utils.benchmark import SyntheticMatches
+from utils.results_cacher import week_timebox
+from utils.update import CREATE_MATCH_TABLE, MATCH_COLUMNS
+
+WEEK = "20211103"
+
+
+@pytest.fixture(name="rows")
+def fixture_rows():
+    """ Synthetic match rows for WEEK."""
+    start, end = week_timebox(WEEK)
+    return SyntheticMatches(seed=3, players=300).rows(3000, int(start), int(end))
+
+
+def expected_axes(rows, start, end, low=None):
+    """ The per-player averaging analyze_glwr did before the tallies."""
+    games = defaultdict(list)
+    for row in rows:
+        length = row[5] - row[4]
+        if (
+            row[7] != 0
+            or row[6] != 1
+            or row[1] != glwr.ARABIA
+            or not start <= row[4] <= end
+            or length < glwr.MIN_LENGTH
+            or (low is not None and (row[10] is None or row[10] < low))
+        ):
+            continue
+        bucket = sum(length >= edge for edge in glwr.BUCKET_EDGES)
+        games[row[9], row[8], bucket].append(row[11])
+    axes = {}
+    for civ_id in {key[0] for key in games}:
+        buckets = defaultdict(list)
+        matches = []
+        for (civ, _, bucket), won in games.items():
+            if civ == civ_id:
+                buckets[bucket].append(mean(won))
+                matches.extend(won)
+        y_values = [mean(buckets[b]) if buckets[b] else np.nan for b in range(4)]
+        axes[civ_id] = (y_values, mean(matches))
+    return axes
+
+
+def assert_axes(tallies, expected):
+    """ Tallies give the expected plot values for every civ."""
+    civs = tallies.civs()
+    assert set(civs) == set(expected)
+    for civ_id, (y_values, average) in expected.items():
+        x_found, y_found, average_found = civs[civ_id].axes()
+        assert x_found == [0, 1, 2, 3]
+        np.testing.assert_allclose(y_found, y_values)
+        assert average_found == pytest.approx(average)
+
+
+def test_snapshot_tallies(tmp_path, rows):
+    """ Tallies from the snapshot match averaging the rows."""
+    start, end = week_timebox(WEEK)
+    snapshot.write_week(WEEK, [rows], str(tmp_path / "matches"))
+    tallies = glwr.tallies(
+        start,
+        end,
+        directory=str(tmp_path / "matches"),
+        elo=(1000, None),
+        cache_dir=str(tmp_path / "glwr"),
+    )
+    assert len(tallies)
+    assert_axes(tallies, expected_axes(rows, start, end, 1000))
+
+
+def test_database_tallies(tmp_path, rows, monkeypatch):
+    """ Tallies from SQL match averaging the rows and are cached."""
+    start, end = week_timebox(WEEK)
+    backend = SQLiteBackend(str(tmp_path / "ranked.db"))
+    backend.transaction(CREATE_MATCH_TABLE, None)
+    backend.bulk_insert(
+        "INSERT INTO matches ({}) VALUES %s".format(MATCH_COLUMNS), rows
+    )
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    cache_dir = str(tmp_path / "glwr")
+    tallies = glwr.tallies(start, end, cache_dir=cache_dir)
+    assert_axes(tallies, expected_axes(rows, start, end))
+    backend.transaction("DELETE FROM matches", None)
+    cached = glwr.tallies(start, end, cache_dir=cache_dir)
+    np.testing.assert_array_equal(cached.games, tallies.games)
+    assert not len(glwr.tallies(start, end, cache_dir=cache_dir, refresh=True))
@@ -3,7 +3,7 @@
 from datetime import datetime, timedelta, timezone
 import pytest
 
-from utils.map_pools import map_type_filter
+from utils.map_pools import map_type_condition, map_type_filter
 
 
 def test_map_type():
@@ -21,3 +21,5 @@ def test_map_type():
         map_type_filter("20210920", 2)
         == "AND map_type in (9,12,29,31,33,77,114,140,166)"
     )
+    # bare condition
+    assert map_type_condition("20210922", 1) == "map_type in (9,23,29,71,77,140,167)"
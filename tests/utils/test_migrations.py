@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+""" Tests migration helpers."""
+from utils.migrations import MIGRATIONS, pending_migrations, sequential_scans
+
+
+def test_pending_migrations():
+    """ Tests applied migrations are skipped and order is kept."""
+    names = [name for name, _ in MIGRATIONS]
+    assert len(set(names)) == len(names)
+    assert names == sorted(names)
+    pending = pending_migrations({names[0]})
+    assert [name for name, _ in pending] == names[1:]
+    assert pending_migrations(set(names)) == []
+
+
+def test_sequential_scans():
+    """ Tests seq scans are found in nested plans."""
+    plan = {
+        "Node Type": "Aggregate",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "matches"},
+            {
+                "Node Type": "Hash",
+                "Plans": [
+                    {"Node Type": "Index Scan", "Relation Name": "results"},
+                    {"Node Type": "Seq Scan", "Relation Name": "week_counts"},
+                ],
+            },
+        ],
+    }
+    assert sequential_scans(plan) == ["matches", "week_counts"]
+    assert sequential_scans({"Node Type": "Bitmap Heap Scan"}) == []
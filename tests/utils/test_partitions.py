@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+""" Tests partition helpers."""
+from datetime import datetime, timezone
+
+from utils.partitions import partition_name, partition_weeks
+from utils.results_cacher import week_timebox
+
+
+def test_partition_weeks():
+    """ Tests weeks follow the Wednesday breakpoint and extend ahead."""
+    wednesday = datetime(2021, 11, 3, 1, tzinfo=timezone.utc).timestamp()
+    assert partition_weeks([]) == []
+    assert partition_weeks([None]) == []
+    assert partition_weeks([wednesday - 1, wednesday]) == ["20211027", "20211103"]
+    assert partition_weeks([wednesday + 3600, None], 2) == [
+        "20211103",
+        "20211110",
+        "20211117",
+    ]
+
+
+def test_partition_bounds():
+    """ Tests partitions of consecutive weeks share their bound."""
+    first, second = partition_weeks(
+        [datetime(2021, 11, 3, 1, tzinfo=timezone.utc).timestamp()], 1
+    )
+    assert week_timebox(first)[1] == week_timebox(second)[0]
+    assert partition_name(first) == "matches_w20211103"
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+""" Tests ingest pipeline helpers."""
+
+import pytest
+
+from utils.pipeline import Checkpoint, prefetch, TokenBucket
+
+
+class FakeClock:
+    """ Clock that only moves when slept."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket():
+    """ Tests that the bucket enforces its rate after the initial burst."""
+    clock = FakeClock()
+    bucket = TokenBucket(0.5, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.now == 0
+    bucket.acquire()
+    assert clock.now == pytest.approx(2)
+    bucket.acquire()
+    assert clock.now == pytest.approx(4)
+
+
+def test_prefetch():
+    """ Tests prefetch yields everything in order and re-raises errors."""
+    assert list(prefetch(range(10), 3)) == list(range(10))
+
+    def failing():
+        yield 1
+        raise ValueError("boom")
+
+    results = []
+    with pytest.raises(ValueError):
+        for item in prefetch(failing()):
+            results.append(item)
+    assert results == [1]
+
+
+def test_prefetch_stops_early():
+    """ Tests abandoning the consumer does not hang the producer."""
+    for item in prefetch(iter(range(1000)), 1):
+        if item == 2:
+            break
+
+
+def test_checkpoint(tmp_path):
+    """ Tests checkpoint round trip."""
+    checkpoint = Checkpoint(str(tmp_path / "sub" / "checkpoint.json"))
+    assert checkpoint.load() is None
+    checkpoint.save(next_start=10, end_ts=None)
+    assert checkpoint.load() == {"next_start": 10, "end_ts": None}
+    checkpoint.clear()
+    assert checkpoint.load() is None
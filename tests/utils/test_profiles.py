@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Tests profile lookups against a local stub of the api."""
+from http.server import BaseHTTPRequestHandler
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from requests import Session
+
+import utils.profiles
+
+DELAY = 0.2
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Slowly serves a profile for even ids, 404 for odd ones."""
+
+    lock = threading.Lock()
+    in_flight = 0
+    most_in_flight = 0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.most_in_flight = max(cls.most_in_flight, cls.in_flight)
+        time.sleep(DELAY)
+        profile_id = int(parse_qs(urlparse(self.path).query)["profile_id"][0])
+        with cls.lock:
+            cls.in_flight -= 1
+        if profile_id % 2:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"name": "p{}".format(profile_id), "country": "DE"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(name="stub_api")
+def fixture_stub_api(stub_server):
+    """ Points the api at a local server."""
+    StubHandler.most_in_flight = 0
+    return stub_server(StubHandler, utils.profiles, "/lastmatch?profile_id={}")
+
+
+def test_fetch_profiles(stub_api):
+    """ Tests profiles are fetched concurrently within the bound."""
+    profile_ids = list(range(16))
+    begin = time.perf_counter()
+    profiles = utils.profiles.fetch_profiles(
+        profile_ids + [0, 2], concurrency=4, http=Session()
+    )
+    elapsed = time.perf_counter() - begin
+    assert sorted(profiles) == profile_ids
+    assert profiles[4]["name"] == "p4"
+    assert profiles[3]["name"] == "UNKNOWN"
+    assert StubHandler.most_in_flight <= 4
+    assert elapsed < len(profile_ids) * DELAY / 2
+    assert utils.profiles.fetch_profiles([]) == {}
+
+
+def test_profile_cache(stub_api, tmp_path):
+    """ Tests fresh, stale, negative and expired lookups."""
+    now = [1000.0]
+    cache = utils.profiles.ProfileCache(
+        str(tmp_path / "profiles.db"),
+        ttl=100,
+        stale_ttl=100,
+        negative_ttl=10,
+        clock=lambda: now[0],
+    )
+    http = Session()
+    profiles = utils.profiles.fetch_profiles([2, 3], http=http, cache=cache)
+    assert profiles[2]["name"] == "p2"
+    assert profiles[3]["name"] == "UNKNOWN"
+    assert cache.stats() == {"miss": 2, "error": 1}
+
+    assert utils.profiles.fetch_profile(2, http, cache=cache)["name"] == "p2"
+    assert utils.profiles.fetch_profile(3, http, cache=cache)["name"] == "UNKNOWN"
+    assert cache.stats()["hit"] == 1
+    assert cache.stats()["negative"] == 1
+
+    now[0] += 150
+    assert cache.lookup(2)[0] == utils.profiles.STALE
+    assert utils.profiles.fetch_profile(2, http, cache=cache)["name"] == "p2"
+    cache.wait()
+    assert cache.stats()["refresh"] == 1
+    assert cache.lookup(2)[0] == utils.profiles.FRESH
+    assert cache.lookup(3)[0] == utils.profiles.MISSING
+
+    cache.store(2, None)
+    assert cache.lookup(2) == (utils.profiles.FRESH, {"name": "p2", "country": "DE"})
+    now[0] += 1000
+    assert cache.lookup(2)[0] == utils.profiles.MISSING
+    cache.store(2, None)
+    assert cache.lookup(2) == (utils.profiles.FRESH, None)
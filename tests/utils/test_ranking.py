@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+""" Tests shared ranking."""
+import random
+import sqlite3
+
+import pytest
+
+from utils.ranking import DENSE_RANK, RANK, ranks
+
+
+def test_ranks():
+    """ Tests tie semantics."""
+    scores = [0.5, 0.7, 0.5, 0.1, 0.7]
+    assert ranks(scores).tolist() == [3, 1, 3, 5, 1]
+    assert ranks(scores, DENSE_RANK).tolist() == [2, 1, 2, 3, 1]
+    assert ranks([]).tolist() == []
+    with pytest.raises(ValueError):
+        ranks(scores, "ROW_NUMBER")
+
+
+def test_grouped_ranks():
+    """ Tests groups are ranked independently."""
+    scores = [3, 1, 3, 2, 2]
+    groups = ["a", "b", "a", "b", "a"]
+    assert ranks(scores, groups=groups).tolist() == [1, 2, 1, 1, 3]
+    assert ranks(scores, DENSE_RANK, groups).tolist() == [1, 2, 1, 1, 2]
+
+
+def test_sql_agrees():
+    """ Tests NumPy ranks agree with the SQL window functions."""
+    generator = random.Random(4)
+    rows = [(generator.choice("xyz"), generator.randint(0, 5)) for _ in range(200)]
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE scores (id integer, category text, score integer)")
+    conn.executemany(
+        "INSERT INTO scores VALUES (?, ?, ?)",
+        [(index, category, score) for index, (category, score) in enumerate(rows)],
+    )
+    for method in (RANK, DENSE_RANK):
+        sql = """SELECT {}() OVER (PARTITION BY category ORDER BY score DESC)
+FROM scores ORDER BY id""".format(
+            method
+        )
+        expected = [rank for (rank,) in conn.execute(sql)]
+        found = ranks([row[1] for row in rows], method, [row[0] for row in rows])
+        assert found.tolist() == expected
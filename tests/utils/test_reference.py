@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+""" Tests reference data registry."""
+import os
+
+import pytest
+
+from utils.reference import load_cached, parse_strings, reference_data
+from utils.tools import civ_map, map_id_lookup, map_name_lookup
+
+
+def test_lookups():
+    """ Tests lookups from strings.json."""
+    assert civ_map()[1] == "Britons"
+    assert civ_map()["1"] == "Britons"
+    assert map_name_lookup()[9] == "Arabia"
+    assert map_name_lookup()["9"] == "Arabia"
+    assert map_name_lookup()[-5] == "UNKNOWN"
+    assert -5 not in map_name_lookup()
+    assert map_id_lookup()["arabia"] == 9
+    with pytest.raises(KeyError):
+        civ_map()[999]
+    with pytest.raises(TypeError):
+        civ_map()[999] = "Nope"
+
+
+def test_parsed_once():
+    """ Tests the registry is shared."""
+    assert reference_data() is reference_data()
+    assert civ_map() is civ_map()
+
+
+def test_disk_cache(tmp_path):
+    """ Tests cache is reused and refreshed when strings change."""
+    strings = tmp_path / "strings.json"
+    strings.write_text(
+        '{"civ": [{"id": 1, "string": "Britons"}], "map_type": [],'
+        ' "rating_type": [{"id": 2, "string": "1v1"}]}'
+    )
+    cache_file = str(tmp_path / "cache" / "strings.pickle")
+    first = load_cached(str(strings), cache_file)
+    assert first == parse_strings(str(strings))
+    assert load_cached(str(strings), cache_file).rating_types[2] == "1v1"
+    assert load_cached(str(strings), cache_file).map_names[9] == "UNKNOWN"
+    strings.write_text(
+        '{"civ": [{"id": 1, "string": "Celts"}], "map_type": [], "rating_type": []}'
+    )
+    os.utime(str(strings), (1, 1))
+    assert load_cached(str(strings), cache_file).civ_names[1] == "Celts"
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+""" Tests loading a report from the results table."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from report import arg_parser, ReportManager
+from utils import backends
+from utils.backends import SQLiteBackend
+from utils.results_cacher import CREATE_RESULTS_TABLE
+
+WEEKS = ("20211027", "20211103")
+
+INSERT_SQL = """INSERT INTO results (week, civ_id, team_size, map_category,
+methodology, metric, compound, rank, pct) VALUES %s"""
+
+
+@pytest.fixture(name="queries")
+def fixture_queries(tmp_path, monkeypatch):
+    """ Results for two weeks on a SQLite backend; returns the list the
+    backend appends each query to. """
+    backend = SQLiteBackend(str(tmp_path / "results.db"))
+    backend.transaction(CREATE_RESULTS_TABLE, None)
+    rows = []
+    for index, week in enumerate(WEEKS):
+        for category in ("All", "Arabia", "Arena", "Others"):
+            for civ_id, rank in (("1", 1), ("2", 2)):
+                pct = 0.1 * rank + 0.01 * index
+                rows.append(
+                    (week, civ_id, "1v1", category, "player", "popularity", 0, rank, pct)
+                )
+                rows.append(
+                    (week, civ_id, "1v1", category, "player", "popularity", 1, 9, 0.9)
+                )
+                rows.append(
+                    (week, civ_id, "1v1", category, "player", "winrate", 0, 3 - rank, pct)
+                )
+                rows.append(
+                    (week, civ_id, "1v1", category, "match", "winrate", 0, 7, 0.7)
+                )
+    backend.bulk_insert(INSERT_SQL, rows)
+    queries = []
+    execute = backend.execute
+
+    def counted(sql, values=None):
+        queries.append(sql)
+        return execute(sql, values)
+
+    monkeypatch.setattr(backend, "execute", counted)
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    return queries
+
+
+def datetime_after(week):
+    """ A moment in the week after an Ymd week, so it is "this week"."""
+    return datetime.strptime(week, "%Y%m%d") + timedelta(days=8)
+
+
+def test_generate(queries):
+    """ Both weeks and every category load in one query."""
+    report = ReportManager(arg_parser().parse_args([]))
+    report.generate(datetime_after(WEEKS[1]))
+    assert len(queries) == 1
+    assert set(report.civs) == {"1", "2"}
+    civ = report.civs["2"]
+    for category in report.categories:
+        assert civ.last_week.popularity_rank(category) == 2
+        assert civ.this_week.popularity_pct(category) == pytest.approx(21)
+        assert civ.this_week.winrate_rank(category) == 1
+        assert civ.last_week.winrate_pct(category) == pytest.approx(20)
+    assert civ.info("popularity", "1v1 Arabia", "1v1") == (
+        " 2. Franks      (+1.00) (21.0%)"
+    )
+
+
+def test_generate_compound_match(queries):
+    """ Compound and methodology pick their own rows."""
+    report = ReportManager(arg_parser().parse_args(["-c", "-m"]))
+    report.generate(datetime_after(WEEKS[1]))
+    assert len(queries) == 1
+    civ = report.civs["1"]
+    assert civ.this_week.popularity_rank("1v1 All") == 0
+    assert civ.this_week.winrate_rank("1v1 All") == 7
@@ -4,6 +4,7 @@
 import pytest
 
 from utils.results_cacher import winrate_player, most_popular_player
+from utils.results_cacher import category_keys, WeekAggregate
 
 
 def test_winrate_player():
@@ -608,3 +609,45 @@ def test_most_popular_player_basic():
     assert len(civs) == len(expected)
     for civ in civs:
         assert civ.score == expected[civ.civ_id]
+
+
+def test_category_keys():
+    """ Tests in-memory category matching."""
+    assert category_keys(1, 9) == [("All", "1v1"), ("Arabia", "1v1")]
+    assert category_keys(2, 29) == [
+        ("All", "2v2"),
+        ("All", "team"),
+        ("Arena", "2v2"),
+        ("Arena", "team"),
+    ]
+    assert category_keys(4, 12) == [("All", "team"), ("Others", "team")]
+    assert category_keys(3, None) == [("All", "team")]
+
+
+def test_week_aggregate():
+    """ Tests single pass aggregation of a week."""
+    rows = [
+        ("1", False, 10, 1, False, 1, 9),
+        ("1", True, 11, 2, False, 1, 9),
+        ("2", False, 10, 1, False, 1, 29),
+        ("2", True, 12, 1, False, 1, 29),
+        ("3", False, 13, 3, False, 2, 9),
+        ("3", False, 14, 12, False, 2, 9),
+        ("3", True, 15, 1, False, 2, 9),
+        ("3", True, 16, 3, False, 2, 9),
+    ]
+    civs = {}
+    for civ in WeekAggregate().load(rows).civilizations():
+        key = (civ.map_category, civ.size, civ.methodology, civ.metric, civ.civ_id)
+        civs[key] = civ
+    arabia_1v1 = civs[("Arabia", "1v1", "match", "popularity", "1")]
+    assert arabia_1v1.pct == 0.5
+    assert arabia_1v1.rank == 1
+    assert civs[("All", "1v1", "match", "popularity", "1")].pct == 0.75
+    assert civs[("All", "1v1", "match", "winrate", "2")].pct == 1
+    assert civs[("All", "1v1", "player", "winrate", "1")].pct == 0.5
+    assert civs[("Arena", "1v1", "match", "popularity", "1")].total == 2
+    assert civs[("Arabia", "2v2", "match", "popularity", "3:12")].pct == 0.5
+    assert civs[("Arabia", "2v2", "player", "popularity", "12:3")].times_used == 1
+    assert ("Arabia", "team", "match", "popularity", "3:12") not in civs
+    assert civs[("All", "team", "match", "winrate", "3")].pct == 0.5
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+""" Tests the window-function smurf search on a SQLite backend."""
+import pytest
+
+from smurf import first_started, first_weeks, player_matches, WEEK_IN_SECONDS
+from utils import backends
+from utils.backends import SQLiteBackend
+from utils.update import CREATE_MATCH_TABLE, MATCH_COLUMNS
+
+START = 1635901200
+HOUR = 60 * 60
+
+
+def match_row(match_id, player_id, started, rating, won, civ_id=1, rating_type=2):
+    """ A row in MATCH_COLUMNS order."""
+    return (
+        str(match_id), 9, rating_type, "1", started, started + HOUR,
+        1, 0, player_id, civ_id, rating, won, False,
+    )
+
+
+@pytest.fixture(name="matches")
+def fixture_matches(tmp_path, monkeypatch):
+    """ Player 1 climbs 1500 -> 1800 in their first week, player 2 climbs
+    too slowly and player 3 was first seen before the search window. """
+    rows = []
+    for game in range(8):
+        started = START + game * HOUR
+        rows.append(match_row(game, 1, started, 1500 + game * 50, game > 0, game))
+        rows.append(match_row(100 + game, 2, started, 1600 + game * 20, True))
+        rows.append(match_row(200 + game, 3, started, 1500 + game * 50, True))
+    rows.append(match_row(300, 3, START - 10 * HOUR, 1400, False))
+    # after the first week; neither counted nor the peak
+    rows.append(match_row(301, 1, START + WEEK_IN_SECONDS + HOUR, 2100, True))
+    backend = SQLiteBackend(str(tmp_path / "ranked.db"))
+    backend.transaction(CREATE_MATCH_TABLE, None)
+    backend.bulk_insert(
+        "INSERT INTO matches ({}) VALUES %s".format(MATCH_COLUMNS), rows
+    )
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    return rows
+
+
+def test_first_weeks(matches):
+    """ Only the fast climber first seen in the window is found."""
+    assert len(matches) == 26
+    climbers = first_weeks(START - HOUR, START + HOUR)
+    assert [climber.player_id for climber in climbers] == [1]
+    climber = climbers[0]
+    assert climber.first_started == START
+    assert climber.peak_started == START + 7 * HOUR
+    assert climber.games_played == 8
+    assert climber.first_rating == 1500
+    assert climber.max_rating == 1850
+    assert climber.climb == 350
+    assert climber.win_pct == pytest.approx(7 / 8)
+    assert climber.civ_count == 8
+    assert climber.map_count == 1
+
+
+def test_first_weeks_ladders(matches):
+    """ Only the requested ladders are searched."""
+    assert len(matches) == 26
+    assert first_weeks(START - HOUR, START + HOUR, ladders=[4]) == []
+    assert len(first_weeks(START - HOUR, START + HOUR, ladders=[2, 4])) == 1
+
+
+def test_no_candidates():
+    """ No players means no query."""
+    assert player_matches([], START) == {}
+    assert first_started([]) == {}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+""" Tests the Parquet snapshot."""
+from collections import Counter
+
+import pyarrow.dataset as ds
+
+from utils import snapshot
+from utils.benchmark import SyntheticMatches
+from utils.results_cacher import week_timebox
+
+
+def write_weeks(directory, weeks, count=300):
+    """ Writes synthetic matches for each week; returns all rows."""
+    generator = SyntheticMatches(seed=5)
+    rows = []
+    for week in weeks:
+        start, end = week_timebox(week)
+        week_rows = generator.rows(count, int(start), int(end))
+        snapshot.write_week(week, [week_rows[:100], week_rows[100:]], directory)
+        rows.extend(week_rows)
+    return rows
+
+
+def test_grouped(tmp_path):
+    """ Tests GROUP BY results match counting the rows."""
+    directory = str(tmp_path)
+    rows = write_weeks(directory, ["20211027", "20211103"])
+    expected = Counter((row[9], row[11]) for row in rows if row[6] == 1)
+    found = snapshot.grouped(
+        ["civ_id", "won"], [("*", "count")], [ds.field("team_size") == 1], directory
+    )
+    assert dict(((civ_id, won), cnt) for civ_id, won, cnt in found) == expected
+    max_ratings = snapshot.grouped(["player_id"], [("rating", "max")], (), directory)
+    assert len(max_ratings) == len({row[8] for row in rows})
+    assert snapshot.distinct("version", (), directory) == ["54684"]
+
+
+def test_timebox_filter(tmp_path):
+    """ Tests rows honour the timebox and rewriting replaces a week."""
+    directory = str(tmp_path)
+    rows = write_weeks(directory, ["20211027", "20211103"])
+    start, end = week_timebox("20211103")
+    filters = [snapshot.timebox_filter(start, end)]
+    found = list(snapshot.rows(["match_id", "started"], filters, directory))
+    expected = [row for row in rows if start <= row[4] <= end]
+    assert len(found) == len(expected)
+    assert all(start <= started <= end for _, started in found)
+
+    rewritten = write_weeks(directory, ["20211103"], count=10)
+    later = snapshot.scan(["match_id"], [ds.field("week") == "20211103"], directory)
+    earlier = snapshot.scan(["started"], [ds.field("started") < start], directory)
+    assert len(later) == len(rewritten)
+    assert len(earlier) == len(rows) - len(expected)
+
+
+def test_rewrite_drops_partitions(tmp_path):
+    """ Tests rewriting a week with fewer team sizes, or none, replaces it."""
+    directory = str(tmp_path)
+    rows = write_weeks(directory, ["20211027", "20211103"])
+    week = [ds.field("week") == "20211103"]
+    earlier = [ds.field("week") == "20211027"]
+    other = len(snapshot.scan(["match_id"], earlier, directory))
+    start, end = week_timebox("20211103")
+    solo = [row for row in rows if start <= row[4] < end and row[6] == 1]
+    assert snapshot.write_week("20211103", [solo], directory) == len(solo)
+    assert len(snapshot.scan(["match_id"], week, directory)) == len(solo)
+    assert snapshot.write_week("20211103", [], directory) == 0
+    assert len(snapshot.scan(["match_id"], week, directory)) == 0
+    assert len(snapshot.scan(["match_id"], (), directory)) == other
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+""" Tests the streak index."""
+import random
+
+import pytest
+
+from utils import backends, streaks
+from utils.backends import SQLiteBackend
+from utils.results_cacher import CREATE_RESULTS_TABLE
+from utils.trends import trailing_weeks
+
+WEEKS = trailing_weeks("20211103", 12)
+
+INSERT_SQL = """INSERT INTO results (week, civ_id, team_size, map_category,
+methodology, metric, compound, rank, pct) VALUES %s"""
+
+STREAKS_ROWS_SQL = "SELECT * FROM streaks ORDER BY {}".format(streaks.KEY_COLUMNS)
+
+
+def week_rows(week, generator):
+    """ Shuffled ranks of 8 civs in two categories."""
+    rows = []
+    for category in ("Arabia", "Arena"):
+        civ_ids = [str(civ_id) for civ_id in range(1, 9)]
+        generator.shuffle(civ_ids)
+        for rank, civ_id in enumerate(civ_ids, 1):
+            rows.append(
+                (week, civ_id, "1v1", category, "player", "winrate", 0, rank, 0.5)
+            )
+    return rows
+
+
+@pytest.fixture(name="backend")
+def fixture_backend(tmp_path, monkeypatch):
+    """ Empty results and streaks tables on a SQLite backend."""
+    backend = SQLiteBackend(str(tmp_path / "results.db"))
+    backend.transaction(CREATE_RESULTS_TABLE, None)
+    backend.transaction(streaks.CREATE_STREAKS_TABLE, None)
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    return backend
+
+
+def test_incremental_matches_rebuild(backend):
+    """ Indexing week by week, including rewriting an old week, ends up
+    where indexing everything at once does. """
+    generator = random.Random(8)
+    for week in WEEKS:
+        backend.bulk_insert(INSERT_SQL, week_rows(week, generator))
+        streaks.update_streaks([week])
+    backend.transaction("DELETE FROM results WHERE week = %s", (WEEKS[5],))
+    backend.bulk_insert(INSERT_SQL, week_rows(WEEKS[5], generator))
+    streaks.update_streaks([WEEKS[5]])
+    incremental = backend.execute(STREAKS_ROWS_SQL)
+    backend.transaction("DELETE FROM streaks", None)
+    streaks.update_streaks(WEEKS)
+    assert backend.execute(STREAKS_ROWS_SQL) == incremental
+    assert len(incremental) == len(WEEKS) * 16
+
+
+def test_week_streaks(backend):
+    """ Streaks count back from the looked up week."""
+    rows = []
+    for index, week in enumerate(WEEKS):
+        # civ 1 is 3rd, 2nd for the last four weeks; civ 2 is 1st, then 6th
+        rows.append((week, "1", "1v1", "Arabia", "player", "winrate", 0,
+                     3 if index < 8 else 2, 0.5))
+        rows.append((week, "2", "1v1", "Arabia", "player", "winrate", 0,
+                     1 if index < 11 else 6, 0.5))
+    backend.bulk_insert(INSERT_SQL, rows)
+    streaks.update_streaks(WEEKS)
+    found = streaks.week_streaks(WEEKS[-1])
+    assert sorted(found["winrate", "Arabia"]) == [
+        ("1", 2, 4, 12, 12),
+        # never ranked worse, so back to its first result
+        ("2", 6, 12, 0, 11),
+    ]
+    assert streaks.week_streaks(WEEKS[-1], below=3) == {
+        ("winrate", "Arabia"): [("1", 2, 4, 12, 12)]
+    }
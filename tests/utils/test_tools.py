@@ -41,3 +41,13 @@ def test_weekend():
         friday, monday = utils.tools.weekend(test_day)
         assert friday == expected_friday
         assert monday == expected_monday
+
+
+def test_week_keys():
+    """ Tests week_keys method. """
+    wednesday = datetime(2021, 11, 3, 1, tzinfo=timezone.utc)
+    assert utils.tools.week_keys(wednesday.timestamp() + 3600) == ["20211103"]
+    assert utils.tools.week_keys(wednesday.timestamp() - 3600) == ["20211027"]
+    assert utils.tools.week_keys(wednesday.timestamp()) == ["20211103", "20211027"]
+    sunday = datetime(2021, 11, 7, 12, tzinfo=timezone.utc)
+    assert utils.tools.week_keys(sunday.timestamp()) == ["20211103"]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Tests the multi-week trend engine."""
+import random
+
+import numpy as np
+import pytest
+
+from utils import backends
+from utils.backends import SQLiteBackend
+from utils.results_cacher import CREATE_RESULTS_TABLE
+from utils.trends import trailing_weeks, Trend
+
+WEEKS = trailing_weeks("20211103", 20)
+
+INSERT_SQL = """INSERT INTO results (week, civ_id, team_size, map_category,
+methodology, metric, compound, rank, pct) VALUES %s"""
+
+
+@pytest.fixture(name="rows")
+def fixture_rows():
+    """ (week, civ_id, metric, rank, pct) rows with some weeks missing."""
+    generator = random.Random(4)
+    rows = []
+    for week in WEEKS:
+        for metric in ("popularity", "winrate"):
+            civ_ids = [str(civ_id) for civ_id in range(1, 9)]
+            generator.shuffle(civ_ids)
+            for rank, civ_id in enumerate(civ_ids, 1):
+                if generator.random() < 0.1:
+                    continue
+                rows.append((week, civ_id, metric, rank, generator.random()))
+    return rows
+
+
+def reference(rows, civ_id, metric, weeks):
+    """ Streaks counted week by week."""
+    ranks = {row[0]: row[3] for row in rows if row[1:3] == (civ_id, metric)}
+    current = ranks.get(weeks[-1], 0)
+    at_level = 0
+    for week in reversed(weeks):
+        if ranks.get(week, 99) > current:
+            break
+        at_level += 1
+    top_5 = 0
+    for week in reversed(weeks[-12:]):
+        if ranks.get(week, 99) > 5:
+            break
+        top_5 += 1
+    count = sum(1 for week in weeks[-10:] if ranks.get(week, 99) <= 5)
+    return at_level, top_5, count
+
+
+def test_streaks(rows):
+    """ Vectorized streaks match counting week by week."""
+    trend = Trend.from_rows(WEEKS, ["popularity", "winrate"], rows)
+    assert trend.rank.shape == (20, 8, 2)
+    at_level = trend.weeks_at_or_above()
+    top_5 = trend.weeks_in_top(5, 12)
+    count = trend.count_in_top(5, 10)
+    for civ_id in trend.civ_ids:
+        for metric in trend.metrics:
+            index = (trend.civ_index(civ_id), trend.metric_index(metric))
+            found = (at_level[index], top_5[index], count[index])
+            assert found == reference(rows, civ_id, metric, WEEKS)
+
+
+def test_deltas_and_averages():
+    """ Deltas and moving averages skip missing weeks."""
+    weeks = WEEKS[:5]
+    rows = [
+        (week, "1", "winrate", 1, pct)
+        for week, pct in zip(weeks, (0.5, 0.6, None, 0.4, 0.7))
+        if pct is not None
+    ]
+    trend = Trend.from_rows(weeks, ["winrate"], rows)
+    pcts = trend.pct[:, 0, 0]
+    np.testing.assert_allclose(
+        trend.deltas()[:, 0, 0], [np.nan, 0.1, np.nan, np.nan, 0.3]
+    )
+    np.testing.assert_allclose(trend.deltas(weeks=3)[:, 0, 0][3:], [-0.1, 0.1])
+    averages = trend.moving_average(window=3)[:, 0, 0]
+    np.testing.assert_allclose(averages, [np.nan, np.nan, 0.55, 0.5, 0.55])
+    assert np.isnan(pcts[2])
+
+
+def test_load(tmp_path, rows, monkeypatch):
+    """ Loads one category and methodology from the results table."""
+    backend = SQLiteBackend(str(tmp_path / "results.db"))
+    backend.transaction(CREATE_RESULTS_TABLE, None)
+    stored = [
+        (week, civ_id, "1v1", "Arabia", "player", metric, 0, rank, pct)
+        for week, civ_id, metric, rank, pct in rows
+    ]
+    stored += [
+        (week, civ_id, "1v1", "Arena", "player", metric, 0, 1, 0.5)
+        for week, civ_id, metric, _, _ in rows
+    ]
+    backend.bulk_insert(INSERT_SQL, stored)
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    trend = Trend.load(WEEKS[-8:], "Arabia")
+    expected = Trend.from_rows(WEEKS[-8:], ["popularity", "winrate"], rows)
+    assert trend.civ_ids == expected.civ_ids
+    np.testing.assert_array_equal(trend.rank, expected.rank)
+    np.testing.assert_allclose(trend.pct, expected.pct)
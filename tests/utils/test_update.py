@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+""" Tests fetching matches against a local stub of the api."""
+from http.server import BaseHTTPRequestHandler
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import utils.update
+
+
+def stub_match(match_id, started):
+    """ Minimal valid 1v1 match as returned by the api."""
+    return {
+        "match_id": str(match_id),
+        "map_type": 9,
+        "rating_type": 2,
+        "version": "54684",
+        "started": started,
+        "finished": started + 1500,
+        "num_players": 2,
+        "game_type": 0,
+        "ranked": True,
+        "players": [
+            {"profile_id": 1, "civ": 3, "rating": 1000, "won": True, "team": 1},
+            {"profile_id": 2, "civ": 4, "rating": 1010, "won": False, "team": 2},
+        ],
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Serves one match per minute after since."""
+
+    requests = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        query = parse_qs(urlparse(self.path).query)
+        since = int(query["since"][0])
+        self.requests.append(since)
+        data = [stub_match(since + i, since + 60 * i) for i in range(1, 4)]
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api(stub_server):
+    """ Points the api at a local server."""
+    StubHandler.requests = []
+    stub_server(StubHandler, utils.update, "/matches?count={count}&since={start}")
+    return StubHandler.requests
+
+
+def test_fetch_matches(stub_api):
+    """ Tests a single fetch is parsed into rows."""
+    length, next_start, ranked, unranked = utils.update.fetch_matches(1000)
+    assert length == 3
+    assert next_start == 1180
+    assert len(ranked) == 6
+    assert not unranked
+    assert ranked[0] == ["1001", 9, 2, "54684", 1060, 2560, 1, 0, 1, 3, 1000, True, False]
+
+
+def test_fetched_pages(stub_api, monkeypatch):
+    """ Tests pages follow each other and stop at end_ts."""
+    monkeypatch.setattr(utils.update, "MAX_DOWNLOAD", 3)
+    bucket = utils.update.TokenBucket(1000, capacity=10)
+    pages = list(utils.update.fetched_pages(1000, 1500, bucket))
+    assert [page[1] for page in pages] == [1180, 1360, 1540]
+    assert stub_api == [1000, 1180, 1360]
+
+
+def test_matches_csv():
+    """ Tests rows are formatted for COPY."""
+    rows = [
+        ["1001", 9, 2, "54684", 1060, 2560, 1.0, 0, 1, 3, None, True, False],
+        ["1001", 9, 2, None, 1060, None, 2.0, 0, 2, 4, 1010, False, True],
+    ]
+    buffer = utils.update.matches_csv(rows)
+    assert buffer.read().splitlines() == [
+        "1001,9,2,54684,1060,2560,1,0,1,3,,t,f",
+        "1001,9,2,,1060,,2,0,2,4,1010,f,t",
+    ]
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+""" Tests the weekend usage statistics."""
+from datetime import datetime
+
+from usage import last_weekends, row_label, STATS, weekend_usage
+from utils import backends
+from utils.backends import SQLiteBackend
+from utils.benchmark import SyntheticMatches
+from utils.update import CREATE_MATCH_TABLE, MATCH_COLUMNS
+
+# Python versions of the STATS conditions
+CONDITIONS = {
+    None: lambda row: True,
+    "team_size = 1": lambda row: row[6] == 1,
+    "team_size > 1": lambda row: row[6] > 1,
+    "rating > 1650 AND team_size = 1": lambda row: row[6] == 1
+    and row[10] is not None
+    and row[10] > 1650,
+    "rating BETWEEN 1000 AND 1650 AND team_size = 1": lambda row: row[6] == 1
+    and row[10] is not None
+    and 1000 <= row[10] <= 1650,
+    "rating < 1000 AND team_size = 1": lambda row: row[6] == 1
+    and row[10] is not None
+    and row[10] < 1000,
+}
+
+COLUMNS = {"match_id": 0, "player_id": 8}
+
+
+def test_weekend_usage(tmp_path, monkeypatch):
+    """ One query counts what the per-statistic queries counted."""
+    timeboxes = last_weekends(3, datetime(2021, 11, 10))
+    generator = SyntheticMatches(seed=9, players=400)
+    rows = []
+    for index, (start, end) in enumerate(timeboxes[1:]):
+        for row in generator.rows(400, int(start) - 3600, int(end) + 3600):
+            rows.append(("{}-{}".format(index, row[0]),) + tuple(row[1:]))
+    backend = SQLiteBackend(str(tmp_path / "ranked.db"))
+    backend.transaction(CREATE_MATCH_TABLE, None)
+    backend.bulk_insert(
+        "INSERT INTO matches ({}) VALUES %s".format(MATCH_COLUMNS), rows
+    )
+    monkeypatch.setitem(backends.STATE, "backend", backend)
+    monkeypatch.setitem(backends.STATE, "pid", backends.os.getpid())
+    usage = weekend_usage(timeboxes)
+    assert usage[0] == {label: 0 for label, _, _ in STATS}
+    for (start, end), found in zip(timeboxes, usage):
+        in_window = [row for row in rows if start <= row[4] <= end]
+        for label, column, condition in STATS:
+            test = CONDITIONS[condition]
+            expected = {row[COLUMNS[column]] for row in in_window if test(row)}
+            assert found[label] == len(expected), label
+    assert usage[1]["Matches"] > 0
+
+
+def test_row_label():
+    """ Estimates are labelled by the whole week they cover."""
+    timebox = last_weekends(1, datetime(2021, 11, 10))[0]
+    assert row_label(timebox) == "11-05:11-08"
+    assert row_label(timebox, approximate=True) == "wk 20211103"
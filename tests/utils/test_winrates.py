@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+""" Tests vectorized win rates."""
+
+import pytest
+from statsmodels.stats.proportion import proportion_confint
+
+from utils.winrates import lower_bounds, win_means
+
+
+def test_win_means():
+    """ Tests means with empty entries."""
+    assert list(win_means([1, 3, 0], [2, 4, 0])) == [0.5, 0.75, 0]
+
+
+def test_lower_bounds():
+    """ Tests lower bounds match statsmodels."""
+    wins = [0, 1, 5, 30, 512, 7]
+    games = [5, 2, 5, 61, 1000, 9]
+    for method in ("normal", "wilson"):
+        bounds = lower_bounds(wins, games, method)
+        for win_count, game_count, bound in zip(wins, games, bounds):
+            expected, _ = proportion_confint(win_count, game_count, method=method)
+            assert bound == pytest.approx(expected)
+    assert list(lower_bounds([0], [0])) == [0]
+    with pytest.raises(ValueError):
+        lower_bounds([1], [2], "beta")
@@ -6,79 +6,156 @@ Number of matches
 - 1v1
 - team
 Ranked and unranked
+
+Every statistic of every weekend comes from one grouped query.
 """
-from collections import defaultdict
+from argparse import ArgumentParser
 from datetime import datetime, timedelta
+
+from utils.backends import set_backend, STATE
+from utils.cardinality import HyperLogLog, merged_sketches
+from utils.facts import UNKNOWN, week_of
 from utils.tools import execute_sql, weekend
 
-SQLS = {
-    "Matches": """SELECT COUNT(DISTINCT match_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}""",
-    "Players": """SELECT COUNT(DISTINCT player_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}""",
-    "1v1 Ma": """SELECT COUNT(DISTINCT match_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND team_size = 1""",
-    "1v1 Pl": """SELECT COUNT(DISTINCT player_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND team_size = 1""",
-    "Team Ma": """SELECT COUNT(DISTINCT match_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND team_size > 1""",
-    "Team Pl": """SELECT COUNT(DISTINCT player_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND team_size > 1""",
-    "1v1 M H": """SELECT COUNT(DISTINCT match_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND rating > 1650
-AND team_size = 1""",
-    "1v1 P H": """SELECT COUNT(DISTINCT player_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND rating > 1650
-AND team_size = 1""",
-    "1v1 M M": """SELECT COUNT(DISTINCT match_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND rating BETWEEN 1000 AND 1650
-AND team_size = 1""",
-    "1v1 P M": """SELECT COUNT(DISTINCT player_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND rating BETWEEN 1000 AND 1650
-AND team_size = 1""",
-    "1v1 M L": """SELECT COUNT(DISTINCT match_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND rating > 1000
-AND team_size = 1""",
-    "1v1 P L": """SELECT COUNT(DISTINCT player_id) FROM matches
-WHERE started BETWEEN {:0.0f} AND {:0.0f}
-AND rating < 1000
-AND team_size = 1""",
+# (label, distinct column, condition or None)
+STATS = (
+    ("Matches", "match_id", None),
+    ("Players", "player_id", None),
+    ("1v1 Ma", "match_id", "team_size = 1"),
+    ("1v1 Pl", "player_id", "team_size = 1"),
+    ("Team Ma", "match_id", "team_size > 1"),
+    ("Team Pl", "player_id", "team_size > 1"),
+    ("1v1 M H", "match_id", "rating > 1650 AND team_size = 1"),
+    ("1v1 P H", "player_id", "rating > 1650 AND team_size = 1"),
+    ("1v1 M M", "match_id", "rating BETWEEN 1000 AND 1650 AND team_size = 1"),
+    ("1v1 P M", "player_id", "rating BETWEEN 1000 AND 1650 AND team_size = 1"),
+    ("1v1 M L", "match_id", "rating < 1000 AND team_size = 1"),
+    ("1v1 P L", "player_id", "rating < 1000 AND team_size = 1"),
+)
+
+USAGE_SQL_TEMPLATE = """SELECT {} AS weekend,
+{}
+FROM matches
+WHERE {}
+GROUP BY 1"""
+
+TIMEBOX_CONDITION = "started BETWEEN {:0.0f} AND {:0.0f}"
+
+# the STATS conditions on the (team_size, rating_band) of a weekly sketch;
+# rating bands are 50 wide, so the 1650 boundary falls into the high band
+APPROXIMATE_CONDITIONS = {
+    None: lambda size, band: True,
+    "team_size = 1": lambda size, band: size == 1,
+    "team_size > 1": lambda size, band: size > 1,
+    "rating > 1650 AND team_size = 1": lambda size, band: size == 1 and band >= 1650,
+    "rating BETWEEN 1000 AND 1650 AND team_size = 1": lambda size, band: size == 1
+    and 1000 <= band < 1650,
+    "rating < 1000 AND team_size = 1": lambda size, band: size == 1
+    and UNKNOWN < band < 1000,
 }
 
-TEMPLATE = "{:14}" + "{:>9}" * len(SQLS)
+TEMPLATE = "{:14}" + "{:>9}" * len(STATS)
+
+
+def distinct_count(column, condition):
+    """ COUNT(DISTINCT column) of the rows matching condition."""
+    if condition is None:
+        return "COUNT(DISTINCT {})".format(column)
+    return "COUNT(DISTINCT {}) FILTER (WHERE {})".format(column, condition)
+
+
+def usage_sql(timeboxes, stats=STATS):
+    """ One query counting stats for each of the (non-overlapping) timeboxes,
+    returning rows of (timebox index, *counts). """
+    conditions = [TIMEBOX_CONDITION.format(*timebox) for timebox in timeboxes]
+    window = "CASE {} END".format(
+        " ".join(
+            "WHEN {} THEN {}".format(condition, index)
+            for index, condition in enumerate(conditions)
+        )
+    )
+    counts = ",\n".join(
+        distinct_count(column, condition) for _, column, condition in stats
+    )
+    return USAGE_SQL_TEMPLATE.format(window, counts, " OR ".join(conditions))
+
+
+def weekend_usage(timeboxes, stats=STATS):
+    """ Returns one {label: count} per timebox."""
+    usage = [{label: 0 for label, _, _ in stats} for _ in timeboxes]
+    if not timeboxes:
+        return usage
+    for index, *counts in execute_sql(usage_sql(timeboxes, stats)):
+        usage[index] = dict(zip([label for label, _, _ in stats], counts))
+    return usage
+
+
+def approximate_usage(timeboxes, stats=STATS):
+    """ Returns one {label: estimate} per timebox, merging the weekly
+    sketches of the breakpoint week each timebox starts in; the estimates
+    cover that whole week, not just the timebox. """
+    usage = []
+    for timebox in timeboxes:
+        where = ["week = '{}'".format(week_of(timebox[0]))]
+        sketches = {
+            counted: merged_sketches(counted, ("team_size", "rating_band"), where)
+            for counted in {column for _, column, _ in stats}
+        }
+        data = {}
+        for label, column, condition in stats:
+            test = APPROXIMATE_CONDITIONS[condition]
+            data[label] = HyperLogLog.merged(
+                sketch
+                for (size, band), sketch in sketches[column].items()
+                if test(size, band)
+            ).count()
+        usage.append(data)
+    return usage
+
+
+def row_label(timebox, approximate=False):
+    """ The weekend's dates, or for estimates the week they cover."""
+    if approximate:
+        return "wk {}".format(week_of(timebox[0]))
+    return "{}:{}".format(
+        datetime.utcfromtimestamp(timebox[0]).strftime("%m-%d"),
+        datetime.utcfromtimestamp(timebox[1]).strftime("%m-%d"),
+    )
+
+
+def last_weekends(count, now=None):
+    """ Timeboxes of the count weekends before now, latest first."""
+    now = now or datetime.utcnow()
+    return [weekend(now - timedelta(weeks=offset)) for offset in range(count)]
 
 
 def run():
     """ Start analysis."""
-    keys = list(SQLS.keys())
-    for mode in (
-        "ranked",
-        "unranked",
-    ):
-        print("\n" + mode.capitalize())
+    parser = ArgumentParser()
+    parser.add_argument("-n", type=int, default=4, help="Number of weekends")
+    parser.add_argument(
+        "--backend",
+        action="append",
+        help="Database backend to report on, e.g. sqlite:data/unranked.db "
+        "(repeatable; default the configured one)",
+    )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Estimate from the weekly sketches; rows cover each weekend's "
+        "whole Wednesday-to-Wednesday week and are labelled by it",
+    )
+    args = parser.parse_args()
+    keys = [label for label, _, _ in STATS]
+    timeboxes = last_weekends(args.n)
+    for spec in args.backend or [STATE["spec"]]:
+        set_backend(spec)
+        print("\n" + spec)
         print(TEMPLATE.format("Week", *keys))
-
-        for week_offset in range(4):
-            data = {}
-            for label, sql_template in SQLS.items():
-                timebox = weekend(datetime.utcnow() - timedelta(weeks=week_offset))
-                dates = "{}:{}".format(
-                    datetime.utcfromtimestamp(timebox[0]).strftime("%m-%d"),
-                    datetime.utcfromtimestamp(timebox[1]).strftime("%m-%d"),
-                )
-                sql = sql_template.format(*timebox)
-                for (cnt,) in execute_sql(sql, "data/{}.db".format(mode)):
-                    data[label] = cnt
-            print(TEMPLATE.format(dates, *[data[key] for key in keys]))
+        usage = approximate_usage if args.approximate else weekend_usage
+        for timebox, data in zip(timeboxes, usage(timeboxes)):
+            label = row_label(timebox, args.approximate)
+            print(TEMPLATE.format(label, *[data[key] for key in keys]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+""" Database backends behind utils.tools.execute_sql and friends.
+
+The backend is chosen with AOE2STATS_BACKEND (or set_backend):
+
+    postgres              the aoe2stats database (default)
+    sqlite:PATH           a SQLite file, e.g. sqlite:data/ranked.db
+    duckdb:PATH           a DuckDB file, or a Parquet snapshot directory
+                          (utils.snapshot) exposed as the matches table
+
+Queries are written for PostgreSQL; each backend translates the few
+constructs its dialect lacks."""
+import os
+import re
+import sqlite3
+
+import psycopg2.extras
+
+from utils.db import cursor, server_cursor
+
+DEFAULT_BACKEND = "postgres"
+
+VALUES_PLACEHOLDER = re.compile(r"VALUES\s+%s", re.IGNORECASE)
+STRING_AGG = re.compile(r"\bSTRING_AGG\s*\(", re.IGNORECASE)
+PYFORMAT = re.compile(r"%([%s])")
+
+SNAPSHOT_VIEW_SQL = """CREATE VIEW matches AS SELECT * FROM read_parquet(
+'{}/**/*.parquet', hive_partitioning = true)"""
+
+STATE = {
+    "spec": os.environ.get("AOE2STATS_BACKEND", DEFAULT_BACKEND),
+    "backend": None,
+    "pid": None,
+}
+
+
+class PostgresBackend:
+    """ The pooled PostgreSQL connection in utils.db."""
+
+    name = "postgres"
+
+    def translate(self, sql, parameters=False):
+        """ Queries are already PostgreSQL."""
+        return sql
+
+    def execute(self, sql, values=None):
+        """ Returns all rows of sql."""
+        with cursor() as cur:
+            cur.execute(sql, values)
+            if cur.description is None:
+                return []
+            return cur.fetchall()
+
+    def stream(self, sql, itersize):
+        """ Yields lists of up to itersize rows from a server-side cursor."""
+        with server_cursor(itersize) as cur:
+            cur.execute(sql)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+
+    def transaction(self, sql, values):
+        """ Runs one statement and commits."""
+        with cursor(commit=True) as cur:
+            cur.execute(sql, values)
+
+    def bulk_insert(self, sql, values):
+        """ Runs an "INSERT ... VALUES %s" statement for all values and commits."""
+        with cursor(commit=True) as cur:
+            psycopg2.extras.execute_values(cur, sql, values)
+
+
+class EmbeddedBackend:
+    """ Shared behaviour of the in-process (DB-API, qmark) backends."""
+
+    name = None
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+
+    def connect(self):
+        """ Override in subclass."""
+        raise NotImplementedError
+
+    def connection(self):
+        """ Returns the connection, opening it on first use."""
+        if self.conn is None:
+            self.conn = self.connect()
+        return self.conn
+
+    def translate(self, sql, parameters=False):
+        """ PostgreSQL parameters to qmark. Like psycopg2, only a query run with
+        parameters has its %s placeholders and %% escapes rewritten. """
+        if not parameters:
+            return sql
+        return PYFORMAT.sub(lambda match: "%" if match.group(1) == "%" else "?", sql)
+
+    def execute(self, sql, values=None):
+        """ Returns all rows of sql."""
+        cur = self.connection().cursor()
+        try:
+            if values is None:
+                cur.execute(self.translate(sql))
+            else:
+                cur.execute(self.translate(sql, True), values)
+            if cur.description is None:
+                return []
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def stream(self, sql, itersize):
+        """ Yields lists of up to itersize rows."""
+        cur = self.connection().cursor()
+        try:
+            cur.execute(self.translate(sql))
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+    def transaction(self, sql, values):
+        """ Runs one statement and commits."""
+        try:
+            self.execute(sql, values)
+        except Exception:
+            self.connection().rollback()
+            raise
+        self.connection().commit()
+
+    def bulk_insert(self, sql, values):
+        """ Runs an "INSERT ... VALUES %s" statement for all values and commits."""
+        if not values:
+            return
+        row = "({})".format(", ".join(["?"] * len(values[0])))
+        sql = self.translate(VALUES_PLACEHOLDER.sub("VALUES " + row, sql), True)
+        cur = self.connection().cursor()
+        try:
+            cur.executemany(sql, [tuple(value) for value in values])
+        except Exception:
+            self.connection().rollback()
+            raise
+        finally:
+            cur.close()
+        self.connection().commit()
+
+
+class SQLiteBackend(EmbeddedBackend):
+    """ A SQLite database file."""
+
+    name = "sqlite"
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def translate(self, sql, parameters=False):
+        """ Also STRING_AGG, which SQLite before 3.44 calls GROUP_CONCAT."""
+        return STRING_AGG.sub("GROUP_CONCAT(", super().translate(sql, parameters))
+
+
+class DuckDBBackend(EmbeddedBackend):
+    """ A DuckDB database file, or a Parquet snapshot directory."""
+
+    name = "duckdb"
+
+    def connect(self):
+        # imported here so the other backends do not need duckdb installed
+        try:
+            import duckdb
+        except ImportError as error:
+            raise ImportError(
+                "The duckdb backend needs DuckDB: pip install duckdb"
+            ) from error
+
+        if os.path.isdir(self.path):
+            conn = duckdb.connect()
+            conn.execute(SNAPSHOT_VIEW_SQL.format(self.path))
+            return conn
+        return duckdb.connect(self.path)
+
+
+BACKENDS = {
+    SQLiteBackend.name: SQLiteBackend,
+    DuckDBBackend.name: DuckDBBackend,
+}
+
+
+def from_spec(spec):
+    """ Returns a backend for a "name" or "name:path" spec."""
+    name, _, path = spec.partition(":")
+    if name == PostgresBackend.name:
+        return PostgresBackend()
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend: {}".format(spec))
+    if not path:
+        raise ValueError("Backend {} needs a path, e.g. {}:FILE".format(name, name))
+    return BACKENDS[name](path)
+
+
+def set_backend(spec):
+    """ Switches to the backend described by spec."""
+    STATE["backend"] = from_spec(spec)
+    STATE["spec"] = spec
+    STATE["pid"] = os.getpid()
+
+
+def backend():
+    """ Returns this process's backend, creating it if necessary.
+    Connections are not shared across forks, so a child opens its own. """
+    if STATE["backend"] is None or STATE["pid"] != os.getpid():
+        set_backend(STATE["spec"])
+    return STATE["backend"]
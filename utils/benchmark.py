@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+""" Times the weekly results pipeline against synthetic match data.
+
+Backends:
+  memory   - generation and in-memory aggregation only
+  sqlite   - a throwaway SQLite file stands in for the database
+  postgres - the real pipeline against --database (rows are written to it!);
+             missing tables are created and migrations applied first
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from utils.cardinality import CREATE_SKETCHES_TABLE
+from utils.facts import CREATE_FACTS_TABLE
+from utils.results_cacher import (
+    CREATE_DIRTY_WEEKS_TABLE,
+    CREATE_RESULTS_TABLE,
+    WEEK_MATCHES_SQL_TEMPLATE,
+    WeekAggregate,
+)
+from utils.streaks import CREATE_STREAKS_TABLE
+from utils.tools import last_time_breakpoint, SEVEN_DAYS_OF_SECONDS
+from utils.update import CREATE_MATCH_TABLE, MATCH_COLUMNS
+
+CIV_COUNT = 39
+OTHER_MAP_TYPES = (11, 12, 17, 19, 21, 23, 33, 71, 72, 77, 87, 140, 149, 167)
+TEAM_SIZE_WEIGHTS = {1: 55, 2: 20, 3: 12, 4: 13}
+MAP_TYPE_WEIGHTS = {9: 45, 29: 15, None: 40}  # None: one of OTHER_MAP_TYPES
+UNRATED_PCT = 0.03
+RATING_MEAN = 1100
+RATING_STDEV = 250
+
+# data/schema.sql's tables with the keys save_matches and save_civs
+# conflict on; the CREATE_*_TABLE constants of those modules are SQLite's
+POSTGRES_TABLES = (
+    """CREATE TABLE IF NOT EXISTS matches (
+id bigserial PRIMARY KEY,
+match_id text,
+player_id integer,
+rating integer,
+civ_id smallint,
+map_type smallint,
+rating_type smallint,
+started integer,
+version text,
+won boolean,
+mirror boolean,
+team_size smallint,
+game_type smallint,
+finished integer,
+UNIQUE(match_id, player_id))""",
+    """CREATE TABLE IF NOT EXISTS results (
+id bigserial PRIMARY KEY,
+week text,
+civ_id text,
+team_size text,
+map_category text,
+methodology text,
+metric text,
+compound boolean,
+rank smallint,
+pct numeric(6,5),
+UNIQUE(week, civ_id, team_size, map_category, methodology, metric, compound))""",
+    """CREATE TABLE IF NOT EXISTS week_counts (
+id bigserial PRIMARY KEY,
+week text UNIQUE,
+match_count integer)""",
+    CREATE_DIRTY_WEEKS_TABLE,
+    CREATE_FACTS_TABLE,
+    CREATE_STREAKS_TABLE,
+    CREATE_SKETCHES_TABLE,
+)
+
+# what an earlier run left in the benchmark week
+RESET_WEEK_SQL = (
+    "DELETE FROM matches WHERE started >= %s AND started < %s",
+    "DELETE FROM weekly_facts WHERE week = %s",
+    "DELETE FROM weekly_sketches WHERE week = %s",
+)
+
+
+class SyntheticMatches:
+    """ Generates match rows in the save_matches column order.
+    Civ and player popularity follow a Zipf-like curve. """
+
+    def __init__(self, seed=0, players=20000):
+        self.random = random.Random(seed)
+        self.players = players
+        self.civ_weights = [1.0 / rank ** 0.6 for rank in range(1, CIV_COUNT + 1)]
+        self.civ_ids = list(range(1, CIV_COUNT + 1))
+        self.random.shuffle(self.civ_ids)
+        self.ratings = {}
+
+    def _weighted(self, weights):
+        return self.random.choices(list(weights), list(weights.values()))[0]
+
+    def _player(self):
+        player_id = int(self.random.paretovariate(1.2) * 1000) % self.players + 1
+        if player_id not in self.ratings:
+            if self.random.random() < UNRATED_PCT:
+                self.ratings[player_id] = None
+            else:
+                rating = self.random.gauss(RATING_MEAN, RATING_STDEV)
+                self.ratings[player_id] = max(100, int(rating))
+        return player_id, self.ratings[player_id]
+
+    def match(self, match_id, started):
+        """ Returns the rows of one match."""
+        team_size = self._weighted(TEAM_SIZE_WEIGHTS)
+        map_type = self._weighted(MAP_TYPE_WEIGHTS)
+        if map_type is None:
+            map_type = self.random.choice(OTHER_MAP_TYPES)
+        finished = started + int(self.random.lognormvariate(7.3, 0.45))
+        rating_type = 2 if team_size == 1 else 4
+        winner = self.random.random() < 0.5
+        seen = set()
+        rows = []
+        for team in (True, False):
+            for _ in range(team_size):
+                player_id, rating = self._player()
+                while player_id in seen:
+                    player_id, rating = self._player()
+                seen.add(player_id)
+                civ_id = self.random.choices(self.civ_ids, self.civ_weights)[0]
+                rows.append(
+                    [
+                        str(match_id),
+                        map_type,
+                        rating_type,
+                        "54684",
+                        started,
+                        finished,
+                        team_size,
+                        0,
+                        player_id,
+                        civ_id,
+                        rating,
+                        team == winner,
+                    ]
+                )
+        mirror = len({row[9] for row in rows}) == 1
+        for row in rows:
+            row.append(mirror)
+        return rows
+
+    def rows(self, count, start, end):
+        """ Returns rows of count matches started evenly-ish in [start, end)."""
+        rows = []
+        for match_id in range(1, count + 1):
+            rows.extend(self.match(match_id, self.random.randrange(start, end)))
+        return rows
+
+
+class Timer:
+    """ Collects stage timings."""
+
+    def __init__(self, repeat=1):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, stage, items, func, *args):
+        """ Runs func repeat times, recording seconds. Returns the last result."""
+        seconds = []
+        result = None
+        for _ in range(self.repeat):
+            begin = time.perf_counter()
+            result = func(*args)
+            seconds.append(time.perf_counter() - begin)
+        self.results[stage] = {
+            "items": items,
+            "median": statistics.median(seconds),
+            "max": max(seconds),
+            "throughput": items / (statistics.median(seconds) or 1e-9),
+        }
+        return result
+
+    def report(self):
+        """ Prints a table of results."""
+        template = "{:16} {:>10} {:>11} {:>11} {:>14}"
+        print(template.format("Stage", "Items", "Median (s)", "Max (s)", "Items/s"))
+        for stage, result in self.results.items():
+            print(
+                "{:16} {:>10} {:>11.4f} {:>11.4f} {:>14.0f}".format(
+                    stage,
+                    result["items"],
+                    result["median"],
+                    result["max"],
+                    result["throughput"],
+                )
+            )
+
+
+def regressions(results, baseline, tolerance):
+    """ Returns messages for stages slower than baseline by more than tolerance.
+    tolerance: allowed fractional slowdown, e.g. 0.2 for 20% """
+    messages = []
+    for stage, expected in baseline.items():
+        if stage not in results:
+            continue
+        allowed = expected["median"] * (1 + tolerance)
+        actual = results[stage]["median"]
+        if actual > allowed:
+            messages.append(
+                "{}: {:.4f}s slower than baseline {:.4f}s (+{:.0f}% allowed)".format(
+                    stage, actual, expected["median"], 100 * tolerance
+                )
+            )
+    return messages
+
+
+def renumbered(rows, run):
+    """ rows with match ids unique to a run, so every run inserts."""
+    return [["{}{:09d}".format(run, int(row[0]))] + row[1:] for row in rows]
+
+
+def aggregate(rows):
+    """ The in-memory part of results_cacher.week_civilizations."""
+    ordered = sorted(
+        (
+            (row[0], row[11], row[8], row[9], row[12], row[6], row[1])
+            for row in rows
+        ),
+        key=lambda row: (row[0], row[1], row[2]),
+    )
+    return WeekAggregate().load(ordered).civilizations()
+
+
+def run_memory(timer, rows):
+    """ Stages that need no database."""
+    timer.time("aggregate", len(rows), aggregate, rows)
+
+
+def run_sqlite(timer, rows, timebox):
+    """ Stages against a temporary SQLite database."""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    conn.execute(CREATE_MATCH_TABLE)
+    conn.execute(CREATE_RESULTS_TABLE)
+    insert_sql = "INSERT OR IGNORE INTO matches ({}) VALUES ({})".format(
+        MATCH_COLUMNS, ", ".join(["?"] * len(rows[0]))
+    )
+
+    def load():
+        conn.execute("DELETE FROM matches")
+        conn.executemany(insert_sql, rows)
+        conn.commit()
+
+    def scan():
+        return conn.execute(WEEK_MATCHES_SQL_TEMPLATE.format(*timebox)).fetchall()
+
+    timer.time("load", len(rows), load)
+    week_rows = timer.time("week_scan", len(rows), scan)
+    civs = timer.time(
+        "aggregate",
+        len(week_rows),
+        lambda: WeekAggregate().load(week_rows).civilizations(),
+    )
+    week = datetime.fromtimestamp(timebox[0], tz=timezone.utc).strftime("%Y%m%d")
+    results_sql = """INSERT OR REPLACE INTO results
+(week, civ_id, team_size, map_category, methodology, metric,
+compound, rank, pct, sample_size) VALUES ({})""".format(
+        ", ".join(["?"] * 10)
+    )
+
+    def save():
+        conn.executemany(
+            results_sql, [[week] + civ.info() + [civ.sample_size] for civ in civs]
+        )
+        conn.commit()
+
+    timer.time("save_results", len(civs), save)
+
+    def report():
+        sql = """SELECT civ_id, pct, rank FROM results
+WHERE week = ? AND team_size = ? AND map_category = ? AND methodology = ?
+AND metric = ?"""
+        found = 0
+        for category in ("All", "Arabia", "Arena", "Others"):
+            for metric in ("popularity", "winrate"):
+                params = (week, "1v1", category, "player", metric)
+                found += len(conn.execute(sql, params).fetchall())
+        return found
+
+    timer.time("report", 8, report)
+    conn.close()
+    os.remove(path)
+
+
+def prepare_postgres(timebox):
+    """ Creates missing tables, applies migrations and empties the week."""
+    # imported here so memory and sqlite runs never open a connection
+    from utils.db import cursor
+    from utils.migrations import migrate
+
+    week = datetime.fromtimestamp(timebox[0], tz=timezone.utc).strftime("%Y%m%d")
+    with cursor(commit=True) as cur:
+        for sql in POSTGRES_TABLES:
+            cur.execute(sql)
+    migrate()
+    with cursor(commit=True) as cur:
+        cur.execute(RESET_WEEK_SQL[0], timebox)
+        for sql in RESET_WEEK_SQL[1:]:
+            cur.execute(sql, (week,))
+
+
+def run_postgres(timer, rows, timebox, database):
+    """ Stages of the real pipeline against database."""
+    # imported here so memory and sqlite runs never open a connection
+    import utils.db
+    from report import arg_parser, ReportManager
+    from utils.results_cacher import save_civs, week_civilizations
+    from utils.update import save_matches
+
+    utils.db.DATABASE = database
+    prepare_postgres(timebox)
+    runs = iter([renumbered(rows, run) for run in range(1, timer.repeat + 1)])
+    timer.time("save_matches", len(rows), lambda: save_matches(next(runs), None))
+    # the week holds every run's rows by now
+    civs = timer.time(
+        "week_results", len(rows) * timer.repeat, week_civilizations, timebox
+    )
+    timer.time("save_results", len(civs), save_civs, civs, timebox)
+    # the written week is "this week" of a report generated a day after it
+    endtime = datetime.fromtimestamp(timebox[1]) + timedelta(days=1)
+
+    def report():
+        ReportManager(arg_parser().parse_args([])).generate(endtime)
+
+    timer.time("report", 1, report)
+
+
+def run():
+    """ Parse arguments and run the benchmark."""
+    parser = ArgumentParser()
+    parser.add_argument("--matches", type=int, default=20000, help="Matches per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage")
+    parser.add_argument(
+        "--backend", choices=("memory", "sqlite", "postgres"), default="sqlite"
+    )
+    parser.add_argument(
+        "--database", default="aoe2stats_bench", help="Postgres database to write to"
+    )
+    parser.add_argument("--baseline", help="JSON file of stage timings to compare to")
+    parser.add_argument(
+        "--save-baseline", help="Write this run's stage timings to a JSON file"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed slowdown vs baseline"
+    )
+    args = parser.parse_args()
+
+    wednesday = last_time_breakpoint(datetime.now()) - timedelta(days=7)
+    timebox = (wednesday.timestamp(), wednesday.timestamp() + SEVEN_DAYS_OF_SECONDS)
+    timer = Timer(args.repeat)
+    rows = timer.time(
+        "generate",
+        args.matches,
+        lambda: SyntheticMatches(args.seed).rows(
+            args.matches, int(timebox[0]), int(timebox[1])
+        ),
+    )
+    print("Generated {} rows for {} matches".format(len(rows), args.matches))
+
+    if args.backend == "memory":
+        run_memory(timer, rows)
+    elif args.backend == "sqlite":
+        run_sqlite(timer, rows, timebox)
+    else:
+        run_postgres(timer, rows, timebox, args.database)
+    timer.report()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as open_file:
+            json.dump(timer.results, open_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as open_file:
+            baseline = json.load(open_file)
+        messages = regressions(timer.results, baseline, args.tolerance)
+        for message in messages:
+            print("REGRESSION", message)
+        if messages:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+""" Process-wide pool of connections to the aoe2stats database. """
+import atexit
+from contextlib import contextmanager
+from itertools import count
+import os
+
+import psycopg2
+import psycopg2.pool
+
+DATABASE = "aoe2stats"
+MIN_CONNECTIONS = 1
+DEFAULT_POOL_SIZE = 5
+DEFAULT_ITERSIZE = 10000
+
+CURSOR_NAMES = count()
+
+POOL_STATE = {
+    "pool": None,
+    "pid": None,
+    "size": int(os.environ.get("AOE2STATS_POOL_SIZE", DEFAULT_POOL_SIZE)),
+}
+
+
+def set_pool_size(size):
+    """ Sets the maximum number of pooled connections.
+    Takes effect the next time the pool is created. """
+    if size < MIN_CONNECTIONS:
+        raise ValueError("Pool size must be at least {}".format(MIN_CONNECTIONS))
+    close_pool()
+    POOL_STATE["size"] = size
+
+
+def pool():
+    """ Returns the pool for this process, creating it if necessary.
+    Connections are not shared across forks, so a child gets its own pool. """
+    if POOL_STATE["pool"] is None or POOL_STATE["pid"] != os.getpid():
+        POOL_STATE["pool"] = psycopg2.pool.ThreadedConnectionPool(
+            MIN_CONNECTIONS, POOL_STATE["size"], database=DATABASE
+        )
+        POOL_STATE["pid"] = os.getpid()
+    return POOL_STATE["pool"]
+
+
+def close_pool():
+    """ Closes every pooled connection owned by this process."""
+    if POOL_STATE["pool"] is not None and POOL_STATE["pid"] == os.getpid():
+        POOL_STATE["pool"].closeall()
+    POOL_STATE["pool"] = None
+    POOL_STATE["pid"] = None
+
+
+atexit.register(close_pool)
+
+
+@contextmanager
+def connection():
+    """ Borrows a connection from the pool.
+    Rolls back on error; always returns the connection. """
+    connection_pool = pool()
+    conn = connection_pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        connection_pool.putconn(conn, close=bool(conn.closed))
+
+
+@contextmanager
+def cursor(commit=False):
+    """ Yields a cursor on a pooled connection.
+    commit: commit the transaction if the block finishes cleanly """
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            if commit:
+                conn.commit()
+        finally:
+            cur.close()
+
+
+@contextmanager
+def server_cursor(itersize=DEFAULT_ITERSIZE):
+    """ Yields a named (server-side) cursor on a pooled connection.
+    Rows are fetched from the server itersize at a time. """
+    with connection() as conn:
+        name = "aoe2stats_{}_{}".format(os.getpid(), next(CURSOR_NAMES))
+        cur = conn.cursor(name=name)
+        cur.itersize = itersize
+        try:
+            yield cur
+        finally:
+            cur.close()
+            if not conn.closed:
+                conn.rollback()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+""" Pre-aggregated weekly counts of matches rows, kept up to date by ingest.
+
+Each weekly_facts row counts the matches rows sharing a week, civ_id,
+map_type, team_size, game_type, rating band, won and mirror. Unknown ids
+and missing ratings are stored as UNKNOWN so they can be part of the key."""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+
+from utils.db import cursor
+from utils.tools import execute_sql, placeholders, SEVEN_DAYS_OF_SECONDS
+
+UNKNOWN = -1
+
+RATING_BAND_WIDTH = 50
+
+# 1970-01-07 01:00 UTC, the first Wednesday breakpoint after the epoch
+FIRST_BREAKPOINT = 522000
+
+FACT_KEYS = (
+    "week",
+    "civ_id",
+    "map_type",
+    "team_size",
+    "game_type",
+    "rating_band",
+    "won",
+    "mirror",
+)
+
+CREATE_FACTS_TABLE = """CREATE TABLE IF NOT EXISTS weekly_facts (
+week text,
+civ_id smallint,
+map_type smallint,
+team_size smallint,
+game_type smallint,
+rating_band smallint,
+won boolean,
+mirror boolean,
+cnt integer,
+PRIMARY KEY(week, civ_id, map_type, team_size, game_type, rating_band, won, mirror))"""
+
+WEEK_SQL = """to_char(to_timestamp(started - ((started - {0}) % {1}))
+AT TIME ZONE 'UTC', 'YYYYMMDD')""".format(
+    FIRST_BREAKPOINT, SEVEN_DAYS_OF_SECONDS
+)
+
+RATING_BAND_SQL = "COALESCE(rating / {0} * {0}, {1})".format(RATING_BAND_WIDTH, UNKNOWN)
+
+FACTS_INSERT_SQL_TEMPLATE = """INSERT INTO weekly_facts ({keys}, cnt)
+SELECT {week}, COALESCE(civ_id, {unknown}), COALESCE(map_type, {unknown}),
+COALESCE(team_size, {unknown}), COALESCE(game_type, {unknown}), {band}, won,
+mirror, COUNT(*)
+FROM {{source}}
+{{where}}
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+ON CONFLICT ({keys})
+DO UPDATE SET cnt = weekly_facts.cnt + EXCLUDED.cnt""".format(
+    keys=", ".join(FACT_KEYS), week=WEEK_SQL, unknown=UNKNOWN, band=RATING_BAND_SQL
+)
+
+
+def facts_insert_sql(source, where=""):
+    """ Returns sql adding the rows of source (a table or CTE with
+    matches columns) to weekly_facts. """
+    return FACTS_INSERT_SQL_TEMPLATE.format(source=source, where=where)
+
+
+def week_of(started):
+    """ Python equivalent of WEEK_SQL: the Ymd breakpoint week of started."""
+    week_start = started - ((started - FIRST_BREAKPOINT) % SEVEN_DAYS_OF_SECONDS)
+    return datetime.fromtimestamp(week_start, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def rating_band(rating):
+    """ Python equivalent of RATING_BAND_SQL: lower bound of the rating's band."""
+    if rating is None:
+        return UNKNOWN
+    return rating // RATING_BAND_WIDTH * RATING_BAND_WIDTH
+
+
+def rebuild_facts(weeks=None):
+    """ Recomputes weekly_facts from matches for the given Ymd weeks
+    (or everything) in one transaction. """
+    with cursor(commit=True) as cur:
+        cur.execute(CREATE_FACTS_TABLE)
+        if weeks is None:
+            cur.execute("DELETE FROM weekly_facts")
+            cur.execute(facts_insert_sql("matches"))
+            return
+        for week in weeks:
+            start = datetime.strptime(week, "%Y%m%d").replace(
+                hour=1, tzinfo=timezone.utc
+            )
+            where = "WHERE started >= {:0.0f} AND started < {:0.0f}".format(
+                start.timestamp(), (start + timedelta(days=7)).timestamp()
+            )
+            cur.execute("DELETE FROM weekly_facts WHERE week = %s", (week,))
+            cur.execute(facts_insert_sql("matches", where))
+
+
+def ensure_facts(weeks):
+    """ Rebuilds the Ymd weeks that have no weekly_facts yet, e.g. weeks
+    ingested before the table existed. """
+    sql = "SELECT DISTINCT week FROM weekly_facts WHERE week IN ({})".format(
+        placeholders(weeks)
+    )
+    found = {week for (week,) in execute_sql(sql, values=list(weeks))}
+    missing = [week for week in weeks if week not in found]
+    if missing:
+        rebuild_facts(missing)
+
+
+def fact_counts(columns, where=None):
+    """ Generator of (*columns, count) rows summed over weekly_facts.
+    columns: fact keys to group by
+    where: list of sql conditions on fact keys """
+    for column in columns:
+        if column not in FACT_KEYS:
+            raise ValueError("Unknown fact column: {}".format(column))
+    group = ", ".join(columns)
+    sql = "SELECT {}{}SUM(cnt) FROM weekly_facts".format(group, ", " if group else "")
+    if where:
+        sql += " WHERE {}".format(" AND ".join(where))
+    if group:
+        sql += " GROUP BY {}".format(group)
+    return execute_sql(sql)
+
+
+def run():
+    """ Rebuild facts from the command line."""
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--week", action="append", help="Ymd week to rebuild (default all)"
+    )
+    args = parser.parse_args()
+    rebuild_facts(args.week)
+
+
+if __name__ == "__main__":
+    run()
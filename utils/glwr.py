@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+""" Per-player, per-civ, per-game-length win tallies for analyze_glwr.
+
+One pass (a GROUP BY in the database, or a vectorized scan of the Parquet
+snapshot) reduces the matches of a timebox to
+    (player_id, civ_id, bucket) -> (wins, games)
+which is cached under cache/glwr, one file per timebox, map and elo band.
+Plots are computed from the tallies, never from the matches. """
+import os
+import zlib
+
+import numpy as np
+import pyarrow.dataset as ds
+
+from utils import snapshot
+from utils.tools import execute_sql
+
+CACHE_DIR = "cache/glwr"
+
+ARABIA = 9
+
+# game length boundaries in seconds: 22, 37 and 60 game minutes
+BUCKET_EDGES = (776, 1306, 2118)
+BUCKET_COUNT = len(BUCKET_EDGES) + 1
+
+# shorter matches were probably civ-unrelated Dark Age shenanigans or
+# rage quitting
+MIN_LENGTH = 353
+
+AGGREGATE_SQL = """SELECT player_id, civ_id,
+CASE WHEN finished - started < {edges[0]} THEN 0
+WHEN finished - started < {edges[1]} THEN 1
+WHEN finished - started < {edges[2]} THEN 2
+ELSE 3 END AS bucket,
+SUM(CAST(won AS INT)), COUNT(*)
+FROM matches
+WHERE game_type = 0
+AND team_size = 1
+AND map_type = {map_type}
+AND started BETWEEN {start:0.0f} AND {end:0.0f}
+AND finished - started >= {min_length}
+AND won IS NOT NULL
+AND civ_id IS NOT NULL{elo}
+GROUP BY player_id, civ_id, bucket"""
+
+FIELDS = ("player_ids", "civ_ids", "buckets", "wins", "games")
+
+
+class Tallies:
+    """ Parallel arrays of (player_id, civ_id, bucket, wins, games)."""
+
+    def __init__(self, player_ids, civ_ids, buckets, wins, games):
+        self.player_ids = np.asarray(player_ids, dtype=np.int64)
+        self.civ_ids = np.asarray(civ_ids, dtype=np.int64)
+        self.buckets = np.asarray(buckets, dtype=np.int64)
+        self.wins = np.asarray(wins, dtype=np.int64)
+        self.games = np.asarray(games, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ From AGGREGATE_SQL rows."""
+        columns = list(zip(*rows)) or [[] for _ in FIELDS]
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.games)
+
+    def save(self, filename):
+        """ Writes the tallies to an .npz file."""
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        np.savez(filename, **{field: getattr(self, field) for field in FIELDS})
+
+    @classmethod
+    def load(cls, filename):
+        """ Reads tallies written by save."""
+        with np.load(filename) as data:
+            return cls(*[data[field] for field in FIELDS])
+
+    def civs(self):
+        """ Returns {civ_id: CivAxes}."""
+        return {
+            int(civ_id): CivAxes(int(civ_id), *civ_axes(self, civ_id))
+            for civ_id in np.unique(self.civ_ids)
+        }
+
+
+class CivAxes:
+    """ What analyze_glwr plots for a civ."""
+
+    def __init__(self, civ_id, y_values, average):
+        self.civ_id = civ_id
+        self.y_values = y_values
+        self.average = average
+
+    def axes(self):
+        """ Returns x values (buckets), y values (mean player win rate in
+        each bucket) and the civ's overall win rate. """
+        return list(range(BUCKET_COUNT)), list(self.y_values), self.average
+
+
+def civ_axes(tallies, civ_id):
+    """ Returns the mean of the players' win rates in each bucket (NaN for an
+    empty bucket) and the overall win rate of civ_id. """
+    mask = tallies.civ_ids == civ_id
+    buckets = tallies.buckets[mask]
+    rates = tallies.wins[mask] / tallies.games[mask]
+    players = np.bincount(buckets, minlength=BUCKET_COUNT)
+    totals = np.bincount(buckets, weights=rates, minlength=BUCKET_COUNT)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y_values = totals / players
+    average = tallies.wins[mask].sum() / tallies.games[mask].sum()
+    return y_values, float(average)
+
+
+def buckets_of(lengths):
+    """ Bucket of each game length in seconds."""
+    return np.searchsorted(np.asarray(BUCKET_EDGES), lengths, side="right")
+
+
+def elo_condition(elo):
+    """ SQL condition for an (low, high) rating band; either may be None."""
+    low, high = elo
+    condition = ""
+    if low is not None:
+        condition += "\nAND rating >= {:d}".format(low)
+    if high is not None:
+        condition += "\nAND rating < {:d}".format(high)
+    return condition
+
+
+def database_tallies(start, end, map_type=ARABIA, elo=(None, None)):
+    """ Tallies from a GROUP BY in the database."""
+    sql = AGGREGATE_SQL.format(
+        edges=BUCKET_EDGES,
+        map_type=map_type,
+        start=start,
+        end=end,
+        min_length=MIN_LENGTH,
+        elo=elo_condition(elo),
+    )
+    return Tallies.from_rows(execute_sql(sql))
+
+
+def snapshot_tallies(start, end, map_type=ARABIA, elo=(None, None), directory=None):
+    """ Tallies from the Parquet snapshot in directory."""
+    filters = [
+        ds.field("game_type") == 0,
+        ds.field("team_size") == 1,
+        ds.field("map_type") == map_type,
+        snapshot.timebox_filter(start, end),
+        ds.field("won").is_valid(),
+        ds.field("civ_id").is_valid(),
+    ]
+    low, high = elo
+    if low is not None:
+        filters.append(ds.field("rating") >= low)
+    if high is not None:
+        filters.append(ds.field("rating") < high)
+    table = snapshot.scan(
+        ("player_id", "civ_id", "started", "finished", "won"),
+        filters,
+        directory or snapshot.SNAPSHOT_DIR,
+    )
+    columns = {name: table.column(name).to_numpy() for name in table.column_names}
+    lengths = columns["finished"] - columns["started"]
+    keep = lengths >= MIN_LENGTH
+    keys = np.stack(
+        [
+            columns["player_id"][keep],
+            columns["civ_id"][keep],
+            buckets_of(lengths[keep]),
+        ]
+    )
+    if not keys.shape[1]:
+        return Tallies.from_rows([])
+    unique, inverse = np.unique(keys, axis=1, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    wins = np.bincount(inverse, weights=columns["won"][keep].astype(int))
+    games = np.bincount(inverse)
+    return Tallies(unique[0], unique[1], unique[2], wins, games)
+
+
+def cache_filename(start, end, map_type, elo, source, cache_dir=CACHE_DIR):
+    """ Where the tallies for these arguments are cached."""
+    low, high = ["" if bound is None else bound for bound in elo]
+    return os.path.join(
+        cache_dir,
+        "{}_{:0.0f}_{:0.0f}_m{}_elo{}-{}.npz".format(
+            source, start, end, map_type, low, high
+        ),
+    )
+
+
+def tallies(
+    start,
+    end,
+    map_type=ARABIA,
+    elo=(None, None),
+    directory=None,
+    refresh=False,
+    cache_dir=CACHE_DIR,
+):
+    """ Tallies for the timebox, from the cache if they were computed before.
+    directory: read this Parquet snapshot instead of the database """
+    source = "db"
+    if directory:
+        source = "snapshot{:08x}".format(
+            zlib.crc32(os.path.abspath(directory).encode())
+        )
+    filename = cache_filename(start, end, map_type, elo, source, cache_dir)
+    if not refresh and os.path.exists(filename):
+        return Tallies.load(filename)
+    if directory:
+        result = snapshot_tallies(start, end, map_type, elo, directory)
+    else:
+        result = database_tallies(start, end, map_type, elo)
+    result.save(filename)
+    return result
@@ -86,8 +86,8 @@ RANKED_MAP_POOLS = {
 }
 
 
-def map_type_filter(week, size):
-    """ Returns AND clause to make sure map type in a week."""
+def map_type_condition(week, size):
+    """ Returns the condition that map type is in the pool of a week."""
     category = "team" if size > 1 else "1v1"
     last_week = week
     for pool_week in sorted(RANKED_MAP_POOLS[category]):
@@ -96,7 +96,12 @@ def map_type_filter(week, size):
         else:
             break
     map_pool = [str(_map) for _map in RANKED_MAP_POOLS[category][last_week]]
-    return "AND map_type in ({})".format(",".join(map_pool))
+    return "map_type in ({})".format(",".join(map_pool))
+
+
+def map_type_filter(week, size):
+    """ Returns AND clause to make sure map type in a week."""
+    return "AND " + map_type_condition(week, size)
 
 
 def ids_from_names(names):
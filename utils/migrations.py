@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+""" Schema migrations for the indexes the hot queries rely on, and an
+EXPLAIN ANALYZE check of those queries.
+
+Migrations are applied in order and recorded in schema_migrations, so
+running this repeatedly only applies what is new."""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+import json
+
+import psycopg2
+
+from utils.cardinality import CREATE_SKETCHES_TABLE
+from utils.db import cursor
+from utils.streaks import CREATE_STREAKS_TABLE
+from utils.tools import last_time_breakpoint
+
+CREATE_MIGRATIONS_TABLE = """CREATE TABLE IF NOT EXISTS schema_migrations (
+name text PRIMARY KEY,
+applied timestamptz DEFAULT now())"""
+
+APPLIED_MIGRATIONS_SQL = "SELECT name FROM schema_migrations"
+
+RECORD_MIGRATION_SQL = "INSERT INTO schema_migrations (name) VALUES (%s)"
+
+MIGRATIONS = (
+    # every weekly query filters on started; rows arrive roughly in started
+    # order so a BRIN index stays tiny and still prunes most of the table
+    (
+        "0001_matches_started_brin",
+        "CREATE INDEX IF NOT EXISTS matches_started_brin ON matches USING brin (started)",
+    ),
+    # per-player lookups (smurf.py, the seeders)
+    (
+        "0002_matches_player_started",
+        """CREATE INDEX IF NOT EXISTS matches_player_started
+ON matches (player_id, started)""",
+    ),
+    # results_cacher only reads ranked (game_type = 0) games
+    (
+        "0003_matches_ranked_started",
+        """CREATE INDEX IF NOT EXISTS matches_ranked_started
+ON matches (started, team_size, map_type) WHERE game_type = 0""",
+    ),
+    (
+        "0004_matches_ranked_1v1_player",
+        """CREATE INDEX IF NOT EXISTS matches_ranked_1v1_player
+ON matches (player_id, started) WHERE game_type = 0 AND team_size = 1""",
+    ),
+    # report.py looks results up by week and category
+    (
+        "0005_results_week_category",
+        """CREATE INDEX IF NOT EXISTS results_week_category
+ON results (week, team_size, map_category, methodology, metric)""",
+    ),
+    # podcast.py reads streaks instead of walking back through results
+    ("0006_streaks", CREATE_STREAKS_TABLE),
+    # distinct player and match estimates (utils.cardinality)
+    ("0007_weekly_sketches", CREATE_SKETCHES_TABLE),
+)
+
+
+def pending_migrations(applied):
+    """ Returns the (name, sql) migrations not in applied, in order."""
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def migrate():
+    """ Applies pending migrations, each in its own transaction.
+    Returns the names applied. """
+    with cursor(commit=True) as cur:
+        cur.execute(CREATE_MIGRATIONS_TABLE)
+        cur.execute(APPLIED_MIGRATIONS_SQL)
+        applied = {name for (name,) in cur.fetchall()}
+    names = []
+    for name, sql in pending_migrations(applied):
+        print("Applying", name)
+        with cursor(commit=True) as cur:
+            cur.execute(sql)
+            cur.execute(RECORD_MIGRATION_SQL, (name,))
+        names.append(name)
+    return names
+
+
+def sequential_scans(plan):
+    """ Returns the relations read by a Seq Scan anywhere in an
+    EXPLAIN (FORMAT JSON) plan node. """
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        scans.extend(sequential_scans(child))
+    return scans
+
+
+def hot_queries(week):
+    """ Returns {name: sql or (sql, values)} of the queries worth checking,
+    filled in for the Ymd week. """
+    # imported here so migrating needs none of the report modules
+    import report
+    import smurf
+    from utils import results_cacher
+    from utils.trends import results_query
+
+    timebox = results_cacher.week_timebox(week)
+    category_filter = results_cacher.CATEGORY_FILTERS["All 1v1"]
+    queries = {}
+    for name, template in results_cacher.QUERIES.items():
+        queries["results_cacher." + name] = template.format(*timebox, category_filter)
+    queries["report.RESULTS_SQL"] = results_query(
+        (week,), "1v1", report.CATEGORIES, "player", ("popularity", "winrate"), False
+    )
+    queries["smurf.SQL"] = smurf.SQL.format(*timebox)
+    return queries
+
+
+def explain(queries):
+    """ Generator of (name, sequential scan relations, error) for each
+    query run under EXPLAIN ANALYZE. """
+    for name, query in queries.items():
+        sql, values = query if isinstance(query, tuple) else (query, None)
+        with cursor() as cur:
+            try:
+                cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, values)
+            except psycopg2.Error as error:
+                yield name, [], str(error).strip().splitlines()[0]
+                continue
+            (result,) = cur.fetchone()
+        if isinstance(result, str):
+            result = json.loads(result)
+        yield name, sequential_scans(result[0]["Plan"]), None
+
+
+def run():
+    """ Migrate or explain from the command line."""
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="EXPLAIN ANALYZE the hot queries instead of migrating",
+    )
+    parser.add_argument("--week", help="Ymd week to explain (default last week)")
+    args = parser.parse_args()
+    if not args.explain:
+        applied = migrate()
+        print("Applied {} migration(s)".format(len(applied)))
+        return
+    week = args.week
+    if not week:
+        week = (last_time_breakpoint(datetime.now()) - timedelta(days=7)).strftime(
+            "%Y%m%d"
+        )
+    for name, scans, error in explain(hot_queries(week)):
+        if error:
+            print("{:40} ERROR {}".format(name, error))
+        elif scans:
+            print("{:40} SEQ SCAN on {}".format(name, ", ".join(sorted(set(scans)))))
+        else:
+            print("{:40} ok".format(name))
+
+
+if __name__ == "__main__":
+    run()
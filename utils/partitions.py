@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+""" Weekly range partitions of matches on started.
+
+Each partition holds one Wednesday 01:00 UTC breakpoint week, so queries
+bounded to a timebox only read the partitions of the weeks they touch.
+Rows outside every partition land in matches_default.
+
+    python -m utils.partitions --migrate   # convert an existing matches table
+    python -m utils.partitions --ahead 4   # create the next four weeks now
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+import re
+
+from utils.db import cursor
+from utils.facts import week_of
+from utils.migrations import MIGRATIONS
+from utils.results_cacher import week_timebox
+from utils.tools import SEVEN_DAYS_OF_SECONDS
+
+PARTITION_TEMPLATE = "matches_w{}"
+
+DEFAULT_PARTITION = "matches_default"
+
+# weeks past the newest ingested one that get a partition in advance
+WEEKS_AHEAD = 2
+
+IS_PARTITIONED_SQL = """SELECT relkind = 'p' FROM pg_class
+WHERE oid = to_regclass('matches')"""
+
+CREATE_PARTITION_SQL = """CREATE TABLE IF NOT EXISTS {0}
+PARTITION OF {1} FOR VALUES FROM ({2:0.0f}) TO ({3:0.0f})"""
+
+CREATE_DEFAULT_PARTITION_SQL = (
+    "CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} DEFAULT"
+)
+
+# the indexes, which carry the primary key and unique constraints, are
+# added again below with started in them
+CREATE_PARTITIONED_TABLE_SQL = """CREATE TABLE {0}
+(LIKE matches INCLUDING ALL EXCLUDING INDEXES)
+PARTITION BY RANGE (started)"""
+
+# the partition key has to be part of every unique constraint; a player's
+# row of a match always has the same started so duplicates still conflict
+CREATE_KEYS_SQL = (
+    "ALTER TABLE {0} ADD PRIMARY KEY (id, started)",
+    "ALTER TABLE {0} ADD UNIQUE (match_id, player_id, started)",
+)
+
+ID_SEQUENCE_SQL = "SELECT pg_get_serial_sequence('matches', 'id')"
+
+# the new matches keeps using the id sequence; owning it keeps it from
+# being dropped along with matches_unpartitioned
+OWN_SEQUENCE_SQL = "ALTER SEQUENCE {0} OWNED BY matches.id"
+
+STARTED_RANGE_SQL = "SELECT MIN(started), MAX(started) FROM matches"
+
+COPY_WEEK_SQL = """INSERT INTO {0} SELECT * FROM matches
+WHERE started >= {1:0.0f} AND started < {2:0.0f}
+ON CONFLICT DO NOTHING"""
+
+COPY_REST_SQL = """INSERT INTO {0} SELECT * FROM matches
+WHERE started < {1:0.0f} OR started >= {2:0.0f}
+ON CONFLICT DO NOTHING"""
+
+# rows without started cannot be part of the primary key
+NULL_STARTED_SQL = "SELECT COUNT(*) FROM matches WHERE started IS NULL"
+
+SWAP_SQL = (
+    "ALTER TABLE matches RENAME TO matches_unpartitioned",
+    "ALTER TABLE {0} RENAME TO matches",
+)
+
+RENAME_INDEX_SQL = "ALTER INDEX IF EXISTS {0} RENAME TO {0}_unpartitioned"
+
+MATCHES_INDEX_PATTERN = re.compile(r"INDEX IF NOT EXISTS (\w+)\s+ON matches\b")
+
+KNOWN = {"partitioned": None, "weeks": set()}
+
+
+def partition_name(week):
+    """ Name of the partition holding an Ymd week."""
+    return PARTITION_TEMPLATE.format(week)
+
+
+def partition_weeks(starteds, ahead=0):
+    """ Returns the sorted Ymd weeks containing starteds, plus ahead weeks
+    after the last of them. """
+    starteds = [started for started in starteds if started is not None]
+    if not starteds:
+        return []
+    weeks = {week_of(started) for started in starteds}
+    last = max(starteds)
+    for index in range(1, ahead + 1):
+        weeks.add(week_of(last + index * SEVEN_DAYS_OF_SECONDS))
+    return sorted(weeks)
+
+
+def create_partition(cur, week, table="matches"):
+    """ Creates the partition of table for an Ymd week if it is missing."""
+    start, end = week_timebox(week)
+    cur.execute(CREATE_PARTITION_SQL.format(partition_name(week), table, start, end))
+
+
+def is_partitioned(cur):
+    """ Whether matches is a partitioned table; looked up once per process."""
+    if KNOWN["partitioned"] is None:
+        cur.execute(IS_PARTITIONED_SQL)
+        row = cur.fetchone()
+        KNOWN["partitioned"] = bool(row and row[0])
+    return KNOWN["partitioned"]
+
+
+def ensure_partitions(cur, starteds, ahead=WEEKS_AHEAD):
+    """ Creates any missing partitions for the weeks of starteds (and ahead
+    weeks after them) in cur's transaction, so ingest never writes new
+    weeks to the default partition.
+    Returns the created weeks, to pass to partitions_committed once the
+    transaction commits. Does nothing if matches is unpartitioned. """
+    if not is_partitioned(cur):
+        return []
+    weeks = [
+        week
+        for week in partition_weeks(starteds, ahead)
+        if week not in KNOWN["weeks"]
+    ]
+    for week in weeks:
+        create_partition(cur, week)
+    return weeks
+
+
+def partitions_committed(weeks):
+    """ Remembers committed partitions so later batches skip them."""
+    KNOWN["weeks"].update(weeks)
+
+
+def migrate_matches(ahead=WEEKS_AHEAD):
+    """ Copies matches into a week-partitioned table one week per
+    transaction, then swaps it in. The old table is kept as
+    matches_unpartitioned. Run it with ingest stopped. """
+    table = "matches_partitioned"
+    KNOWN.update(partitioned=None, weeks=set())
+    with cursor(commit=True) as cur:
+        if is_partitioned(cur):
+            print("matches is already partitioned")
+            return
+        cur.execute(STARTED_RANGE_SQL)
+        first, last = cur.fetchone()
+        cur.execute(ID_SEQUENCE_SQL)
+        (sequence,) = cur.fetchone()
+        cur.execute("DROP TABLE IF EXISTS {}".format(table))
+        cur.execute(CREATE_PARTITIONED_TABLE_SQL.format(table))
+        for sql in CREATE_KEYS_SQL:
+            cur.execute(sql.format(table))
+        cur.execute(
+            CREATE_DEFAULT_PARTITION_SQL.format(DEFAULT_PARTITION, table)
+        )
+    if first is None:
+        first = last = datetime.now().timestamp()
+    starteds = list(range(int(first), int(last), SEVEN_DAYS_OF_SECONDS)) + [last]
+    weeks = partition_weeks(starteds, ahead)
+    for week in weeks:
+        print("Copying", week)
+        start, end = week_timebox(week)
+        with cursor(commit=True) as cur:
+            create_partition(cur, week, table)
+            cur.execute(COPY_WEEK_SQL.format(table, start, end))
+    with cursor(commit=True) as cur:
+        start = week_timebox(weeks[0])[0]
+        end = week_timebox(weeks[-1])[1]
+        cur.execute(COPY_REST_SQL.format(table, start, end))
+        cur.execute(NULL_STARTED_SQL)
+        (left_behind,) = cur.fetchone()
+        for sql in SWAP_SQL:
+            cur.execute(sql.format(table))
+        if sequence:
+            cur.execute(OWN_SEQUENCE_SQL.format(sequence))
+        # the migrated indexes stay with the old table; build them again
+        for _, sql in MIGRATIONS:
+            match = MATCHES_INDEX_PATTERN.search(sql)
+            if match:
+                cur.execute(RENAME_INDEX_SQL.format(match.group(1)))
+                cur.execute(sql)
+    KNOWN["partitioned"] = True
+    partitions_committed(weeks)
+    if left_behind:
+        print(left_behind, "rows without started stay in matches_unpartitioned")
+
+
+def run():
+    """ Manage partitions from the command line."""
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--migrate", action="store_true", help="Partition the existing matches table"
+    )
+    parser.add_argument(
+        "--ahead",
+        type=int,
+        default=WEEKS_AHEAD,
+        help="Weeks after the current one to create partitions for",
+    )
+    args = parser.parse_args()
+    if args.migrate:
+        migrate_matches(args.ahead)
+        return
+    with cursor(commit=True) as cur:
+        if not is_partitioned(cur):
+            print("matches is not partitioned; run with --migrate first")
+            return
+        weeks = ensure_partitions(cur, [datetime.now().timestamp()], args.ahead)
+    partitions_committed(weeks)
+
+
+if __name__ == "__main__":
+    run()
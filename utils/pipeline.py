@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+""" Helpers for overlapping network and database work during ingest. """
+import json
+import os
+from queue import Queue
+import threading
+import time
+
+
+class TokenBucket:
+    """ Blocks callers so that on average no more than rate calls
+    per second get through, allowing bursts of up to capacity. """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """ Takes one token, waiting until one is available."""
+        with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                self.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class Checkpoint:
+    """ Persists the last fully saved position so a run can resume."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ Returns saved data or None if no checkpoint."""
+        try:
+            with open(self.path) as open_file:
+                return json.load(open_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, **data):
+        """ Atomically replaces the checkpoint with data."""
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as open_file:
+            json.dump(data, open_file)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """ Removes the checkpoint."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _Failure:
+    """ Carries an exception from the producer thread to the consumer."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_DONE = object()
+
+
+def prefetch(iterable, depth=2):
+    """ Generator that consumes iterable in a background thread,
+    keeping up to depth items ready. Producer exceptions are re-raised. """
+    items = Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except BaseException as exception:  # pylint: disable=broad-except
+            items.put(_Failure(exception))
+            return
+        items.put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        # unblock a producer waiting on a full queue
+        while producer.is_alive():
+            while not items.empty():
+                items.get_nowait()
+            producer.join(0.1)
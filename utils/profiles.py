@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+""" Player profile lookups against aoe2.net, singly or many at once.
+
+Lookups go through an on-disk cache (cache/profiles.db):
+  fresh      younger than TTL, served from the cache
+  stale      younger than TTL + STALE_TTL, served from the cache and
+             refreshed in the background
+  failures   remembered for NEGATIVE_TTL so a broken profile is not
+             requested again on every report
+Set AOE2STATS_PROFILE_CACHE=0 to always ask aoe2.net. """
+import asyncio
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+API_TEMPLATE = "https://aoe2.net/api/player/lastmatch?game=aoe2de&profile_id={}"
+
+# requests in flight at once; also the size of the session's connection pool
+CONCURRENCY = 8
+
+TIMEOUT = 10
+
+CACHE_FILE = "cache/profiles.db"
+USE_CACHE = os.environ.get("AOE2STATS_PROFILE_CACHE", "1") != "0"
+
+DAY = 24 * 60 * 60
+TTL = 7 * DAY
+STALE_TTL = 30 * DAY
+NEGATIVE_TTL = 60 * 60
+
+CREATE_CACHE_TABLE = """CREATE TABLE IF NOT EXISTS profiles (
+profile_id integer PRIMARY KEY,
+data text,
+fetched real)"""
+
+FRESH = "fresh"
+STALE = "stale"
+MISSING = "missing"
+
+HTTP = {"session": None}
+
+CACHE = {"cache": None}
+
+
+def unknown_profile():
+    """ What a failed lookup returns: every field is "UNKNOWN"."""
+    return defaultdict(lambda: "UNKNOWN")
+
+
+def profile_session():
+    """ Returns a Session with retries and a pool for CONCURRENCY connections,
+    shared by all profile lookups. """
+    if HTTP["session"] is None:
+        retry_strategy = Retry(backoff_factor=1, total=3)
+        adapter = HTTPAdapter(
+            max_retries=retry_strategy, pool_maxsize=CONCURRENCY
+        )
+        http = Session()
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+        HTTP["session"] = http
+    return HTTP["session"]
+
+
+def request_profile(profile_id, http=None, timeout=TIMEOUT):
+    """ Fetches last match info of a profile from aoe2.net; None on failure."""
+    http = http or profile_session()
+    try:
+        response = http.get(API_TEMPLATE.format(profile_id), timeout=timeout)
+        if response.status_code != 200:
+            return None
+        return response.json()
+    except (RequestException, ValueError):
+        return None
+
+
+class ProfileCache:
+    """ SQLite store of profile data with fresh/stale/negative lifetimes. """
+
+    def __init__(
+        self,
+        path=CACHE_FILE,
+        ttl=TTL,
+        stale_ttl=STALE_TTL,
+        negative_ttl=NEGATIVE_TTL,
+        clock=time.time,
+    ):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(CREATE_CACHE_TABLE)
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.counts = Counter()
+        self.refreshing = set()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def count(self, kind):
+        """ Counts one lookup outcome; workers count too, so under the lock."""
+        with self.lock:
+            self.counts[kind] += 1
+
+    def lookup(self, profile_id):
+        """ Returns (FRESH | STALE | MISSING, data); data is None for a
+        remembered failure. """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data, fetched FROM profiles WHERE profile_id = ?",
+                (profile_id,),
+            ).fetchone()
+        if row is None:
+            return MISSING, None
+        data, fetched = row
+        age = self.clock() - fetched
+        if data is None:
+            return (FRESH if age < self.negative_ttl else MISSING), None
+        if age < self.ttl:
+            return FRESH, json.loads(data)
+        if age < self.ttl + self.stale_ttl:
+            return STALE, json.loads(data)
+        return MISSING, None
+
+    def store(self, profile_id, data):
+        """ Saves a fetch result. A failure (None) does not replace data that
+        can still be served stale. """
+        now = self.clock()
+        with self.lock:
+            if data is None:
+                self.conn.execute(
+                    """INSERT INTO profiles (profile_id, data, fetched)
+VALUES (?, NULL, ?) ON CONFLICT (profile_id)
+DO UPDATE SET data = NULL, fetched = excluded.fetched
+WHERE profiles.data IS NULL OR profiles.fetched <= ?""",
+                    (profile_id, now, now - self.ttl - self.stale_ttl),
+                )
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                    (profile_id, json.dumps(data), now),
+                )
+            self.conn.commit()
+
+    def _refresh(self, profile_id, http):
+        try:
+            data = request_profile(profile_id, http)
+            self.count("error" if data is None else "refresh")
+            if data is not None:
+                self.store(profile_id, data)
+        finally:
+            with self.lock:
+                self.refreshing.discard(profile_id)
+
+    def revalidate(self, profile_id, http=None):
+        """ Refreshes a stale profile in the background."""
+        with self.lock:
+            if profile_id in self.refreshing:
+                return
+            self.refreshing.add(profile_id)
+        self.executor.submit(self._refresh, profile_id, http)
+
+    def cached(self, profile_id, http=None):
+        """ Returns (found, data) and counts the lookup; stale data is
+        returned and revalidated. """
+        state, data = self.lookup(profile_id)
+        if state == MISSING:
+            self.count("miss")
+            return False, None
+        if data is None:
+            self.count("negative")
+            return True, unknown_profile()
+        if state == STALE:
+            self.count("stale")
+            self.revalidate(profile_id, http)
+        else:
+            self.count("hit")
+        return True, data
+
+    def fetched(self, profile_id, data):
+        """ Stores a fetch result and returns what callers should see."""
+        if data is None:
+            self.count("error")
+        self.store(profile_id, data)
+        return unknown_profile() if data is None else data
+
+    def stats(self):
+        """ Lookup counts, e.g. {"hit": 10, "miss": 2}."""
+        with self.lock:
+            return dict(self.counts)
+
+    def wait(self):
+        """ Waits for background refreshes to finish."""
+        self.executor.shutdown(wait=True)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+
+def profile_cache():
+    """ The process-wide ProfileCache, or None if caching is disabled."""
+    if not USE_CACHE:
+        return None
+    if CACHE["cache"] is None:
+        CACHE["cache"] = ProfileCache()
+    return CACHE["cache"]
+
+
+def fetch_profile(profile_id, http=None, timeout=TIMEOUT, cache=None):
+    """ Fetches last match info of a profile, through the cache if given.
+    Every field is "UNKNOWN" if aoe2.net could not answer. """
+    if cache is not None:
+        found, data = cache.cached(profile_id, http)
+        if found:
+            return data
+        return cache.fetched(profile_id, request_profile(profile_id, http, timeout))
+    data = request_profile(profile_id, http, timeout)
+    return unknown_profile() if data is None else data
+
+
+async def gather_profiles(profile_ids, concurrency=CONCURRENCY, http=None, cache=None):
+    """ Fetches profiles concurrently, at most concurrency at a time.
+    Returns {profile_id: data}. """
+    http = http or profile_session()
+    semaphore = asyncio.Semaphore(concurrency)
+    profile_ids = list(dict.fromkeys(profile_ids))
+    profiles = {}
+    missing = []
+    for profile_id in profile_ids:
+        found, data = (False, None) if cache is None else cache.cached(profile_id, http)
+        if found:
+            profiles[profile_id] = data
+        else:
+            missing.append(profile_id)
+
+    async def fetch(profile_id):
+        async with semaphore:
+            return await asyncio.to_thread(request_profile, profile_id, http)
+
+    results = await asyncio.gather(*[fetch(profile_id) for profile_id in missing])
+    for profile_id, data in zip(missing, results):
+        if cache is None:
+            profiles[profile_id] = unknown_profile() if data is None else data
+        else:
+            profiles[profile_id] = cache.fetched(profile_id, data)
+    return {profile_id: profiles[profile_id] for profile_id in profile_ids}
+
+
+def fetch_profiles(profile_ids, concurrency=CONCURRENCY, http=None, cache=None):
+    """ Blocking wrapper of gather_profiles."""
+    if not profile_ids:
+        return {}
+    return asyncio.run(gather_profiles(profile_ids, concurrency, http, cache))
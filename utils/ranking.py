@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+""" Ranking shared by the results cacher and the seeders.
+
+Highest score ranks first and equal scores share a rank, like SQL:
+    RANK        1, 1, 3  (RANK() OVER ...)
+    DENSE_RANK  1, 1, 2  (DENSE_RANK() OVER ...)"""
+import numpy as np
+
+RANK = "RANK"
+DENSE_RANK = "DENSE_RANK"
+
+
+def ranks(scores, method=RANK, groups=None):
+    """ Returns the rank of each score, highest first.
+    groups: parallel labels; each group is ranked on its own, so many
+    categories can be ranked in one pass """
+    if method not in (RANK, DENSE_RANK):
+        raise ValueError("Unknown ranking method: {}".format(method))
+    scores = np.asarray(scores, dtype=float)
+    count = len(scores)
+    if not count:
+        return np.zeros(0, dtype=int)
+    if groups is None:
+        group_ids = np.zeros(count, dtype=int)
+    else:
+        _, group_ids = np.unique(np.asarray(groups), return_inverse=True)
+    order = np.lexsort((-scores, group_ids))
+    sorted_groups = group_ids[order]
+    sorted_scores = scores[order]
+    new_group = np.ones(count, dtype=bool)
+    new_group[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    new_score = new_group.copy()
+    new_score[1:] |= sorted_scores[1:] != sorted_scores[:-1]
+    positions = np.arange(count)
+    group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+    if method == RANK:
+        tie_start = np.maximum.accumulate(np.where(new_score, positions, 0))
+        sorted_ranks = tie_start - group_start + 1
+    else:
+        distinct = np.cumsum(new_score)
+        sorted_ranks = distinct - distinct[group_start] + 1
+    result = np.empty(count, dtype=int)
+    result[order] = sorted_ranks
+    return result
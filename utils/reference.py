@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+""" Read-only reference data (civs, maps, rating types) from data/strings.json,
+parsed once per process. """
+from collections import namedtuple
+from collections.abc import Mapping
+from functools import lru_cache
+import json
+import os
+import pickle
+
+STRINGS_FILE = "data/strings.json"
+CACHE_FILE = "cache/strings.pickle"
+USE_DISK_CACHE = os.environ.get("AOE2STATS_REFERENCE_CACHE", "1") != "0"
+
+UNKNOWN = "UNKNOWN"
+
+ReferenceData = namedtuple(
+    "ReferenceData", ("civ_names", "map_names", "map_ids", "rating_types")
+)
+
+
+class FrozenLookup(Mapping):
+    """ Immutable mapping that can answer missing keys with a default. """
+
+    def __init__(self, data, *default):
+        self._data = dict(data)
+        self._default = default
+
+    def __getitem__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            if not self._default:
+                raise
+            return self._default[0]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __repr__(self):
+        return "FrozenLookup({!r})".format(self._data)
+
+
+def parse_strings(path=STRINGS_FILE):
+    """ Builds ReferenceData from the aoe2.net strings file."""
+    with open(path) as open_file:
+        data = json.load(open_file)
+    civ_names = {}
+    for civ_info in data["civ"]:
+        civ_names[int(civ_info["id"])] = civ_info["string"]
+        civ_names[str(civ_info["id"])] = civ_info["string"]
+    map_names = {}
+    map_ids = {}
+    for map_info in data["map_type"]:
+        map_names[str(map_info["id"])] = map_info["string"]
+        map_names[int(map_info["id"])] = map_info["string"]
+        map_ids[map_info["string"]] = map_info["id"]
+        map_ids[map_info["string"].lower()] = map_info["id"]
+    rating_types = {}
+    for rating_info in data["rating_type"]:
+        rating_types[rating_info["id"]] = rating_info["string"]
+    return ReferenceData(
+        FrozenLookup(civ_names),
+        FrozenLookup(map_names, UNKNOWN),
+        FrozenLookup(map_ids),
+        FrozenLookup(rating_types),
+    )
+
+
+def load_cached(path=STRINGS_FILE, cache_file=CACHE_FILE):
+    """ Returns ReferenceData from the pickle cache if it was made from the
+    current version of path, otherwise parses path and refreshes the cache. """
+    mtime = os.stat(path).st_mtime
+    try:
+        with open(cache_file, "rb") as open_file:
+            cached = pickle.load(open_file)
+        if cached["mtime"] == mtime and cached["path"] == path:
+            return cached["data"]
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+    data = parse_strings(path)
+    try:
+        dirname = os.path.dirname(cache_file)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(cache_file, "wb") as open_file:
+            pickle.dump({"mtime": mtime, "path": path, "data": data}, open_file)
+    except OSError:
+        pass
+    return data
+
+
+@lru_cache(maxsize=None)
+def reference_data():
+    """ The process-wide ReferenceData."""
+    if USE_DISK_CACHE:
+        return load_cached()
+    return parse_strings()
@@ -1,16 +1,22 @@
 #!/usr/bin/env python
 """ Save weekly calculations of popularity, win rates, rank, and sample_size."""
 
-from collections import defaultdict
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
 from datetime import datetime, timezone
+from itertools import groupby
+from multiprocessing import Pool
 import psycopg2
+import psycopg2.extras
 
-import statistics
-from statsmodels.stats.proportion import proportion_confint
-
+from utils.db import close_pool
 from utils.models import Player
+from utils.ranking import ranks
+from utils.streaks import update_streaks
 from utils.tools import all_wednesdays, batch, DB, SEVEN_DAYS_OF_SECONDS
 from utils.tools import execute_sql, execute_bulk_insert, execute_transaction
+from utils.tools import week_keys
+from utils.winrates import lower_bounds, win_means
 
 DBS = {"current": DB}
 
@@ -40,6 +46,17 @@ week text,
 match_count integer,
 UNIQUE(week))"""
 
+CREATE_DIRTY_WEEKS_TABLE = """CREATE TABLE IF NOT EXISTS dirty_weeks (
+week text PRIMARY KEY,
+marked timestamptz DEFAULT clock_timestamp())"""
+
+MARK_DIRTY_WEEKS_SQL = """INSERT INTO dirty_weeks (week) VALUES %s
+ON CONFLICT (week) DO UPDATE SET marked = clock_timestamp()"""
+
+DIRTY_WEEKS_SQL = "SELECT week, marked FROM dirty_weeks ORDER BY week"
+
+CLEAR_DIRTY_WEEK_SQL = "DELETE FROM dirty_weeks WHERE week = %s AND marked <= %s"
+
 WEEK_COUNT_SQL_TEMPLATE = """ SELECT match_count FROM week_counts
 WHERE week = '{}' """
 
@@ -92,6 +109,14 @@ QUERIES = {
                             GROUP BY player_id, civ_id""",
 }
 
+WEEK_MATCHES_SQL_TEMPLATE = """SELECT match_id, won, player_id, civ_id, mirror,
+                               team_size, map_type
+                               FROM matches
+                               WHERE civ_id IS NOT NULL
+                               AND game_type = 0
+                               AND started BETWEEN {:0.0f} AND {:0.0f}
+                               ORDER BY match_id, won, player_id"""
+
 
 class CivDict(defaultdict):
     """ Generates civ if missing."""
@@ -223,20 +248,33 @@ class PopularCivilization(Civilization):
 
 
 class WinrateCivilization(Civilization):
-    """ Holds weekly winrate information. """
+    """ Holds weekly winrate information as summed results and a count. """
 
     def __init__(self, civ_id, size, map_category, methodology):
         Civilization.__init__(self, civ_id, size, map_category, methodology)
-        self.win_results = []
+        self.wins = 0
+        self.games = 0
         self.cached_winrate_pct = None
 
     def __str__(self):
         return "{:2}: {:.3f}".format(self.civ_id, self.pct)
 
+    def add_results(self, wins, games):
+        """ Adds games, of which wins were won
+        (or one player's win average with games=1). """
+        self.wins += wins
+        self.games += games
+        self.cached_winrate_pct = None
+
+    @staticmethod
+    def winrates(wins, games):
+        """ Vectorized pct calculation over parallel wins and games."""
+        return win_means(wins, games)
+
     @property
     def sample_size(self):
         """ How many data points."""
-        return len(self.win_results)
+        return self.games
 
     @property
     def metric(self):
@@ -257,33 +295,35 @@ class WinrateCivilization(Civilization):
     def pct(self):
         """ Percentage of games won by this civ. """
         if self.cached_winrate_pct is None:
-            try:
-                self.cached_winrate_pct = round(statistics.mean(self.win_results), 3)
-            except statistics.StatisticsError:
-                self.cached_winrate_pct = 0
+            winrate = self.winrates([self.wins], [self.games])[0]
+            self.cached_winrate_pct = round(float(winrate), 3)
         return self.cached_winrate_pct
 
 
 class BottomWinrateCivilization(WinrateCivilization):
     """ Holds weekly bottom winrate information."""
 
+    @staticmethod
+    def winrates(wins, games):
+        """ Vectorized lower confidence bound over parallel wins and games."""
+        return lower_bounds(wins, games)
+
     @property
     def metric(self):
         """ What is actually measured."""
         return "bottom_winrate"
 
-    @property
-    def pct(self):
-        """ Percentage of games won by this civ assuming the worst. """
-        if self.cached_winrate_pct is None:
-            try:
-                wins = sum(self.win_results)
-                total = len(self.win_results)
-                low_confidence, _ = proportion_confint(wins, total)
-                self.cached_winrate_pct = round(low_confidence, 3)
-            except statistics.StatisticsError:
-                self.cached_winrate_pct = 0
-        return self.cached_winrate_pct
+
+def cache_winrates(civs):
+    """ Sets pct of winrate civs of one class in a single vectorized call."""
+    civs = list(civs)
+    if not civs:
+        return
+    winrates = civs[0].winrates(
+        [civ.wins for civ in civs], [civ.games for civ in civs]
+    )
+    for civ, winrate in zip(civs, winrates):
+        civ.cached_winrate_pct = round(float(winrate), 3)
 
 
 def filters(category, size):
@@ -297,17 +337,22 @@ def most_popular_match(timebox, size, map_category, basic):
         return []
     key = "match_popularity_basic" if basic else "match_popularity"
     sql = QUERIES[key].format(*timebox, filters(map_category, size))
+    return match_popularity_civs(execute_sql(sql, db_path()), size, map_category)
+
+
+def match_popularity_civs(rows, size, map_category, rank=True):
+    """ Builds popularity civs from (civ_id, count) rows.
+    rank: rank them now (otherwise the caller ranks them) """
     total = 0
     civs = CivDict(PopularCivilization, size, map_category, "match")
-    for civ_id, count in execute_sql(sql, db_path()):
+    for civ_id, count in rows:
         total += count
         civ = civs[civ_id]
         civ.times_used += count
 
-    def civ_sorter(civ):
-        return -1 * civ.times_used
-
-    rank_civs(civs.values(), civ_sorter, total)
+    set_totals(civs.values(), total)
+    if rank:
+        rank_civs(civs.values())
 
     return list(civs.values())
 
@@ -318,8 +363,14 @@ def most_popular_player(timebox, size, map_category, basic):
         return []
     key = "player_popularity_basic" if basic else "player_popularity"
     sql = QUERIES[key].format(*timebox, filters(map_category, size))
+    return player_popularity_civs(execute_sql(sql, db_path()), size, map_category)
+
+
+def player_popularity_civs(rows, size, map_category, rank=True):
+    """ Builds popularity civs from (player_id, civ_id, count) rows.
+    rank: rank them now (otherwise the caller ranks them) """
     players = defaultdict(Player)
-    for player_id, civ_id, count in execute_sql(sql, db_path()):
+    for player_id, civ_id, count in rows:
         pair = [int(x) for x in str(player_id).split(":")]
         sorted_player_id = ":".join([str(x) for x in sorted(pair)])
         players[sorted_player_id].add_civ_use(civ_id, count)
@@ -330,49 +381,65 @@ def most_popular_player(timebox, size, map_category, basic):
             civ = civs[civ_id]
             civ.times_used += value
 
-    def civ_sorter(civ):
-        return -1 * civ.times_used
-
-    rank_civs(civs.values(), civ_sorter, len(players))
+    set_totals(civs.values(), len(players))
+    if rank:
+        rank_civs(civs.values())
 
     return list(civs.values())
 
 
-def rank_civs(civs, sorter, total):
-    """ Set rank and total for each civ."""
-    last_rank = 0
-    last_score = 0
-
-    for rank, civ in enumerate(sorted(civs, key=sorter), 1):
-        score = civ.score
-        if score == last_score:
-            civ.rank = last_rank
-        else:
-            civ.rank = rank
-            last_rank = rank
-            last_score = score
+def set_totals(civs, total):
+    """ Set total for each civ."""
+    for civ in civs:
         civ.total = total
 
 
+def rank_civs(civs, groups=None):
+    """ Set rank for each civ, highest score first; ties share the best rank.
+    groups: parallel labels to rank several sets of civs in one pass """
+    civs = list(civs)
+    for civ, rank in zip(civs, ranks([civ.score for civ in civs], groups=groups)):
+        civ.rank = int(rank)
+
+
+def rank_civ_groups(civ_groups):
+    """ Ranks lists of civs, each list on its own and per metric, in one pass.
+    Returns all the civs. """
+    civs = []
+    labels = []
+    for index, group in enumerate(civ_groups):
+        for civ in group:
+            civs.append(civ)
+            labels.append("{}:{}".format(index, civ.metric))
+    rank_civs(civs, labels)
+    return civs
+
+
 def winrate_match(timebox, size, map_category):
     """ Returns civs with winrate data based on matches. """
     sql = QUERIES["win_rates_match"].format(*timebox, filters(map_category, size))
+    return winrate_match_civs(execute_sql(sql, db_path()), size, map_category)
+
+
+def winrate_match_civs(rows, size, map_category, rank=True):
+    """ Builds winrate and bottom winrate civs from (civ_id, won, count) rows.
+    rank: rank them now (otherwise the caller ranks them) """
     civs = CivDict(WinrateCivilization, size, map_category, "match")
     bottom_civs = CivDict(BottomWinrateCivilization, size, map_category, "match")
     total = 0
-    for civ_id, won, count in execute_sql(sql, db_path()):
+    for civ_id, won, count in rows:
         total += count
-        wins = [won for _ in range(count)]
-        civ = civs[civ_id]
-        civ.win_results += wins
-        bottom_civ = bottom_civs[civ_id]
-        bottom_civ.win_results += wins
-
-    def sort_win_pct(civ):
-        return -1 * civ.pct
-
-    rank_civs(civs.values(), sort_win_pct, total)
-    rank_civs(bottom_civs.values(), sort_win_pct, total)
+        wins = count if won else 0
+        civs[civ_id].add_results(wins, count)
+        bottom_civs[civ_id].add_results(wins, count)
+    cache_winrates(civs.values())
+    cache_winrates(bottom_civs.values())
+
+    set_totals(civs.values(), total)
+    set_totals(bottom_civs.values(), total)
+    if rank:
+        rank_civs(civs.values())
+        rank_civs(bottom_civs.values())
 
     return list(civs.values()) + list(bottom_civs.values())
 
@@ -380,23 +447,182 @@ def winrate_match(timebox, size, map_category):
 def winrate_player(timebox, size, map_category):
     """ Returns civs with winrate data based on player percentage. """
     sql = QUERIES["win_rates_player"].format(*timebox, filters(map_category, size))
+    return winrate_player_civs(execute_sql(sql, db_path()), size, map_category)
+
+
+def winrate_player_civs(rows, size, map_category, rank=True):
+    """ Builds winrate civs from (civ_id, win average) rows.
+    rank: rank them now (otherwise the caller ranks them) """
     civs = CivDict(WinrateCivilization, size, map_category, "player")
 
     total = 0
-    for civ_id, won_avg in execute_sql(sql, db_path()):
+    for civ_id, won_avg in rows:
         total += 1
-        civ = civs[civ_id]
-        civ.win_results.append(won_avg)
-
-    def sort_win_pct(civ):
-        return -1 * civ.pct
+        civs[civ_id].add_results(float(won_avg), 1)
+    cache_winrates(civs.values())
 
-    rank_civs(civs.values(), sort_win_pct, total)
+    set_totals(civs.values(), total)
+    if rank:
+        rank_civs(civs.values())
     return list(civs.values())
 
 
+def category_keys(team_size, map_type):
+    """ Returns the (map_category, size) pairs a match belongs to.
+    In-memory equivalent of CATEGORY_FILTERS. """
+    sizes = []
+    if team_size == 1:
+        sizes.append("1v1")
+    elif team_size == 2:
+        sizes.append("2v2")
+    if team_size and team_size > 1:
+        sizes.append("team")
+    map_categories = ["All"]
+    if map_type == 9:
+        map_categories.append("Arabia")
+    elif map_type == 29:
+        map_categories.append("Arena")
+    elif map_type is not None:
+        map_categories.append("Others")
+    return [(map_category, size) for map_category in map_categories for size in sizes]
+
+
+class CategoryAggregate:
+    """ Running counts for one (map_category, size) bucket of a week. """
+
+    def __init__(self):
+        self.civ_uses = Counter()
+        self.player_civ_uses = Counter()
+        self.team_civ_uses = Counter()
+        self.team_player_civ_uses = Counter()
+        self.civ_wins = Counter()
+        self.player_civ_wins = defaultdict(lambda: [0, 0])
+
+    def add_team(self, team, compound):
+        """ Adds (player_id, civ_id, won, mirror) rows of one side of a match."""
+        for player_id, civ_id, won, mirror in team:
+            self.civ_uses[str(civ_id)] += 1
+            self.player_civ_uses[(str(player_id), str(civ_id))] += 1
+            if not mirror:
+                self.civ_wins[(civ_id, won)] += 1
+                player_wins = self.player_civ_wins[(player_id, civ_id)]
+                player_wins[0] += int(won)
+                player_wins[1] += 1
+        if compound:
+            civ_ids = sorted([row[1] for row in team])
+            self.team_civ_uses[":".join([str(civ_id) for civ_id in civ_ids])] += 1
+            player_key = ":".join([str(row[0]) for row in team])
+            player_civ_key = ":".join([str(row[1]) for row in team])
+            self.team_player_civ_uses[(player_key, player_civ_key)] += 1
+
+    def civilizations(self, size, map_category):
+        """ Returns the same civs the per-category queries would produce."""
+        return rank_civ_groups(self.civilization_groups(size, map_category))
+
+    def civilization_groups(self, size, map_category):
+        """ Returns lists of unranked civs, one per per-category query."""
+        win_rows = [(civ, won, count) for (civ, won), count in self.civ_wins.items()]
+        player_rows = [
+            (player, civ, count)
+            for (player, civ), count in self.player_civ_uses.items()
+        ]
+        player_win_rows = [
+            (civ, wins / games)
+            for (_, civ), (wins, games) in self.player_civ_wins.items()
+        ]
+        groups = [
+            match_popularity_civs(self.civ_uses.items(), size, map_category, False),
+            winrate_match_civs(win_rows, size, map_category, False),
+            player_popularity_civs(player_rows, size, map_category, False),
+            winrate_player_civs(player_win_rows, size, map_category, False),
+        ]
+        if size == "2v2":
+            team_player_rows = [
+                (player, civ, count)
+                for (player, civ), count in self.team_player_civ_uses.items()
+            ]
+            groups.append(
+                match_popularity_civs(
+                    self.team_civ_uses.items(), size, map_category, False
+                )
+            )
+            groups.append(
+                player_popularity_civs(team_player_rows, size, map_category, False)
+            )
+        return groups
+
+
+class WeekAggregate:
+    """ Computes every CATEGORY_FILTERS bucket of a week in one pass over its rows."""
+
+    def __init__(self):
+        self.categories = defaultdict(CategoryAggregate)
+
+    def load(self, rows):
+        """ Consumes (match_id, won, player_id, civ_id, mirror, team_size, map_type)
+        rows ordered by match_id and won. """
+        for _, side in groupby(rows, key=lambda row: (row[0], row[1])):
+            side = list(side)
+            team_size, map_type = side[0][5], side[0][6]
+            team = [(row[2], row[3], row[1], row[4]) for row in side]
+            for key in category_keys(team_size, map_type):
+                self.categories[key].add_team(team, key[1] == "2v2")
+        return self
+
+    def civilizations(self):
+        """ Returns civs for every category, ready for save_civs.
+        All categories are ranked together in one pass. """
+        groups = []
+        for map_category, size in sorted(self.categories):
+            category = self.categories[(map_category, size)]
+            groups.extend(category.civilization_groups(size, map_category))
+        return rank_civ_groups(groups)
+
+
+def week_civilizations(timebox):
+    """ Returns all civs for a week using a single query."""
+    sql = WEEK_MATCHES_SQL_TEMPLATE.format(*timebox)
+    return WeekAggregate().load(execute_sql(sql, db_path())).civilizations()
+
+
+def week_timebox(week):
+    """ Returns the timebox starting on the Wednesday breakpoint of an Ymd week."""
+    wednesday = datetime.strptime(week, "%Y%m%d").replace(hour=1, tzinfo=timezone.utc)
+    timestamp = datetime.timestamp(wednesday)
+    return (
+        timestamp,
+        timestamp + SEVEN_DAYS_OF_SECONDS,
+    )
+
+
+def timebox_week(timebox):
+    """ Returns the Ymd week name of a timebox."""
+    return datetime.fromtimestamp(timebox[0], tz=timezone.utc).strftime("%Y%m%d")
+
+
+def mark_dirty_weeks(cur, starteds):
+    """ Records that the weeks containing starteds received new matches.
+    Runs on the caller's cursor so it commits with the matches."""
+    weeks = {week for started in starteds for week in week_keys(started)}
+    if weeks:
+        psycopg2.extras.execute_values(
+            cur, MARK_DIRTY_WEEKS_SQL, [(week,) for week in sorted(weeks)]
+        )
+
+
+def dirty_weeks():
+    """ Returns (week, marked) pairs of weeks with unprocessed matches."""
+    return list(execute_sql(DIRTY_WEEKS_SQL, db_path()))
+
+
+def clear_dirty_week(week, marked):
+    """ Clears a week unless new matches arrived after it was read."""
+    execute_transaction(CLEAR_DIRTY_WEEK_SQL, (week, marked))
+
+
 def timeboxes_to_update():
-    """ Returns array of timebox tuples that need to be updated."""
+    """ Returns array of timebox tuples that need to be updated,
+    comparing every week's match count against week_counts."""
     timeboxes = []
     for wednesday in all_wednesdays():
         old_count = None
@@ -422,52 +648,140 @@ def timeboxes_to_update():
     return timeboxes
 
 
-def save_civs(civs, timebox):
-    """ Calls saves on the civs and updates week_counts."""
-    results_sql = """INSERT INTO results
+RESULTS_SQL = """INSERT INTO results
     (week, civ_id, team_size, map_category, methodology, metric,
     compound, rank, pct)
     VALUES %s
 ON CONFLICT (week, civ_id, team_size, map_category, methodology, metric, compound) DO UPDATE SET rank=Excluded.rank, pct=Excluded.pct"""
-    wednesday = datetime.fromtimestamp(timebox[0], tz=timezone.utc)
-    week = wednesday.strftime("%Y%m%d")
-    print("Saving", week, len(civs))
-    for match_batch in batch(civs, 300):
-        civ_batch = [[week] + civ.info() for civ in match_batch]
-        execute_bulk_insert(results_sql, civ_batch)
-    match_count = None
-    for (count,) in execute_sql(MATCHES_SQL_TEMPLATE.format(*timebox), db_path()):
-        match_count = count
-    week_counts_sql = """INSERT INTO week_counts
+
+WEEK_COUNTS_SQL = """INSERT INTO week_counts
     (week, match_count) VALUES (%s, %s)
     ON CONFLICT (week) DO UPDATE SET match_count=EXCLUDED.match_count"""
-    execute_transaction(week_counts_sql, (week, match_count))
+
+RESULTS_BATCH_SIZE = 300
+
+WRITER_FLUSH_SIZE = 20000
+
+
+class ResultsWriter:
+    """ Buffers the results rows of finished weeks and writes them in batches.
+    Once a week's rows are written its week_counts entry and streaks are
+    updated and its dirty_weeks mark (if any) is cleared. """
+
+    def __init__(self, marks=None, flush_size=WRITER_FLUSH_SIZE):
+        self.marks = marks or {}
+        self.flush_size = flush_size
+        self.rows = []
+        self.timeboxes = []
+
+    def add(self, timebox, infos):
+        """ Queues the civ.info() lists of one week."""
+        week = timebox_week(timebox)
+        print("Saving", week, len(infos))
+        self.rows.extend([[week] + info for info in infos])
+        self.timeboxes.append(timebox)
+        if len(self.rows) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """ Writes everything queued."""
+        for results_batch in batch(self.rows, RESULTS_BATCH_SIZE):
+            execute_bulk_insert(RESULTS_SQL, results_batch)
+        update_streaks([timebox_week(timebox) for timebox in self.timeboxes])
+        for timebox in self.timeboxes:
+            week = timebox_week(timebox)
+            match_count = None
+            for (count,) in execute_sql(
+                MATCHES_SQL_TEMPLATE.format(*timebox), db_path()
+            ):
+                match_count = count
+            execute_transaction(WEEK_COUNTS_SQL, (week, match_count))
+            if week in self.marks:
+                clear_dirty_week(week, self.marks[week])
+        self.rows = []
+        self.timeboxes = []
 
 
-def generate_results():
-    """ Generate all the results"""
+def save_civs(civs, timebox):
+    """ Calls saves on the civs and updates week_counts."""
+    writer = ResultsWriter()
+    writer.add(timebox, [civ.info() for civ in civs])
+    writer.flush()
+
+
+def category_civilizations(timebox):
+    """ Returns all civs for a week using one query per category and metric."""
     categories = {x.split()[0] for x in CATEGORY_FILTERS}
-    for timebox in timeboxes_to_update():
-        wednesday = datetime.fromtimestamp(timebox[0], tz=timezone.utc)
-        print("Generating Results for {}".format(wednesday.strftime("%Y%m%d")))
-        civs = []
-        for map_category in categories:
-            for team_size in ("1v1", "2v2", "team"):
-                print("  {} {}".format(team_size, map_category))
-                civs.extend(most_popular_match(timebox, team_size, map_category, True))
-                civs.extend(most_popular_match(timebox, team_size, map_category, False))
-                civs.extend(winrate_match(timebox, team_size, map_category))
-                civs.extend(most_popular_player(timebox, team_size, map_category, True))
-                civs.extend(
-                    most_popular_player(timebox, team_size, map_category, False)
-                )
-                civs.extend(winrate_player(timebox, team_size, map_category))
-        save_civs(civs, timebox)
+    civs = []
+    for map_category in categories:
+        for team_size in ("1v1", "2v2", "team"):
+            print("  {} {}".format(team_size, map_category))
+            civs.extend(most_popular_match(timebox, team_size, map_category, True))
+            civs.extend(most_popular_match(timebox, team_size, map_category, False))
+            civs.extend(winrate_match(timebox, team_size, map_category))
+            civs.extend(most_popular_player(timebox, team_size, map_category, True))
+            civs.extend(most_popular_player(timebox, team_size, map_category, False))
+            civs.extend(winrate_player(timebox, team_size, map_category))
+    return civs
+
+
+def week_results(task):
+    """ Computes one week's results; runs in worker processes.
+    task: (timebox, single_pass)
+    Returns the timebox and the civ.info() list of every civ. """
+    timebox, single_pass = task
+    print("Generating Results for {}".format(timebox_week(timebox)))
+    if single_pass:
+        civs = week_civilizations(timebox)
+    else:
+        civs = category_civilizations(timebox)
+    return timebox, [civ.info() for civ in civs]
+
+
+def generate_results(single_pass=True, full_scan=False, workers=1):
+    """ Generate all the results
+    full_scan: recount every week instead of using the dirty_weeks ledger
+    workers: number of processes computing weeks concurrently """
+    marks = dict(dirty_weeks())
+    if full_scan:
+        timeboxes = timeboxes_to_update()
+    else:
+        timeboxes = [week_timebox(week) for week in marks]
+    tasks = [(timebox, single_pass) for timebox in timeboxes]
+    writer = ResultsWriter(marks)
+    if workers > 1 and len(tasks) > 1:
+        # children must not inherit the parent's open connections
+        close_pool()
+        with Pool(workers) as process_pool:
+            for timebox, infos in process_pool.imap_unordered(week_results, tasks):
+                writer.add(timebox, infos)
+    else:
+        for task in tasks:
+            writer.add(*week_results(task))
+    writer.flush()
 
 
 def run():
     """ Basic functioning of app."""
-    generate_results()
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--per-category",
+        action="store_true",
+        help="Query each category separately instead of one pass per week",
+    )
+    parser.add_argument(
+        "--full-scan",
+        action="store_true",
+        help="Recount every week instead of only weeks with new matches",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes computing weeks concurrently",
+    )
+    args = parser.parse_args()
+    generate_results(not args.per_category, args.full_scan, args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+""" Parquet snapshot of matches for offline analysis.
+
+The snapshot is a hive-partitioned dataset, one directory per breakpoint
+week and team_size:
+
+    cache/matches/week=20211103/team_size=1/part-0.parquet
+
+Filters on week, team_size or any other column are pushed down to the
+scan, so only the matching partitions and row groups are read.
+
+    python -m utils.snapshot --all             # export everything
+    python -m utils.snapshot --week 20211103   # (re-)export one week
+"""
+from argparse import ArgumentParser
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from utils.facts import week_of
+from utils.results_cacher import week_timebox
+from utils.tools import execute_sql, stream_sql, SEVEN_DAYS_OF_SECONDS
+
+SNAPSHOT_DIR = "cache/matches"
+
+SCHEMA = pa.schema(
+    [
+        ("match_id", pa.string()),
+        ("map_type", pa.int16()),
+        ("rating_type", pa.int16()),
+        ("version", pa.string()),
+        ("started", pa.int64()),
+        ("finished", pa.int64()),
+        ("team_size", pa.int16()),
+        ("game_type", pa.int16()),
+        ("player_id", pa.int64()),
+        ("civ_id", pa.int16()),
+        ("rating", pa.int32()),
+        ("won", pa.bool_()),
+        ("mirror", pa.bool_()),
+    ]
+)
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("week", pa.string()), ("team_size", pa.int16())]), flavor="hive"
+)
+
+EXPORT_SQL_TEMPLATE = """SELECT {} FROM matches
+WHERE started >= {:0.0f} AND started < {:0.0f}"""
+
+STARTED_RANGE_SQL = "SELECT MIN(started), MAX(started) FROM matches"
+
+EXPORT_BATCH_SIZE = 100000
+
+
+def record_batch(rows):
+    """ Converts match rows in SCHEMA column order to a RecordBatch."""
+    columns = list(zip(*rows)) or [[] for _ in SCHEMA]
+    arrays = [
+        pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+
+
+def write_week(week, row_batches, directory=SNAPSHOT_DIR):
+    """ Writes batches of match rows as the snapshot of an Ymd week,
+    replacing whatever the snapshot held for that week. Returns the row count. """
+    table = pa.Table.from_batches(
+        [record_batch(rows) for rows in row_batches], schema=SCHEMA
+    )
+    table = table.append_column(
+        pa.field("week", pa.string()), pa.array([week] * len(table), pa.string())
+    )
+    # delete_matching only replaces the team_size partitions being written
+    shutil.rmtree(os.path.join(directory, "week={}".format(week)), ignore_errors=True)
+    ds.write_dataset(
+        table,
+        directory,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
+    return len(table)
+
+
+def export_week(week, directory=SNAPSHOT_DIR):
+    """ Copies the matches of an Ymd week from the database to the snapshot."""
+    start, end = week_timebox(week)
+    sql = EXPORT_SQL_TEMPLATE.format(", ".join(SCHEMA.names), start, end)
+    return write_week(
+        week, stream_sql(sql, EXPORT_BATCH_SIZE, batches=True), directory
+    )
+
+
+def all_weeks():
+    """ Ymd weeks from the first to the last match in the database."""
+    for first, last in execute_sql(STARTED_RANGE_SQL):
+        if first is None:
+            return []
+        starteds = range(first, last, SEVEN_DAYS_OF_SECONDS)
+        weeks = {week_of(started) for started in starteds}
+        weeks.add(week_of(last))
+        return sorted(weeks)
+    return []
+
+
+def dataset(directory=SNAPSHOT_DIR):
+    """ The snapshot as a pyarrow dataset."""
+    return ds.dataset(directory, format="parquet", partitioning=PARTITIONING)
+
+
+def timebox_filter(start, end):
+    """ Expression for started BETWEEN start AND end that also prunes
+    week partitions. """
+    return (
+        (ds.field("week") >= week_of(start))
+        & (ds.field("week") <= week_of(end))
+        & (ds.field("started") >= start)
+        & (ds.field("started") <= end)
+    )
+
+
+def all_of(filters):
+    """ Combines expressions with AND; None if there are none."""
+    combined = None
+    for expression in filters:
+        combined = expression if combined is None else combined & expression
+    return combined
+
+
+def scan(columns, filters=(), directory=SNAPSHOT_DIR):
+    """ Returns a pyarrow Table of columns from rows matching all filters."""
+    return dataset(directory).to_table(columns=list(columns), filter=all_of(filters))
+
+
+def rows(columns, filters=(), directory=SNAPSHOT_DIR):
+    """ Generator of row tuples, like stream_sql, from the snapshot."""
+    for arrow_batch in dataset(directory).to_batches(
+        columns=list(columns), filter=all_of(filters)
+    ):
+        yield from zip(*[column.to_pylist() for column in arrow_batch.columns])
+
+
+def grouped(keys, aggregations, filters=(), directory=SNAPSHOT_DIR):
+    """ Returns rows of (*keys, *aggregates), like a GROUP BY.
+    aggregations: (column, function) pairs, e.g. ("rating", "max");
+    use ("*", "count") for COUNT(*) """
+    columns = set(keys)
+    for column, _ in aggregations:
+        if column != "*":
+            columns.add(column)
+    table = scan(sorted(columns), filters, directory)
+    arrow_aggregations = []
+    names = []
+    for column, function in aggregations:
+        if column == "*":
+            arrow_aggregations.append(([], "count_all"))
+            names.append("count_all")
+        else:
+            arrow_aggregations.append((column, function))
+            names.append("{}_{}".format(column, function))
+    result = table.group_by(list(keys)).aggregate(arrow_aggregations)
+    return list(zip(*[result.column(name).to_pylist() for name in list(keys) + names]))
+
+
+def distinct(column, filters=(), directory=SNAPSHOT_DIR):
+    """ Distinct non-null values of column."""
+    values = pc.unique(scan([column], filters, directory).column(column))
+    return [value for value in values.to_pylist() if value is not None]
+
+
+def run():
+    """ Export from the command line."""
+    parser = ArgumentParser()
+    parser.add_argument("--week", action="append", help="Ymd week to export")
+    parser.add_argument("--all", action="store_true", help="Export every week")
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    weeks = all_weeks() if args.all else (args.week or [])
+    for week in weeks:
+        print("Exported {} rows for {}".format(export_week(week, args.directory), week))
+
+
+if __name__ == "__main__":
+    run()
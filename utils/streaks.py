@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+""" Streak and longevity index over results, one row per week, civ,
+category, methodology, metric and compound:
+
+    rank          the civ's rank that week
+    level_since   first week of the run of weeks at or above that rank
+    top_5_weeks   length of the run of top-5 weeks ending that week, within
+                  the year up to it
+    year_top_5    top-5 weeks in the year up to that week
+
+ResultsWriter updates the rows of every week it writes (and of the later
+weeks those depend on), so reports look streaks up instead of walking
+back through results.
+
+    python -m utils.streaks --rebuild   # index every week in results
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+from datetime import datetime, timedelta
+import math
+
+from utils.tools import batch, execute_bulk_insert, execute_sql
+from utils.trends import trailing_weeks, Trend
+
+# how far back level_since looks
+TREND_WEEKS = 104
+
+# weeks within a year of a week, both included
+YEAR_WEEKS = 53
+
+TOP = 5
+
+KEY_COLUMNS = (
+    "week, civ_id, team_size, map_category, methodology, metric, compound"
+)
+
+CREATE_STREAKS_TABLE = """CREATE TABLE IF NOT EXISTS streaks (
+week text,
+civ_id text,
+team_size text,
+map_category text,
+methodology text,
+metric text,
+compound boolean,
+rank smallint,
+level_since text,
+top_5_weeks smallint,
+year_top_5 smallint,
+PRIMARY KEY ({}))""".format(
+    KEY_COLUMNS
+)
+
+STREAKS_SQL = """INSERT INTO streaks ({}, rank, level_since, top_5_weeks,
+year_top_5) VALUES %s
+ON CONFLICT ({}) DO UPDATE SET rank = EXCLUDED.rank,
+level_since = EXCLUDED.level_since, top_5_weeks = EXCLUDED.top_5_weeks,
+year_top_5 = EXCLUDED.year_top_5""".format(
+    KEY_COLUMNS, KEY_COLUMNS
+)
+
+LATER_WEEKS_SQL = """SELECT DISTINCT week FROM streaks
+WHERE week > %s AND week <= %s"""
+
+WINDOW_RESULTS_SQL = """SELECT week, civ_id, team_size, map_category,
+methodology, metric, compound, rank, pct
+FROM results
+WHERE week BETWEEN %s AND %s"""
+
+ALL_WEEKS_SQL = "SELECT DISTINCT week FROM results"
+
+LOOKUP_SQL = """SELECT civ_id, map_category, metric, rank, level_since,
+top_5_weeks, year_top_5
+FROM streaks
+WHERE week = %s
+AND team_size = %s
+AND methodology = %s
+AND rank < %s
+AND (metric <> 'popularity' OR compound = %s)"""
+
+STREAKS_BATCH_SIZE = 1000
+
+
+def week_offset(week, weeks):
+    """ The Ymd week weeks after week (before, if negative)."""
+    day = datetime.strptime(week, "%Y%m%d") + timedelta(days=7 * weeks)
+    return day.strftime("%Y%m%d")
+
+
+def weeks_apart(first, last):
+    """ Whole weeks from Ymd week first to last."""
+    delta = datetime.strptime(last, "%Y%m%d") - datetime.strptime(first, "%Y%m%d")
+    return delta.days // 7
+
+
+def affected_weeks(weeks):
+    """ The written weeks plus the indexed weeks whose streaks can reach
+    back to one of them. """
+    first = min(weeks)
+    last = week_offset(max(weeks), TREND_WEEKS - 1)
+    later = execute_sql(LATER_WEEKS_SQL, values=[first, last])
+    later = [week for (week,) in later]
+    return sorted(set(weeks) | set(later))
+
+
+def grouped_trends(weeks, rows):
+    """ Returns {(team_size, map_category, methodology, compound): Trend}."""
+    groups = defaultdict(list)
+    for row in rows:
+        week, civ_id, team_size, map_category, methodology, metric = row[:6]
+        compound, rank, pct = row[6:]
+        key = (team_size, map_category, methodology, compound)
+        groups[key].append((week, civ_id, metric, rank, pct))
+    trends = {}
+    for key, group_rows in groups.items():
+        metrics = sorted({row[2] for row in group_rows})
+        trends[key] = Trend.from_rows(weeks, metrics, group_rows)
+    return trends
+
+
+def streak_rows(trend, key):
+    """ STREAKS_SQL rows of the last week of trend."""
+    week = trend.weeks[-1]
+    team_size, map_category, methodology, compound = key
+    at_level = trend.weeks_at_or_above()
+    top_runs = trend.weeks_in_top(TOP, YEAR_WEEKS)
+    year_counts = trend.count_in_top(TOP, YEAR_WEEKS)
+    rows = []
+    for civ, civ_id in enumerate(trend.civ_ids):
+        for index, metric in enumerate(trend.metrics):
+            rank = trend.rank[-1, civ, index]
+            if math.isnan(rank):
+                continue
+            rows.append(
+                (
+                    week,
+                    civ_id,
+                    team_size,
+                    map_category,
+                    methodology,
+                    metric,
+                    compound,
+                    int(rank),
+                    week_offset(week, 1 - int(at_level[civ, index])),
+                    int(top_runs[civ, index]),
+                    int(year_counts[civ, index]),
+                )
+            )
+    return rows
+
+
+def update_streaks(weeks):
+    """ Indexes the Ymd weeks, and the later indexed weeks depending on
+    them, from one results query. """
+    weeks = sorted(set(weeks))
+    if not weeks:
+        return
+    targets = affected_weeks(weeks)
+    first = week_offset(targets[0], 1 - TREND_WEEKS)
+    window = trailing_weeks(targets[-1], weeks_apart(first, targets[-1]) + 1)
+    rows = execute_sql(WINDOW_RESULTS_SQL, values=[window[0], window[-1]])
+    trends = grouped_trends(window, rows)
+    streaks = []
+    for target in targets:
+        for key, trend in trends.items():
+            streaks.extend(streak_rows(trend.until(target, TREND_WEEKS), key))
+    for streaks_batch in batch(streaks, STREAKS_BATCH_SIZE):
+        execute_bulk_insert(STREAKS_SQL, streaks_batch)
+
+
+def week_streaks(
+    week, team_size="1v1", methodology="player", below=9, compound=False
+):
+    """ Returns {(metric, map_category): [(civ_id, rank, weeks at or above
+    rank, top-5 run, top-5 weeks this year)]} for civs ranked better than
+    below in an Ymd week. """
+    values = [week, team_size, methodology, below, bool(compound)]
+    streaks = defaultdict(list)
+    for row in execute_sql(LOOKUP_SQL, values=values):
+        civ_id, map_category, metric, rank, level_since, top_5, year_top_5 = row
+        weeks_at_level = weeks_apart(level_since, week) + 1
+        streaks[metric, map_category].append(
+            (civ_id, rank, weeks_at_level, top_5, year_top_5)
+        )
+    return streaks
+
+
+def run():
+    """ Rebuild the index from the command line."""
+    parser = ArgumentParser()
+    parser.add_argument("--rebuild", action="store_true", help="Index every week")
+    parser.add_argument("--week", action="append", help="Ymd week to index")
+    args = parser.parse_args()
+    weeks = args.week or []
+    if args.rebuild:
+        weeks = [week for (week,) in execute_sql(ALL_WEEKS_SQL) if len(week) == 8]
+    update_streaks(weeks)
+
+
+if __name__ == "__main__":
+    run()
@@ -1,23 +1,23 @@
 #!/usr/bin/env python3
 """ Useful functions. """
 
-from collections import defaultdict
 import csv
 from datetime import datetime, timedelta, timezone
-import json
 import logging
 import logging.handlers
 import os
 
-import psycopg2
-import psycopg2.extras
 import requests
 import yaml
 
+from utils.backends import backend
+from utils.db import DEFAULT_ITERSIZE
+from utils.profiles import fetch_profile, profile_cache
+from utils.reference import reference_data
+
 DB = "data/ranked.db"
 SEVEN_DAYS_OF_SECONDS = 7 * 24 * 60 * 60
 
-API_TEMPLATE = "https://aoe2.net/api/player/lastmatch?game=aoe2de&profile_id={}"
 LOGGER_NAME = "aoe2stats"
 
 def flatten(array):
@@ -58,14 +58,8 @@ def setup_logging(level=logging.WARNING):
     return logger
 
 def user_info(profile_id):
-    """ Fetches last match info from aoe2.net"""
-    try:
-        response = requests.get(API_TEMPLATE.format(profile_id))
-        if response.status_code != 200:
-            return defaultdict(lambda: "UNKNOWN")
-        return json.loads(response.text)
-    except:
-        return defaultdict(lambda: "UNKNOWN")
+    """ Fetches last match info from aoe2.net (cached, see utils.profiles)"""
+    return fetch_profile(profile_id, cache=profile_cache())
 
 
 def country_map():
@@ -88,39 +82,19 @@ def batch(iterable, size=1):
 
 
 def civ_map():
-    """ Generates dict for mapping civ id to civ name. """
-    cmap = {}
-    with open("data/strings.json") as open_file:
-        data = json.load(open_file)
-    for civ_info in data["civ"]:
-        cmap[int(civ_info["id"])] = civ_info["string"]
-        cmap[str(civ_info["id"])] = civ_info["string"]
-
-    return cmap
+    """ Returns read-only mapping of civ id (int or str) to civ name. """
+    return reference_data().civ_names
 
 
 def map_name_lookup():
-    """ Returns a dictionary of map_id:map_name pairs. """
-    mmap = defaultdict(lambda: "UNKNOWN")
-    with open("data/strings.json") as open_file:
-        data = json.load(open_file)
-    for civ_info in data["map_type"]:
-        mmap[str(civ_info["id"])] = civ_info["string"]
-        mmap[int(civ_info["id"])] = civ_info["string"]
-
-    return mmap
+    """ Returns read-only mapping of map_id:map_name pairs
+    ("UNKNOWN" for missing ids). """
+    return reference_data().map_names
 
 
 def map_id_lookup():
-    """ Returns a dictionary of map_name:map_id pairs. """
-    mmap = {}
-    with open("data/strings.json") as open_file:
-        data = json.load(open_file)
-    for civ_info in data["map_type"]:
-        mmap[civ_info["string"]] = civ_info["id"]
-        mmap[civ_info["string"].lower()] = civ_info["id"]
-
-    return mmap
+    """ Returns read-only mapping of map_name:map_id pairs. """
+    return reference_data().map_ids
 
 def tournament_timeboxes(now):
     breakpoint = last_time_breakpoint(now).date()
@@ -153,6 +127,20 @@ def last_time_breakpoint(now):
         tzinfo=timezone.utc,
     )
 
+def week_keys(started):
+    """ Returns the Ymd week names of the results timeboxes containing started.
+    Timeboxes include both ends, so a match on a breakpoint is in two weeks. """
+    now = datetime.fromtimestamp(started, tz=timezone.utc)
+    breakpoint = last_time_breakpoint(now)
+    breakpoint_ts = breakpoint.timestamp()
+    if started < breakpoint_ts:
+        breakpoint -= timedelta(days=7)
+    keys = [breakpoint.strftime("%Y%m%d")]
+    if started == breakpoint_ts:
+        keys.append((breakpoint - timedelta(days=7)).strftime("%Y%m%d"))
+    return keys
+
+
 def weekend(now):
     """ Returns timebox of weekend (FRI-MON) before "now" """
     now_midnight = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
@@ -164,34 +152,37 @@ def weekend(now):
     return (friday_ts, monday_ts)
 
 def execute_bulk_insert(sql, values):
-    conn = psycopg2.connect(database="aoe2stats")
-    cur = conn.cursor()
-    cur.execute("BEGIN")
-    psycopg2.extras.execute_values(cur, sql, values)
-    cur.execute("COMMIT")
+    """ Inserts values ("VALUES %s" in sql) in one transaction."""
+    backend().bulk_insert(sql, values)
+
 
 def execute_transaction(sql, values):
     """ Wrap sql in commit."""
-    conn = psycopg2.connect(database="aoe2stats")
-    cur = conn.cursor()
-    cur.execute("BEGIN")
-
-    cur.execute(sql, values)
-    cur.execute("COMMIT")
-    conn.close()
-
-def execute_sql(sql, db_path=DB):
-    """ Generator for an sql statement and database. """
-    conn = psycopg2.connect(database="aoe2stats")
-    cur = conn.cursor()
-    cur.execute(sql)
-    try:
-        for row in cur.fetchall():
-            yield row
-    except GeneratorExit:
-        pass
-    cur.close()
-    conn.close()
+    backend().transaction(sql, values)
+
+
+def placeholders(values):
+    """ "%s, %s, ..." for each value."""
+    return ", ".join(["%s"] * len(values))
+
+
+def execute_sql(sql, db_path=DB, values=None):
+    """ Generator for an sql statement and database.
+    values: parameters for the %s placeholders in sql
+    The connection goes back to the pool before the first row is yielded. """
+    for row in backend().execute(sql, values):
+        yield row
+
+
+def stream_sql(sql, itersize=DEFAULT_ITERSIZE, batches=False):
+    """ Generator for large result sets using a server-side cursor.
+    Only itersize rows are held in memory at a time.
+    batches: yield lists of up to itersize rows instead of single rows """
+    for rows in backend().stream(sql, itersize):
+        if batches:
+            yield rows
+        else:
+            yield from rows
 
 
 def all_wednesdays():
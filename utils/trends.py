@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+""" Trends over any number of weeks of the results table.
+
+Trend.load reads a window of weeks for a category in one query into
+(weeks x civs x metrics) arrays of rank and pct; deltas, moving averages
+and streaks are then computed for every civ at once.
+
+    python -m utils.trends --weeks 13 --category Arabia --metric winrate
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.tools import civ_map, execute_sql, last_time_breakpoint, placeholders
+
+METRICS = ("popularity", "winrate")
+
+# compound only distinguishes popularity rows
+RESULTS_SQL_TEMPLATE = """SELECT week, map_category, metric, civ_id, rank, pct
+FROM results
+WHERE week IN ({})
+AND team_size = %s
+AND map_category IN ({})
+AND methodology = %s
+AND metric IN ({})
+AND (metric <> 'popularity' OR compound = %s)"""
+
+
+def results_query(weeks, team_size, categories, methodology, metrics, compound):
+    """ Returns (sql, values) selecting (week, map_category, metric, civ_id,
+    rank, pct) results of every week, category and metric at once. """
+    sql = RESULTS_SQL_TEMPLATE.format(
+        placeholders(weeks), placeholders(categories), placeholders(metrics)
+    )
+    values = (
+        list(weeks)
+        + [team_size]
+        + list(categories)
+        + [methodology]
+        + list(metrics)
+        + [bool(compound)]
+    )
+    return sql, values
+
+
+def trailing_weeks(last_week, count):
+    """ The count Ymd weeks ending with last_week, oldest first."""
+    last = datetime.strptime(last_week, "%Y%m%d")
+    return [
+        (last - timedelta(days=7 * offset)).strftime("%Y%m%d")
+        for offset in reversed(range(count))
+    ]
+
+
+def latest_week(now=None):
+    """ The last complete Ymd week before now."""
+    last_wednesday = last_time_breakpoint(now or datetime.now())
+    return (last_wednesday - timedelta(days=7)).strftime("%Y%m%d")
+
+
+class Trend:
+    """ rank and pct arrays indexed [week, civ, metric]; NaN where a civ has
+    no result that week. """
+
+    def __init__(self, weeks, civ_ids, metrics, rank, pct):
+        self.weeks = list(weeks)
+        self.civ_ids = list(civ_ids)
+        self.metrics = list(metrics)
+        self.rank = rank
+        self.pct = pct
+
+    @classmethod
+    def from_rows(cls, weeks, metrics, rows):
+        """ From (week, civ_id, metric, rank, pct) rows."""
+        rows = [row for row in rows if row[0] in weeks]
+        civ_ids = sorted({row[1] for row in rows}, key=civ_sort_key)
+        week_index = {week: index for index, week in enumerate(weeks)}
+        civ_index = {civ_id: index for index, civ_id in enumerate(civ_ids)}
+        metric_index = {metric: index for index, metric in enumerate(metrics)}
+        shape = (len(weeks), len(civ_ids), len(metrics))
+        rank = np.full(shape, np.nan)
+        pct = np.full(shape, np.nan)
+        for week, civ_id, metric, row_rank, row_pct in rows:
+            index = (week_index[week], civ_index[civ_id], metric_index[metric])
+            rank[index] = row_rank
+            pct[index] = row_pct
+        return cls(weeks, civ_ids, metrics, rank, pct)
+
+    @classmethod
+    def load(
+        cls,
+        weeks,
+        category="All",
+        metrics=METRICS,
+        team_size="1v1",
+        methodology="player",
+        compound=False,
+    ):
+        """ Loads the results of Ymd weeks for a map category in one query."""
+        sql, values = results_query(
+            weeks, team_size, (category,), methodology, metrics, compound
+        )
+        rows = [
+            (week, civ_id, metric, rank, pct)
+            for week, _, metric, civ_id, rank, pct in execute_sql(sql, values=values)
+        ]
+        return cls.from_rows(list(weeks), list(metrics), rows)
+
+    def until(self, week, weeks=None):
+        """ The Trend of the weeks up to and including an Ymd week, only the
+        last weeks of them if given. """
+        end = self.weeks.index(week) + 1
+        start = 0 if weeks is None else max(end - weeks, 0)
+        return Trend(
+            self.weeks[start:end],
+            self.civ_ids,
+            self.metrics,
+            self.rank[start:end],
+            self.pct[start:end],
+        )
+
+    def civ_index(self, civ_id):
+        """ Position of civ_id on the civ axis."""
+        return self.civ_ids.index(str(civ_id))
+
+    def metric_index(self, metric):
+        """ Position of metric on the metric axis."""
+        return self.metrics.index(metric)
+
+    def values(self, field="pct"):
+        """ The rank or pct array."""
+        if field not in ("rank", "pct"):
+            raise ValueError("Unknown field: {}".format(field))
+        return getattr(self, field)
+
+    def deltas(self, field="pct", weeks=1):
+        """ Change from weeks earlier; NaN for the first weeks."""
+        values = self.values(field)
+        result = np.full(values.shape, np.nan)
+        result[weeks:] = values[weeks:] - values[:-weeks]
+        return result
+
+    def moving_average(self, field="pct", window=4):
+        """ Mean of the last window weeks, ignoring missing weeks; NaN until
+        a civ has a result in the window. """
+        values = self.values(field)
+        present = ~np.isnan(values)
+        zero = np.zeros((1,) + values.shape[1:])
+        sums = np.concatenate([zero, np.cumsum(np.where(present, values, 0), axis=0)])
+        counts = np.concatenate([zero, np.cumsum(present, axis=0)])
+        window_sums = sums[window:] - sums[:-window]
+        window_counts = counts[window:] - counts[:-window]
+        result = np.full(values.shape, np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[window - 1 :] = window_sums / window_counts
+        return result
+
+    def weeks_at_or_above(self):
+        """ [civ, metric] consecutive weeks ranked at or above the civ's rank
+        in the last week, ending with it. A week without a result ends the
+        run; 0 if the last week has none. """
+        with np.errstate(invalid="ignore"):
+            return trailing_run(self.rank <= self.rank[-1])
+
+    def weeks_in_top(self, top=5, weeks=None):
+        """ [civ, metric] consecutive weeks ranked top or better, ending with
+        the last week, within the last weeks (default all loaded). """
+        rank = self.rank if weeks is None else self.rank[-weeks:]
+        with np.errstate(invalid="ignore"):
+            return trailing_run(rank <= top)
+
+    def count_in_top(self, top=5, weeks=None):
+        """ [civ, metric] weeks ranked top or better in the last weeks
+        (default all loaded). """
+        rank = self.rank if weeks is None else self.rank[-weeks:]
+        with np.errstate(invalid="ignore"):
+            return np.sum(rank <= top, axis=0)
+
+
+def trailing_run(flags):
+    """ Length of the run of True at the end of axis 0 of flags."""
+    count = flags.shape[0]
+    broken = ~flags[::-1]
+    first_break = np.argmax(broken, axis=0)
+    return np.where(broken.any(axis=0), first_break, count)
+
+
+def civ_sort_key(civ_id):
+    """ Numeric order of civ ids, including compound "1:2" ones."""
+    return [int(part) for part in str(civ_id).split(":")]
+
+
+def run():
+    """ Prints a trend report."""
+    parser = ArgumentParser()
+    parser.add_argument("--weeks", type=int, default=13, help="Weeks to look back")
+    parser.add_argument("--week", help="Last Ymd week (default last complete week)")
+    parser.add_argument("--category", default="All", help="Map category")
+    parser.add_argument("--metric", default="popularity", choices=METRICS)
+    parser.add_argument("-s", default="1v1", help="Team size")
+    parser.add_argument("-m", action="store_true", help="Use match methodology")
+    parser.add_argument("--average", type=int, default=4, help="Moving average weeks")
+    args = parser.parse_args()
+    weeks = trailing_weeks(args.week or latest_week(), args.weeks)
+    methodology = "match" if args.m else "player"
+    trend = Trend.load(weeks, args.category, (args.metric,), args.s, methodology)
+    cmap = civ_map()
+    metric = trend.metric_index(args.metric)
+    rank = trend.rank[-1, :, metric]
+    pct = trend.pct[-1, :, metric]
+    span = max(len(weeks) - 1, 1)
+    change = trend.deltas("pct", span)[-1, :, metric]
+    average = trend.moving_average("pct", args.average)[-1, :, metric]
+    at_level = trend.weeks_at_or_above()[:, metric]
+    top_5 = trend.weeks_in_top(5)[:, metric]
+    print(
+        "{} {} {} {} to {}".format(
+            args.s, args.category, args.metric, weeks[0], weeks[-1]
+        )
+    )
+    for index in np.argsort(np.where(np.isnan(rank), np.inf, rank), kind="stable"):
+        if np.isnan(rank[index]):
+            continue
+        print(
+            "{:>2}. {:11} {:5.1f}% ({:+5.1f} over {} weeks, {}-week avg {:5.1f}%)"
+            " {:>3} weeks at/above, {:>3} weeks top 5".format(
+                int(rank[index]),
+                cmap[trend.civ_ids[index]],
+                100 * pct[index],
+                100 * change[index],
+                span,
+                args.average,
+                100 * average[index],
+                at_level[index],
+                top_5[index],
+            )
+        )
+
+
+if __name__ == "__main__":
+    run()
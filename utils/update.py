@@ -4,19 +4,23 @@
 
 from argparse import ArgumentParser
 from collections import Counter
+import csv
 from datetime import datetime, timedelta
+import io
 import json
-import psycopg2
-import psycopg2.extras
 import sys
-import time
 
 from requests import Session
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
-from utils.results_cacher import generate_results
-from utils.tools import batch, execute_sql, last_time_breakpoint
+from utils.cardinality import merge_sketches
+from utils.db import connection
+from utils.facts import facts_insert_sql
+from utils.partitions import ensure_partitions, partitions_committed
+from utils.pipeline import Checkpoint, prefetch, TokenBucket
+from utils.results_cacher import generate_results, mark_dirty_weeks
+from utils.tools import execute_sql, last_time_breakpoint
 from utils.tools import SEVEN_DAYS_OF_SECONDS
 from utils.versions import version_for_timestamp
 
@@ -43,24 +47,40 @@ MAX_DOWNLOAD = 1000
 
 API_TEMPLATE = "https://aoe2.net/api/matches?game=aoe2de&count={count}&since={start}"
 
-BATCH_SIZE = 300
-
 MAX_STARTED_DIFFERENCE = 1200
 
 BACKWARD_JUMP = -14400  # 4 hours
 
+# one api call per five seconds on average
+REQUESTS_PER_SECOND = 0.2
+
+PREFETCH_DEPTH = 2
+
+CHECKPOINT_FILE = "cache/update_checkpoint.json"
+
+HTTP = {"session": None}
+
+
+def http_session():
+    """ Returns a Session with retries, shared by all api calls. """
+    if HTTP["session"] is None:
+        retry_strategy = Retry(backoff_factor=10, total=6)
+        adapter = HTTPAdapter(max_retries=retry_strategy)
+        http = Session()
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+        HTTP["session"] = http
+    return HTTP["session"]
+
 
 def latest_version():
     """ Returns latest version available in db. """
-    conn = psycopg2.connect(database="aoe2stats")
-    cur = conn.cursor()
     version = 0
-    for (current_version,) in cur.execute(
+    for (current_version,) in execute_sql(
         "SELECT DISTINCT version FROM matches WHERE version IS NOT NULL"
-    ).fetchall():
+    ):
         if int(current_version) > version:
             version = int(current_version)
-    conn.close()
     return version
 
 
@@ -78,38 +98,94 @@ def one_week_ago():
 
 def last_match_time():
     """ Returns the time of the last match retrieved or one week ago. """
-    conn = psycopg2.connect(database="aoe2stats")
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(started) FROM matches")
-    result = cur.fetchone()[0]
-    conn.close()
+    result = None
+    for (result,) in execute_sql("SELECT MAX(started) FROM matches"):
+        pass
     cutoff = one_week_ago()
     # results trickle in, so start 90 minutes before end of last run
     return result and result > cutoff and result - 5400 or cutoff
 
 
+MATCH_COLUMNS = (
+    "match_id, map_type, rating_type, version, started, finished, "
+    "team_size, game_type, player_id, civ_id, rating, won, mirror"
+)
+
+CREATE_STAGING_TABLE = """CREATE TEMP TABLE matches_staging (
+match_id text,
+map_type smallint,
+rating_type smallint,
+version text,
+started integer,
+finished integer,
+team_size smallint,
+game_type smallint,
+player_id integer,
+civ_id smallint,
+rating integer,
+won boolean,
+mirror boolean) ON COMMIT DROP"""
+
+COPY_STAGING_SQL = "COPY matches_staging ({}) FROM STDIN WITH (FORMAT csv)".format(
+    MATCH_COLUMNS
+)
+
+MERGE_STAGING_SQL = """WITH inserted AS (
+INSERT INTO matches ({0})
+SELECT {0} FROM matches_staging
+ON CONFLICT DO NOTHING
+RETURNING {0}),
+facts AS ({1})
+SELECT DISTINCT started FROM inserted""".format(
+    MATCH_COLUMNS, facts_insert_sql("inserted")
+)
+
+
+def csv_value(value):
+    """ Formats a match value for COPY in csv format."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return value
+
+
+def matches_csv(matches):
+    """ Returns an in-memory csv buffer of match rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in matches:
+        writer.writerow([csv_value(value) for value in row])
+    buffer.seek(0)
+    return buffer
+
+
 def save_matches(matches, database):
-    """ Inserts each match value into the database. """
-    sql = """ INSERT INTO matches
-(match_id, map_type, rating_type, version, started, finished,
-team_size, game_type,
-player_id, civ_id, rating, won, mirror)
-VALUES %s
-ON CONFLICT DO NOTHING"""
-    conn = psycopg2.connect(database="aoe2stats")
-    cur = conn.cursor()
-    for match_batch in batch(matches, BATCH_SIZE):
-        cur.execute("BEGIN")
-
-        psycopg2.extras.execute_values(cur, sql, match_batch)
-        cur.execute("COMMIT")
-    conn.close()
-
-
-def fetch_matches(start, changeby=0):
+    """ Copies match values into a staging table and merges them
+    into matches in one transaction, creating missing week partitions,
+    marking the weeks that changed and adding the new rows to
+    weekly_facts and the weekly sketches. """
+    if not matches:
+        return
+    with connection() as conn:
+        with conn.cursor() as cur:
+            weeks = ensure_partitions(cur, [row[4] for row in matches])
+            cur.execute(CREATE_STAGING_TABLE)
+            cur.copy_expert(COPY_STAGING_SQL, matches_csv(matches))
+            cur.execute(MERGE_STAGING_SQL)
+            mark_dirty_weeks(cur, [started for (started,) in cur.fetchall()])
+            merge_sketches(cur, matches)
+        conn.commit()
+    partitions_committed(weeks)
+
+
+def fetch_matches(start, changeby=0, http=None):
     """ Fetches match data via one api call starting at start_time.
         start: unix timestamp to start
         changeby: for explicit jumps from start; 0 for next batch
+        http: Session to use; defaults to the shared session
         Returns number of matches, latest start time, and
         array of values ready for sql insert. """
 
@@ -119,12 +195,7 @@ def fetch_matches(start, changeby=0):
     ranked_match_data = []
     unranked_match_data = []
 
-    retry_strategy = Retry(backoff_factor=10, total=6)
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    http = Session()
-    http.mount("https://", adapter)
-    http.mount("http://", adapter)
-
+    http = http or http_session()
     url = API_TEMPLATE.format(start=start, count=MAX_DOWNLOAD)
     response = http.get(url)
     if response.status_code != 200:
@@ -262,8 +333,9 @@ def print_time_left(script_start, fetch_start, next_start, end_ts=None):
     )
 
 
-def fetch_and_save(start, end_ts):
+def fetch_and_save(start, end_ts, bucket=None, checkpoint=None):
     """ Fetches up to one week of data from start. """
+    bucket = bucket or TokenBucket(REQUESTS_PER_SECOND)
     script_start = datetime.now().timestamp()
     print("Starting at {}".format(int(script_start)))
     fetch_start = start
@@ -287,6 +359,8 @@ WHERE id > {}""".format(baseline)
             fetch_start, changeby
         )
         save_matches(ranked, RANKED_DB)
+        if checkpoint and not changeby:
+            checkpoint.save(next_start=fetch_start, end_ts=end_ts)
         for (cnt,) in execute_sql(count_sql):
             print("Ranked match change:", cnt - last_count)
             if cnt - last_count == 0:
@@ -306,10 +380,45 @@ WHERE id > {}""".format(baseline)
         if data_length < MAX_DOWNLOAD or (end_ts and fetch_start > end_ts):
             break
         print("Next start:", fetch_start)
-        print("sleeping...")
-        time.sleep(5)
+        bucket.acquire()
         if forward_start and forward_start != fetch_start:
             print_time_left(script_start, forward_start, fetch_start, end_ts)
+    if checkpoint:
+        checkpoint.clear()
+    print("Ending at {}".format(datetime.now().strftime("%H:%M")))
+
+
+def fetched_pages(start, end_ts, bucket, http=None):
+    """ Generator of consecutive forward fetch_matches results from start. """
+    fetch_start = start
+    while True:
+        bucket.acquire()
+        page = fetch_matches(fetch_start, http=http)
+        yield page
+        data_length, fetch_start, _, _ = page
+        if data_length < MAX_DOWNLOAD or (end_ts and fetch_start > end_ts):
+            break
+
+
+def fetch_and_save_pipelined(
+    start, end_ts, bucket=None, checkpoint=None, depth=PREFETCH_DEPTH
+):
+    """ Fetches forward from start, downloading the next page
+    while the current one is written to the database. """
+    script_start = datetime.now().timestamp()
+    print("Starting at {}".format(int(script_start)))
+    bucket = bucket or TokenBucket(REQUESTS_PER_SECOND)
+    for _, next_start, ranked, _ in prefetch(
+        fetched_pages(start, end_ts, bucket), depth
+    ):
+        save_matches(ranked, RANKED_DB)
+        if checkpoint:
+            checkpoint.save(next_start=next_start, end_ts=end_ts)
+        print("Saved through:", next_start)
+        if next_start != start:
+            print_time_left(script_start, start, next_start, end_ts)
+    if checkpoint:
+        checkpoint.clear()
     print("Ending at {}".format(datetime.now().strftime("%H:%M")))
 
 
@@ -331,8 +440,17 @@ def run():
     )
 
     parser.add_argument("--lw", action="store_true", help="Reload the last week")
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Fetch the next page while saving the current one (forward only)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Start from the last checkpoint",
+    )
     start_timestamp = None
     args = parser.parse_args()
+    checkpoint = Checkpoint(CHECKPOINT_FILE)
     if args.start:
         start_date = datetime.strptime(args.start, "%Y-%m-%d")
         start_timestamp = int(start_date.timestamp())
@@ -353,10 +471,22 @@ def run():
         if not start_timestamp:
             start_timestamp = end_timestamp - SEVEN_DAYS_OF_SECONDS - 36000
 
+    if args.resume:
+        saved = checkpoint.load()
+        if saved:
+            start_timestamp = saved["next_start"]
+            end_timestamp = end_timestamp or saved["end_ts"]
+            print("Resuming from", start_timestamp)
+
     if not start_timestamp:
         start_timestamp = last_match_time()
 
-    fetch_and_save(start_timestamp, end_timestamp)
+    if args.pipeline:
+        fetch_and_save_pipelined(
+            start_timestamp, end_timestamp, checkpoint=checkpoint
+        )
+    else:
+        fetch_and_save(start_timestamp, end_timestamp, checkpoint=checkpoint)
 
     if args.lw:
         print("CACHING RESULTS")
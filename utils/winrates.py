@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+""" Vectorized win rate statistics over (wins, games) counts. """
+from statistics import NormalDist
+
+import numpy as np
+
+
+def win_means(wins, games):
+    """ Returns wins / games for each pair; 0 where there are no games. """
+    wins = np.asarray(wins, dtype=float)
+    games = np.asarray(games, dtype=float)
+    means = np.zeros_like(wins)
+    np.divide(wins, games, out=means, where=games > 0)
+    return means
+
+
+def lower_bounds(wins, games, method="normal", alpha=0.05):
+    """ Returns the lower end of the confidence interval of each win rate.
+    method: "normal" (the statsmodels proportion_confint default) or "wilson" """
+    wins = np.asarray(wins, dtype=float)
+    games = np.asarray(games, dtype=float)
+    means = win_means(wins, games)
+    z_score = NormalDist().inv_cdf(1 - alpha / 2.0)
+    safe_games = np.where(games > 0, games, 1)
+    if method == "normal":
+        low = means - z_score * np.sqrt(means * (1 - means) / safe_games)
+    elif method == "wilson":
+        z_squared = z_score ** 2
+        denominator = 1 + z_squared / safe_games
+        center = (means + z_squared / (2 * safe_games)) / denominator
+        spread = (
+            z_score
+            * np.sqrt(
+                means * (1 - means) / safe_games + z_squared / (4 * safe_games ** 2)
+            )
+            / denominator
+        )
+        low = center - spread
+    else:
+        raise ValueError("Unknown method: {}".format(method))
+    return np.where(games > 0, np.clip(low, 0, 1), 0)